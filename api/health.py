@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Delay before a failed startup check is retried.
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 5))
+
+logger = logging.getLogger(__name__)
+
+health_router = APIRouter()
+
+
+class Readiness:
+    """
+    Tracks the startup checks (connections opened, models loaded) of this worker.
+
+    run() executes the checks concurrently and retries the failed ones every
+    WARMUP_RETRY_SECONDS, so a dependency that is down at startup does not need a restart.
+    The worker is ready once every check has passed.
+    """
+    _status: Dict[str, str] = {}
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return bool(cls._status) and all(status == "ok" for status in cls._status.values())
+
+    @classmethod
+    async def _run_check(cls, name: str, check: Callable[[], Awaitable]) -> None:
+        while True:
+            try:
+                await check()
+                cls._status[name] = "ok"
+                logger.info("Startup check %s passed.", name)
+                return
+            except Exception as e:
+                cls._status[name] = f"failed: {e}"
+                logger.warning("Startup check %s failed, retrying in %.1fs: %s", name, WARMUP_RETRY_SECONDS, e)
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+    @classmethod
+    async def run(cls, checks: Dict[str, Callable[[], Awaitable]]) -> None:
+        cls._status = {name: "pending" for name in checks}
+        await asyncio.gather(*(cls._run_check(name, check) for name, check in checks.items()))
+
+    @classmethod
+    def status(cls) -> Dict[str, str]:
+        return dict(cls._status)
+
+
+@health_router.get("/live")
+async def live():
+    # The process is up and serving requests (it may still be warming up).
+    return {"status": "ok"}
+
+
+@health_router.get("/ready")
+async def ready():
+    # Only ready once every connection pool is warm and every model is loaded.
+    status_code = 200 if Readiness.is_ready() else 503
+    return JSONResponse(status_code=status_code, content={"ready": status_code == 200, "checks": Readiness.status()})
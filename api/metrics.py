@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from utils.metrics import Metrics
+from utils.redis_client import RedisClient
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics")
+async def get_metrics():
+    # Counters, gauges and latency percentiles of this worker process.
+    RedisClient.report_pool_metrics()
+    return Metrics.snapshot()
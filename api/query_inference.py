@@ -1,7 +1,15 @@
 from fastapi import APIRouter,HTTPException
-import asyncio
+from fastapi.responses import StreamingResponse
 import datetime
+import json
+import logging
 import os
+import re
+import time
+import traceback
+import numpy as np
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Optional, AsyncIterator
 from dotenv import load_dotenv
 from models.query_model import QueryRequest, QueryResponse
 
@@ -11,13 +19,21 @@ from services.intent_classifier import IntentClassificationService
 from services.vector_search import VectorSearchService
 from services.reranker import Reranker
 from services.response_generator import ResponseGeneratorService
-from services.hallucination_checker import HallucinationCheckService
+from services.hallucination_checker import HallucinationCheckService, GROUNDING_STREAM_ABORT_SCORE
+from services.grounding_scorer import StreamingGrounding
+from services.response_repair import ResponseRepairService
+from services.context_packer import ContextPacker
 from services.query_embedding import EmbeddingClient
+from services.cache_service import CacheService
+from services.history_writer import HistoryWriter
+from utils.stage_graph import StageGraph, timed
 
 load_dotenv()
 
 query_inference_router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 
 LLM_VENDOR = os.getenv("LLM_VENDOR")
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
@@ -28,134 +44,368 @@ EMBEDDING_API_KEY = os.getenv("EMBEDDING_API_KEY")
 RERANKER_VENDOR = os.getenv("RERANKER_VENDOR")
 RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL_NAME")
 RERANKER_API_KEY = os.getenv("RERANKER_API_KEY")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 95.0))
+# Responses scoring below this in the hallucination check are repaired (and never cached).
+CONSISTENCY_THRESHOLD = float(os.getenv("CONSISTENCY_THRESHOLD", 90.0))
 
 # Instantiate our service objects.
 query_reformulation_service = QueryReformulationService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY)
-intent_classification_service = IntentClassificationService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY)
 vector_search_service = VectorSearchService()  
 reranker = Reranker(RERANKER_VENDOR, RERANKER_API_KEY, RERANKER_MODEL_NAME)
 response_generator_service = ResponseGeneratorService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY)
-hallucination_check_service = HallucinationCheckService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY)
-embedding_client = EmbeddingClient(EMBEDDING_VENDOR, EMBEDDING_MODEL_NAME, EMBEDDING_API_KEY)
+embedding_client = EmbeddingClient(EMBEDDING_VENDOR, EMBEDDING_API_KEY, EMBEDDING_MODEL_NAME)
+hallucination_check_service = HallucinationCheckService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY, embedding_client)
+intent_classification_service = IntentClassificationService(LLM_VENDOR, LLM_MODEL_NAME, LLM_API_KEY, embedding_client)
+response_repair_service = ResponseRepairService(response_generator_service, hallucination_check_service)
+context_packer = ContextPacker(LLM_MODEL_NAME)
+cache_service = CacheService()
+history_writer = HistoryWriter()
 
 
-@query_inference_router.post("/infer", response_model=QueryResponse)
-async def infer(request: QueryRequest):
-    # Step 1: Retrieve session history from MongoDB.
-    session = await SessionService.get_session_by_id(request.session_id)
-    print("got the session")
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Extract the last 3 interactions as short-term memory.
-    history = session.get("history", [])
-    short_term_memory = [
+@dataclass
+class RetrievalResult:
+    """
+    Outcome of the steps shared by /infer and /infer/stream (session lookup up to reranking).
+
+    When `response` is set the pipeline short-circuited (greeting, non-domain, cache hit,
+    no relevant documents), the interaction is already queued for the history and nothing is left to generate.
+    """
+    reformulated_query: str
+    query_embedding: Optional[np.ndarray] = None
+    top_documents: List[Dict] = field(default_factory=list)
+    response: Optional[str] = None
+    # Duration of each pipeline stage in milliseconds.
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Token counts of the packed generation context (see PackingStats).
+    context_tokens: Dict[str, int] = field(default_factory=dict)
+
+
+def save_interaction(request: QueryRequest, reformulated_query: str, response: str) -> None:
+    """
+    Queues the interaction for the session history (written behind, off the response path).
+    """
+    new_history_entry = {
+        "query": request.query,
+        "reformulated_query": reformulated_query,
+        "response": response,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+    }
+    history_writer.append(request.session_id, new_history_entry)
+
+
+def format_sources(top_documents: List[Dict]) -> List[Dict]:
+    """
+    Extracts the citation metadata of the documents used to generate a response.
+    """
+    return [
+        {
+            "document_name": doc.get("document_name", "N/A"),
+            "page_number": doc.get("page_number", "N/A"),
+            "file_link": doc.get("file_link", "N/A")
+        } for doc in top_documents
+    ]
+
+
+async def cache_response(request: QueryRequest, retrieval: RetrievalResult, response: str) -> None:
+    """
+    Stores a response that passed the hallucination check in the semantic cache (best effort).
+    """
+    document_id = ",".join(sorted({str(doc.get("document_name")) for doc in retrieval.top_documents if doc.get("document_name")}))
+    try:
+        await cache_service.insert_cache(
+            request.user_id, request.group_id, retrieval.reformulated_query, response,
+            format_sources(retrieval.top_documents), retrieval.query_embedding, document_id,
+        )
+    except Exception:
+        traceback.print_exc()
+
+
+async def lookup_cache(group_id: str, query_embedding: np.ndarray) -> List:
+    """
+    Semantic cache lookup. The cache is best effort, a failing lookup is treated as a miss.
+    """
+    try:
+        return await cache_service.get_similar_cache_entries(group_id, query_embedding, threshold=SEMANTIC_CACHE_THRESHOLD)
+    except Exception:
+        traceback.print_exc()
+        return []
+
+
+def short_term_memory_from(session: Dict) -> List[str]:
+    """
+    Extracts the last 3 interactions of the session as short-term memory.
+    """
+    history = session.get("recent_history", [])
+    return [
     f"Query: {interaction.get('reformulated_query', '')} | Response: {interaction.get('response', '')}"
     for interaction in history[-3:]
     ]
-    print("got the short term memory")
-    
+
+
+async def retrieve(request: QueryRequest) -> RetrievalResult:
+    """
+    Runs the pipeline up to the point where a response has to be generated.
+    Raises a 404 if the session does not exist.
+
+    Independent stages run concurrently through a StageGraph:
+      - intent classification reuses the embedding of the reformulated query (local classifier,
+        with an LLM fallback when it is not confident);
+      - semantic cache lookup and vector search start speculatively alongside it, and are
+        cancelled if the query is a greeting or non-domain.
+    """
+    async def reformulate(session):
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return await query_reformulation_service.reformulate_query(request.query, short_term_memory_from(session))
+
+    graph = StageGraph()
+    # Step 1: Retrieve the session summary (owner and last turns), cached in-process and in Redis.
+    graph.add("session", lambda: SessionService.get_session_summary(request.session_id))
     # Step 2: Query Reformulation.
-    reformulated_query = await query_reformulation_service.reformulate_query(request.query, short_term_memory)
-    print("got the reformulated query : ", reformulated_query)
-    
-    # Step 3: Intent Classification.
-    intent = await intent_classification_service.classify_intent(reformulated_query)
-    print("got the intent : ", intent)
-    if intent.lower() == "non-domain":
-        generated_response = "Sorry, I'm a bot specialized in banking and global payments."
-        new_history_entry = {
-        "query": request.query,
-        "reformulated_query": reformulated_query,
-        "response": generated_response,
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        }
-        await SessionService.update_session_history(request.session_id, new_history_entry)
-        return QueryResponse(response=generated_response)
-    elif intent.lower() == "greeting":
-        generated_response = "Hello and welcome to GPN chatbot!"
-        new_history_entry = {
-        "query": request.query,
-        "reformulated_query": reformulated_query,
-        "response": generated_response,
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        }
-        await SessionService.update_session_history(request.session_id, new_history_entry)
-        return QueryResponse(response=generated_response)
+    graph.add("reformulate", reformulate, deps=["session"])
+    # Step 3: Generate query embeddings (batched with concurrent requests and cached).
+    graph.add("embed", embedding_client.agenerate_embedding, deps=["reformulate"])
+    # Step 4: Intent Classification of the reformulated query, from its embedding when the local classifier is confident.
+    graph.add("intent", lambda query, embedding: intent_classification_service.classify_intent(query, query_embedding=embedding), deps=["reformulate", "embed"])
+    # Step 5: Semantic cache lookup: reuse the answer to a near-identical query from the same group.
+    graph.add("cache", lambda embedding: lookup_cache(request.group_id, embedding), deps=["embed"])
+    # Step 6: Vector Search: retrieve top 10 candidate documents.
+    # (Assumes authorization filter is the group_id.)
+    graph.add("search", lambda embedding: vector_search_service.search(embedding, request.group_id, limit=10), deps=["embed"])
+    graph.start()
+    try:
+        session = await graph.result("session")
+        print("got the session")
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        reformulated_query = await graph.result("reformulate")
+        print("got the reformulated query : ", reformulated_query)
+        
+        intent = await graph.result("intent")
+        print("got the intent : ", intent)
+        if intent.lower() == "non-domain":
+            graph.cancel("cache", "search")
+            generated_response = "Sorry, I'm a bot specialized in banking and global payments."
+            save_interaction(request, reformulated_query, generated_response)
+            return RetrievalResult(reformulated_query, response=generated_response, timings=graph.timings)
+        elif intent.lower() == "greeting":
+            graph.cancel("cache", "search")
+            generated_response = "Hello and welcome to GPN chatbot!"
+            save_interaction(request, reformulated_query, generated_response)
+            return RetrievalResult(reformulated_query, response=generated_response, timings=graph.timings)
+        
+        query_embedding = await graph.result("embed")
+        print("got the query embedding")
+        
+        cache_hits = await graph.result("cache")
+        if cache_hits:
+            graph.cancel("search")
+            cached_entry, similarity = cache_hits[0]
+            print("semantic cache hit, similarity : ", similarity)
+            generated_response = cached_entry["response"]
+            save_interaction(request, reformulated_query, generated_response)
+            return RetrievalResult(reformulated_query, query_embedding, response=generated_response, timings=graph.timings)
+        
+        vector_results, _ = await graph.result("search")
+        print("got the vector results")
+        if not vector_results:
+            generated_response = "Sorry, I could not find relevant documents."
+            save_interaction(request, reformulated_query, generated_response)
+            return RetrievalResult(reformulated_query, query_embedding, response=generated_response, timings=graph.timings)
+        
+        # Step 7: Extract content strings from retrieved documents while keeping full metadata.
+        documents = vector_results  # Each result is a dict with keys: content, document_name, page_number, file_link, etc.
+        content_list = [doc.get("content", "") for doc in documents]
+        
+        # Step 8: Reranking: rank candidate documents using the reformulated query.
+        # Falls back to the vector search order if the reranker times out.
+        vector_scores = [doc.get("score", 0.0) for doc in documents]
+        rerank_results = await graph.run_stage("rerank", reranker.rerank(reformulated_query, content_list, top_n=10, fallback_scores=vector_scores))
+        print("rerank results : \n", rerank_results)
+        # Filter for top 3 documents with a relevance score of at least 40%. The cutoff is on the
+        # reranker's scale, so a fallback ranking keeps its top 3 in vector search order.
+        top_indices = [res["index"] for res in rerank_results if res.get("fallback") or res["relevance_score"] >= 0.4][:3]
+        print("got the top indices")
+        print("top indices : \n", top_indices)
+        if not top_indices:
+            generated_response = "Sorry, I couldn't find a sufficiently relevant answer."
+            save_interaction(request, reformulated_query, generated_response)
+            return RetrievalResult(reformulated_query, query_embedding, response=generated_response, timings=graph.timings)
+        
+        # Map indices back to the full document metadata.
+        top_documents = [documents[i] for i in top_indices]
+        # Fit the documents into the prompt token budget (merged per page, trimmed to the relevant sentences).
+        # The tokenizer is normally loaded at startup; if not, it is loaded off the event loop.
+        await context_packer.warmup()
+        top_documents, packing = context_packer.pack(reformulated_query, top_documents)
+        context_tokens = asdict(packing)
+        logger.info("context_tokens %s", json.dumps({"session_id": request.session_id, **context_tokens}))
+        print("got the top documents")
+        print("top documents : \n", top_documents)
+        return RetrievalResult(reformulated_query, query_embedding, top_documents, timings=graph.timings, context_tokens=context_tokens)
+    finally:
+        graph.cancel_all()
+
+
+@query_inference_router.post("/infer", response_model=QueryResponse)
+async def infer(request: QueryRequest):
+    retrieval = await retrieve(request)
+    if retrieval.response is not None:
+        print("stage timings (ms) : ", retrieval.timings)
+        return QueryResponse(response=retrieval.response)
+    reformulated_query = retrieval.reformulated_query
+    top_documents = retrieval.top_documents
+    timings = retrieval.timings
     
-    # Step 4: Generate query embeddings (wrap the synchronous call in a thread).
-    query_embedding = await asyncio.to_thread(embedding_client.generate_embedding, reformulated_query)
-    print("got the query embedding")
+    # Step 9: Generate the final response using the top documents. With a local grounding scorer,
+    # each sentence is checked as soon as it is generated and a poorly grounded answer is abandoned early.
+    doc_texts = [doc.get("content", "") for doc in top_documents]
+    # Built once and reused by the generation, a regeneration and the repair prompts.
+    doc_context = response_generator_service.document_context(top_documents)
+    check = hallucination_check_service.start_streaming_check(doc_texts, abort_below=GROUNDING_STREAM_ABORT_SCORE)
+    if check is None:
+        generated_response = await timed(timings, "generate", response_generator_service.generate_response(reformulated_query, top_documents, doc_context=doc_context))
+    else:
+        generated_response = await timed(timings, "generate", generate_checked(reformulated_query, top_documents, check, doc_context))
+    print("got the generated response")
+    print("generated response : \n", generated_response)
     
-    # Step 5: Vector Search: retrieve top 20 candidate documents.
-    # (Assumes authorization filter is the group_id.)
-    vector_results, _ = await vector_search_service.search(query_embedding, request.group_id, limit=10)
-    print("got the vector results")
-    if not vector_results:
-        generated_response = "Sorry, I could not find relevant documents."
-        new_history_entry = {
-        "query": request.query,
-        "reformulated_query": reformulated_query,
-        "response": generated_response,
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        }
-        await SessionService.update_session_history(request.session_id, new_history_entry)
-        return QueryResponse(response=generated_response)
+    # Step 10: Hallucination Check: ensure factual consistency of the generated response.
+    if check is None:
+        consistency_score = await timed(timings, "hallucination_check", hallucination_check_service.check_hallucination(reformulated_query, generated_response, doc_texts))
+    elif check.aborted:
+        check.close()
+        consistency_score = check.score
+        print("generation aborted by the grounding check")
+    else:
+        consistency_score = await timed(timings, "hallucination_check", hallucination_check_service.finish_streaming_check(check, reformulated_query, generated_response, doc_texts))
+    print("consistency score : ", consistency_score)
+    if consistency_score < CONSISTENCY_THRESHOLD:
+        if check is not None and check.aborted:
+            # The abandoned response is incomplete, so it is generated again in full.
+            generated_response = await timed(timings, "regenerate", response_generator_service.generate_response(reformulated_query, top_documents, doc_context=doc_context))
+        else:
+            # Rewrite or remove only the unsupported sentences.
+            sentence_scores = check.sentence_scores if check is not None else []
+            generated_response, repaired_score = await timed(timings, "repair", response_repair_service.repair(
+                reformulated_query, top_documents, generated_response, sentence_scores, CONSISTENCY_THRESHOLD, doc_context))
+            print("repaired consistency score : ", repaired_score)
+            if repaired_score is not None and repaired_score >= CONSISTENCY_THRESHOLD:
+                await cache_response(request, retrieval, generated_response)
+    else:
+        # Only answers that passed the hallucination check are cached.
+        await cache_response(request, retrieval, generated_response)
     
-    # Step 6: Extract content strings from retrieved documents while keeping full metadata.
-    documents = vector_results  # Each result is a dict with keys: content, document_name, page_number, file_link, etc.
-    content_list = [doc.get("content", "") for doc in documents]
+    # Step 11: Update session history with the new interaction.
+    save_interaction(request, reformulated_query, generated_response)
+    print("stage timings (ms) : ", timings)
     
-    # Step 7: Reranking: rank candidate documents using the reformulated query.
-    rerank_results = reranker.rerank(reformulated_query, content_list, top_n=10)
-    print("rerank results : \n", rerank_results)
-    # Filter for top 3 documents with a relevance score of at least 50%.
-    top_indices = [res["index"] for res in rerank_results if res["relevance_score"] >= 0.4][:3]
-    print("got the top indices")
-    print("top indices : \n", top_indices)
-    if not top_indices:
-        generated_response = "Sorry, I couldn't find a sufficiently relevant answer."
-        new_history_entry = {
-        "query": request.query,
-        "reformulated_query": reformulated_query,
-        "response": generated_response,
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        }
-        await SessionService.update_session_history(request.session_id, new_history_entry)
-        return QueryResponse(response=generated_response)
+    return QueryResponse(response=generated_response)
+
+
+async def generate_checked(reformulated_query: str, top_documents: List[Dict], check: StreamingGrounding, doc_context: Optional[str] = None) -> str:
+    """
+    Generates the response while the streaming grounding check scores it, and stops the
+    generation as soon as the check aborts. Returns the text generated so far; check.aborted
+    is only left set if the generation was actually stopped.
+    """
+    chunks = []
+    stream = response_generator_service.stream_response(reformulated_query, top_documents, doc_context=doc_context)
+    try:
+        async for token in stream:
+            chunks.append(token)
+            check.feed(token)
+            if check.aborted:
+                break
+        else:
+            # The answer is complete, so a low score leads to a repair rather than a regeneration.
+            check.end_generation()
+    except BaseException:
+        check.close()
+        raise
+    finally:
+        await stream.aclose()
+    return "".join(chunks)
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Formats a Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(request: QueryRequest, retrieval: RetrievalResult) -> AsyncIterator[str]:
+    """
+    Yields the answer as 'token' events while it is generated, followed by the trailing
+    'citations' and 'consistency' events and a final 'done' event. If the pipeline fails
+    midway, an 'error' event is sent before the 'done' event.
+    """
+    if retrieval.response is not None:
+        yield sse_event("token", {"text": retrieval.response})
+        yield sse_event("done", {})
+        return
+    reformulated_query = retrieval.reformulated_query
+    top_documents = retrieval.top_documents
     
-    # Map indices back to the full document metadata.
-    top_documents = [documents[i] for i in top_indices]
-    print("got the top documents")
-    print("top documents : \n", top_documents)
+    timings = retrieval.timings
     
-    # Step 8: Generate the final response using the top documents.
-    generated_response = await response_generator_service.generate_response(reformulated_query, top_documents)
-    print("got the generated response")
-    print("generated response : \n", generated_response)
+    check = None
+    try:
+        # Step 9: Stream the response tokens as they are generated, scoring each sentence as it completes.
+        doc_texts = [doc.get("content", "") for doc in top_documents]
+        check = hallucination_check_service.start_streaming_check(doc_texts)
+        start_time = time.perf_counter()
+        chunks = []
+        async for token in response_generator_service.stream_response(reformulated_query, top_documents):
+            if not chunks:
+                timings["first_token"] = (time.perf_counter() - start_time) * 1000
+            chunks.append(token)
+            if check is not None:
+                check.feed(token)
+            yield sse_event("token", {"text": token})
+        timings["generate"] = (time.perf_counter() - start_time) * 1000
+        generated_response = "".join(chunks)
     
-    # Step 9: Hallucination Check: ensure factual consistency of the generated response.
-    doc_texts = [doc.get("content", "") for doc in top_documents]
-    consistency_score = await hallucination_check_service.check_hallucination(reformulated_query, generated_response, doc_texts)
-    print("consistency score : ", consistency_score)
-    if consistency_score < 90:
-        # Regenerate response if factual consistency is low.
-        generated_response = await response_generator_service.generate_response(reformulated_query, top_documents)
+        # Citations actually used in the answer ([1], [2], ...) mapped back to their documents.
+        sources = format_sources(top_documents)
+        cited = sorted({int(n) for n in re.findall(r"\[(\d+)\]", generated_response) if 1 <= int(n) <= len(sources)})
+        yield sse_event("citations", [{"index": n, **sources[n - 1]} for n in cited])
     
-    # Step 10: Update session history with the new interaction.
-    new_history_entry = {
-        "query": request.query,
-        "reformulated_query": reformulated_query,
-        "response": generated_response,
-        "timestamp": datetime.datetime.utcnow().isoformat(),
-        # "sources": [
-        #     {
-        #         "document_name": doc.get("document_name", "N/A"),
-        #         "page_number": doc.get("page_number", "N/A"),
-        #         "file_link": doc.get("file_link", "N/A")
-        #     } for doc in top_documents
-        # ]
-    }
-    await SessionService.update_session_history(request.session_id, new_history_entry)
+        # Step 10: Hallucination Check. The answer has already been sent, so the verdict is reported
+        # to the client instead of triggering a regeneration.
+        if check is None:
+            consistency_score = await timed(timings, "hallucination_check", hallucination_check_service.check_hallucination(reformulated_query, generated_response, doc_texts))
+        else:
+            consistency_score = await timed(timings, "hallucination_check", hallucination_check_service.finish_streaming_check(check, reformulated_query, generated_response, doc_texts))
+        print("consistency score : ", consistency_score)
+        yield sse_event("consistency", {"score": consistency_score, "consistent": consistency_score >= CONSISTENCY_THRESHOLD})
+        if consistency_score >= CONSISTENCY_THRESHOLD:
+            await cache_response(request, retrieval, generated_response)
     
-    return QueryResponse(response=generated_response)
\ No newline at end of file
+        # Step 11: Update session history with the new interaction.
+        save_interaction(request, reformulated_query, generated_response)
+        print("stage timings (ms) : ", timings)
+        yield sse_event("done", {})
+    except Exception:
+        # The response headers are already sent, so a failure (e.g. the LLM stream breaking off)
+        # is reported as an 'error' event. Cancellation and client disconnects still propagate.
+        traceback.print_exc()
+        yield sse_event("error", {"detail": "The answer could not be completed."})
+        yield sse_event("done", {})
+    finally:
+        # Also reached when the client disconnects, at any yield.
+        if check is not None:
+            check.close()
+
+
+@query_inference_router.post("/infer/stream")
+async def infer_stream(request: QueryRequest):
+    # Retrieval runs before the stream opens so a missing session still returns a plain 404.
+    retrieval = await retrieve(request)
+    return StreamingResponse(
+        stream_events(request, retrieval),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
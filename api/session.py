@@ -1,7 +1,7 @@
-from fastapi import APIRouter,HTTPException
-import datetime
+from fastapi import APIRouter,HTTPException,Query
+from typing import Optional
 from models.sessions_model import CreateSessionRequest, CreateSessionResponse, GetSessionsResponse, Session, HistoryResponse
-from services.session_service import SessionService
+from services.session_service import SessionService, InvalidCursorError
 
 sessions_router = APIRouter()
 
@@ -13,16 +13,14 @@ async def create_session(request: CreateSessionRequest):
 
 
 @sessions_router.get("/get_all_sessions/{user_id}", response_model=GetSessionsResponse)
-async def get_sessions(user_id: int):
-    sessions = await SessionService.get_sessions_for_user(user_id)
-    # Sort sessions by updated_at (latest first)
-    sorted_sessions = sorted(
-        sessions,
-        key=lambda s: s.get("updated_at", datetime.datetime.min),
-        reverse=True,
-    )
+async def get_sessions(user_id: int, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None):
+    # Sessions come back sorted by updated_at (latest first); pass next_cursor for the next page.
+    try:
+        sessions, next_cursor = await SessionService.get_sessions_for_user(user_id, limit, cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     formatted_sessions = []
-    for s in sorted_sessions:
+    for s in sessions:
         formatted_sessions.append(
             Session(
                 id=str(s["_id"]),
@@ -31,11 +29,15 @@ async def get_sessions(user_id: int):
                 updated_at=s["updated_at"],
             )
         )
-    return GetSessionsResponse(sessions=formatted_sessions)
+    return GetSessionsResponse(sessions=formatted_sessions, next_cursor=next_cursor)
 
 @sessions_router.get("/get_session/{session_id}", response_model=HistoryResponse)
-async def get_session_history(session_id: str):
-    session = await SessionService.get_session_by_id(session_id)
-    if not session:
+async def get_session_history(session_id: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    # Pages go backwards from the newest entry; pass next_cursor to fetch older entries.
+    if not await SessionService.session_exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
-    return HistoryResponse(history=session.get("history", []))
+    try:
+        history, next_cursor = await SessionService.get_history_page(session_id, limit, cursor)
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return HistoryResponse(history=history, next_cursor=next_cursor)
@@ -0,0 +1,100 @@
+"""
+Benchmarks the pgvector store against MongoDB Atlas vector search on our corpus.
+
+Usage:
+    python benchmark_vector_search.py --queries queries.txt --group <group_id> [--sync] [--runs 5] [--ef-search 40 100 200]
+
+  --queries    Text file with one query per line.
+  --sync       First copy the chunk collection (VECTOR_SEARCH_COLLECTION) into the pgvector table.
+
+For every query, reports latency percentiles per backend and the overlap of the pgvector
+top-k with the Atlas top-k (by document name and page).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+from dotenv import load_dotenv
+from services.query_embedding import EmbeddingClient
+from services.vector_search import AtlasVectorStore
+from services.pgvector_store import PgVectorStore
+from utils.mongodb_client import MongoDBClient
+
+load_dotenv()
+
+
+async def sync_chunks(store: PgVectorStore, batch_size: int = 500) -> None:
+    collection = await MongoDBClient.get_collection(os.getenv("VECTOR_SEARCH_COLLECTION"))
+    embedding_path = os.getenv("VECTOR_SEARCH_PATH")
+    filter_field = os.getenv("VECTOR_SEARCH_FILTER_FIELD")
+    batch, total, schema_ready = [], 0, False
+    async for doc in collection.find({}):
+        groups = doc.get(filter_field)
+        # The Atlas filter matches a group inside a list, pgvector stores one row per group.
+        for group in (groups if isinstance(groups, list) else [groups]):
+            chunk = {key: doc.get(key) for key in ["content", "document_name", "document_url", "document_type", "page_number", "file_link"]}
+            chunk["group_id"] = str(group)
+            chunk["embedding"] = doc[embedding_path]
+            batch.append(chunk)
+        if not schema_ready:
+            await store.ensure_schema(len(doc[embedding_path]))
+            schema_ready = True
+        if len(batch) >= batch_size:
+            await store.insert_chunks(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        await store.insert_chunks(batch)
+        total += len(batch)
+    print(f"Copied {total} rows into {store.table}")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", required=True)
+    parser.add_argument("--group", required=True)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[100])
+    parser.add_argument("--sync", action="store_true")
+    args = parser.parse_args()
+
+    atlas, pgvector = AtlasVectorStore(), PgVectorStore()
+    if args.sync:
+        await sync_chunks(pgvector)
+
+    embedding_client = EmbeddingClient(os.getenv("EMBEDDING_VENDOR"), os.getenv("EMBEDDING_API_KEY"), os.getenv("EMBEDDING_MODEL_NAME"))
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    embeddings = await embedding_client.agenerate_embeddings(queries)
+
+    def keys(results):
+        return {(doc.get("document_name"), doc.get("page_number")) for doc in results}
+
+    atlas_latencies, atlas_results = [], []
+    for embedding in embeddings:
+        for _ in range(args.runs):
+            results, duration_ms = await atlas.search(embedding, args.group, args.limit)
+            atlas_latencies.append(duration_ms)
+        atlas_results.append(keys(results))
+    print(f"atlas              p50={statistics.median(atlas_latencies):7.1f}ms  p95={percentile(atlas_latencies, 0.95):7.1f}ms")
+
+    for ef_search in args.ef_search:
+        latencies, overlaps = [], []
+        for embedding, expected in zip(embeddings, atlas_results):
+            for _ in range(args.runs):
+                results, duration_ms = await pgvector.search(embedding, args.group, args.limit, ef_search=ef_search)
+                latencies.append(duration_ms)
+            if expected:
+                overlaps.append(len(keys(results) & expected) / len(expected))
+        overlap = statistics.mean(overlaps) if overlaps else float("nan")
+        print(f"pgvector ef={ef_search:<5} p50={statistics.median(latencies):7.1f}ms  p95={percentile(latencies, 0.95):7.1f}ms  overlap@{args.limit}={overlap:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
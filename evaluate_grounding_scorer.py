@@ -0,0 +1,93 @@
+"""
+Compares the local grounding scorer with the LLM hallucination judge on recorded answers.
+
+Usage:
+    python evaluate_grounding_scorer.py --samples samples.jsonl [--backends nli embedding] [--bands 50:95 60:90] [--threshold 90]
+
+  --samples    JSONL file, one answer per line: {"query": ..., "response": ..., "context": [chunk, ...]}.
+               An optional "llm_score" field is used as the reference instead of calling the LLM judge.
+  --bands      Local scores inside [low, high) are sent to the LLM judge (GROUNDING_LLM_BAND_LOW/HIGH).
+
+For each backend, reports the correlation of the local and LLM scores, the agreement of their
+pass/fail verdicts at the threshold used by /infer, the local latency, and for each band the share
+of answers that still need the LLM judge and the end-to-end verdict agreement.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import numpy as np
+from dotenv import load_dotenv
+from services.grounding_scorer import GroundingScorer
+from services.hallucination_checker import HallucinationCheckService
+from services.query_embedding import EmbeddingClient
+
+load_dotenv()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def spearman(a, b):
+    ranks_a, ranks_b = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", required=True)
+    parser.add_argument("--backends", nargs="*", default=["nli", "embedding"])
+    parser.add_argument("--bands", nargs="*", default=["50:95"])
+    parser.add_argument("--threshold", type=float, default=90)
+    args = parser.parse_args()
+
+    with open(args.samples) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    judge = HallucinationCheckService(os.getenv("LLM_VENDOR"), os.getenv("LLM_MODEL_NAME"), os.getenv("LLM_API_KEY"))
+    missing = [sample for sample in samples if "llm_score" not in sample]
+    scores = await asyncio.gather(*(judge.judge_hallucination(s["query"], s["response"], s["context"]) for s in missing))
+    for sample, score in zip(missing, scores):
+        sample["llm_score"] = score
+    llm_scores = np.array([sample["llm_score"] for sample in samples], dtype=float)
+    llm_pass = llm_scores >= args.threshold
+    print(f"{len(samples)} samples, LLM pass rate {llm_pass.mean():.2f}")
+
+    embedding_client = EmbeddingClient(os.getenv("EMBEDDING_VENDOR"), os.getenv("EMBEDDING_API_KEY"), os.getenv("EMBEDDING_MODEL_NAME"))
+    for backend in args.backends:
+        scorer = GroundingScorer(backend, embedding_client)
+        await scorer.warmup()
+        local_scores, latencies = [], []
+        for sample in samples:
+            start_time = time.perf_counter()
+            score, _ = await scorer.score(sample["response"], sample["context"])
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            local_scores.append(score)
+        local_scores = np.array(local_scores)
+        local_pass = local_scores >= args.threshold
+        print(
+            f"{backend:<10} pearson={np.corrcoef(local_scores, llm_scores)[0, 1]:.3f}  spearman={spearman(local_scores, llm_scores):.3f}  "
+            f"verdict_agreement={(local_pass == llm_pass).mean():.3f}  "
+            f"p50={statistics.median(latencies):.1f}ms  p95={percentile(latencies, 0.95):.1f}ms"
+        )
+        for band in args.bands:
+            low, high = (float(bound) for bound in band.split(":"))
+            borderline = (local_scores >= low) & (local_scores < high)
+            # Borderline answers get the LLM verdict, the others keep the local one.
+            final_pass = np.where(borderline, llm_pass, local_pass)
+            false_pass = (final_pass & ~llm_pass).sum()
+            false_fail = (~final_pass & llm_pass).sum()
+            print(
+                f"    band [{low:g}, {high:g})  llm_calls={borderline.mean():.2f}  "
+                f"verdict_agreement={(final_pass == llm_pass).mean():.3f}  false_pass={false_pass}  false_fail={false_fail}"
+            )
+
+    embedding_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Evaluates the local intent classifier against the LLM labels on a set of queries.
+
+Usage:
+    python evaluate_intent_classifier.py --queries queries.txt [--exemplars exemplars.json] [--min-similarity 0.4 0.5] [--margins 0.04 0.08 0.12]
+
+  --queries    Text file with one query per line (ideally sampled from production traffic).
+  --exemplars  JSON file of labeled exemplars, defaults to INTENT_EXEMPLARS_PATH or the built-in set.
+
+Every query is labeled by the LLM classifier, which is taken as the reference. For each threshold
+pair, reports the share of queries the local classifier answers on its own (coverage), its accuracy
+on those, the end-to-end accuracy with the LLM fallback, and the local classification latency.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from collections import Counter
+from dotenv import load_dotenv
+from services.intent_classifier import IntentClassificationService
+from services.local_intent_classifier import LocalIntentClassifier, load_exemplars
+from services.query_embedding import EmbeddingClient
+
+load_dotenv()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", required=True)
+    parser.add_argument("--exemplars", default=os.getenv("INTENT_EXEMPLARS_PATH"))
+    parser.add_argument("--min-similarity", type=float, nargs="*", default=[0.5])
+    parser.add_argument("--margins", type=float, nargs="*", default=[0.08])
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    # Without an embedding client the service always asks the LLM.
+    llm_classifier = IntentClassificationService(os.getenv("LLM_VENDOR"), os.getenv("LLM_MODEL_NAME"), os.getenv("LLM_API_KEY"))
+    reference = [label.strip().lower() for label in await asyncio.gather(*(llm_classifier.classify_intent(query) for query in queries))]
+    print("LLM labels:", dict(Counter(reference)))
+
+    embedding_client = EmbeddingClient(os.getenv("EMBEDDING_VENDOR"), os.getenv("EMBEDDING_API_KEY"), os.getenv("EMBEDDING_MODEL_NAME"))
+    embeddings = await embedding_client.agenerate_embeddings(queries)
+    exemplars = load_exemplars(args.exemplars)
+
+    for min_similarity in args.min_similarity:
+        for margin in args.margins:
+            classifier = LocalIntentClassifier(embedding_client, exemplars, min_similarity=min_similarity, min_margin=margin)
+            await classifier.fit()
+            latencies, confusion = [], Counter()
+            confident_count = confident_correct = overall_correct = 0
+            for embedding, expected in zip(embeddings, reference):
+                start_time = time.perf_counter()
+                label, confident = await classifier.classify(embedding)
+                latencies.append((time.perf_counter() - start_time) * 1000)
+                if confident:
+                    confident_count += 1
+                    confident_correct += label == expected
+                    overall_correct += label == expected
+                    confusion[(expected, label)] += 1
+                else:
+                    # Not confident: the pipeline falls back to the LLM, which matches the reference.
+                    overall_correct += 1
+            coverage = confident_count / len(queries)
+            local_accuracy = confident_correct / confident_count if confident_count else float("nan")
+            print(
+                f"min_similarity={min_similarity:.2f} margin={margin:.2f}  coverage={coverage:.2f}  "
+                f"local_accuracy={local_accuracy:.3f}  overall_accuracy={overall_correct / len(queries):.3f}  "
+                f"p50={statistics.median(latencies):.2f}ms  p95={percentile(latencies, 0.95):.2f}ms"
+            )
+            for (expected, label), count in sorted(confusion.items()):
+                if expected != label:
+                    print(f"    {expected} -> {label}: {count}")
+
+    embedding_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,42 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from api.query_inference import query_inference_router
+from api.query_inference import query_inference_router, history_writer, embedding_client, reranker, vector_search_service, intent_classification_service, hallucination_check_service, context_packer
 from api.session import sessions_router
-app = FastAPI()
+from api.metrics import metrics_router
+from api.health import health_router, Readiness
+from utils.mongodb_client import MongoDBClient
+from utils.redis_client import RedisClient
+from utils.llm_registry import LLMRegistry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /health/live answers right away; /health/ready turns
+    # green once every check below has passed.
+    warmup = asyncio.create_task(Readiness.run({
+        "mongodb": MongoDBClient.warmup,
+        "redis": RedisClient.warmup,
+        "vector_store": vector_search_service.warmup,
+        "embedding_model": embedding_client.warmup,
+        "reranker_model": reranker.warmup,
+        "intent_exemplars": intent_classification_service.warmup,
+        "grounding_model": hallucination_check_service.warmup,
+        "tokenizer": context_packer.warmup,
+    }))
+    yield
+    warmup.cancel()
+    # Write the session history entries that are still queued before the worker exits.
+    await history_writer.close()
+    await vector_search_service.close()
+    await RedisClient.close_connection()
+    await MongoDBClient.close_connection()
+    await asyncio.to_thread(embedding_client.close)
+    await LLMRegistry.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(query_inference_router,prefix="/query")
-app.include_router(sessions_router,prefix="/sessions")
\ No newline at end of file
+app.include_router(sessions_router,prefix="/sessions")
+app.include_router(metrics_router)
+app.include_router(health_router,prefix="/health")
@@ -22,6 +22,8 @@ class Session(BaseModel):
 
 class GetSessionsResponse(BaseModel):
     sessions: List[Session]
+    next_cursor: Optional[str] = None
 
 class HistoryResponse(BaseModel):
-    history: List[Any]
\ No newline at end of file
+    history: List[Any]
+    next_cursor: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import List, Dict, Tuple
+import numpy as np
+import redis
+from redis.commands.search.field import TagField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from services.similarity_engine import SimilarityEngine
+from utils.redis_client import RedisClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "cache"
+CACHE_INDEX_NAME = os.getenv("CACHE_INDEX_NAME", "idx:semantic_cache")
+CACHE_HNSW_M = int(os.getenv("CACHE_HNSW_M", 16))
+CACHE_HNSW_EF_CONSTRUCTION = int(os.getenv("CACHE_HNSW_EF_CONSTRUCTION", 200))
+CACHE_HNSW_EF_RUNTIME = int(os.getenv("CACHE_HNSW_EF_RUNTIME", 10))
+
+# Fields returned from a cache hit (the embedding itself is never read back).
+RETURN_FIELDS = ["user_id", "user_group", "query", "response", "sources", "document_id", "distance"]
+
+
+def group_key_prefix(user_group: str) -> str:
+    """
+    Returns the key prefix of a user group's cache entries, 'cache:{hash}:'.
+
+    The group id is hashed so that no group id (e.g. one containing ':') can produce a
+    prefix that also matches the keys of another group.
+    """
+    return f"{CACHE_KEY_PREFIX}:{_group_hash(user_group)}:"
+
+
+def _group_hash(user_group: str) -> str:
+    return hashlib.sha256(user_group.encode("utf-8")).hexdigest()
+
+
+def _escape_tag(value: str) -> str:
+    """
+    Escapes punctuation and whitespace so the value can be used inside a RediSearch tag query.
+    """
+    return re.sub(r"([^A-Za-z0-9_])", r"\\\1", value)
+
+
+def _to_float32(embedding) -> np.ndarray:
+    """
+    Converts an embedding (list or array) to a contiguous float32 vector.
+    """
+    return np.ascontiguousarray(embedding, dtype=np.float32)
+
+
+class RedisVectorCacheIndex:
+    """
+    Semantic cache index backed by Redis vector search (RediSearch HNSW).
+
+    Each user group gets its own HNSW index over the hashes stored under
+    'cache:{sha256(user_group)}:*' (see group_key_prefix), so a lookup is a
+    single KNN query that never touches entries from other groups. Expired keys
+    are dropped from the index by Redis itself.
+    """
+
+    def __init__(self):
+        self._ready_groups = set()
+
+    @property
+    def client(self):
+        return RedisClient.get_client()
+
+    def _index_name(self, user_group: str) -> str:
+        return f"{CACHE_INDEX_NAME}:{_group_hash(user_group)}"
+
+    async def _ensure_index(self, user_group: str, dim: int) -> None:
+        """
+        Creates the HNSW index for the given group if it does not exist yet.
+        """
+        if user_group in self._ready_groups:
+            return
+        index = self.client.ft(self._index_name(user_group))
+        try:
+            await index.info()
+        except redis.ResponseError:
+            await index.create_index(
+                fields=[
+                    TagField("document_id", separator=","),
+                    VectorField(
+                        "embedding",
+                        "HNSW",
+                        {
+                            "TYPE": "FLOAT32",
+                            "DIM": dim,
+                            "DISTANCE_METRIC": "COSINE",
+                            "M": CACHE_HNSW_M,
+                            "EF_CONSTRUCTION": CACHE_HNSW_EF_CONSTRUCTION,
+                            "EF_RUNTIME": CACHE_HNSW_EF_RUNTIME,
+                        },
+                    ),
+                ],
+                definition=IndexDefinition(prefix=[group_key_prefix(user_group)], index_type=IndexType.HASH),
+            )
+            logger.info("Created semantic cache index %s (dim=%d).", self._index_name(user_group), dim)
+        self._ready_groups.add(user_group)
+
+    async def add(self, key: str, entry: Dict, embedding, ttl_seconds: int) -> None:
+        """
+        Stores the entry as a Redis hash with its embedding as raw float32 bytes.
+        """
+        vector = _to_float32(embedding)
+        await self._ensure_index(entry["user_group"], vector.shape[0])
+        mapping = {
+            "user_id": str(entry["user_id"]),
+            "user_group": entry["user_group"],
+            "query": entry["query"],
+            "response": entry["response"],
+            "sources": json.dumps(entry["sources"]),
+            "document_id": entry.get("document_id") or "",
+            "embedding": vector.tobytes(),
+        }
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ttl_seconds)
+            await pipe.execute()
+
+    async def search(self, user_group: str, embedding, k: int = 1) -> List[Tuple[Dict, float]]:
+        """
+        Returns up to k (entry, similarity) pairs, where similarity is the cosine similarity as a percentage.
+        """
+        vector = _to_float32(embedding)
+        await self._ensure_index(user_group, vector.shape[0])
+        query = (
+            Query(f"*=>[KNN {k} @embedding $vec AS distance]")
+            .sort_by("distance")
+            .return_fields(*RETURN_FIELDS)
+            .paging(0, k)
+            .dialect(2)
+        )
+        result = await self.client.ft(self._index_name(user_group)).search(query, query_params={"vec": vector.tobytes()})
+        matches = []
+        for doc in result.docs:
+            entry = {
+                "user_id": doc.user_id,
+                "user_group": doc.user_group,
+                "query": doc.query,
+                "response": doc.response,
+                "sources": json.loads(doc.sources) if doc.sources else [],
+                "document_id": doc.document_id,
+            }
+            # COSINE distance is 1 - cosine similarity.
+            matches.append((entry, (1.0 - float(doc.distance)) * 100))
+        return matches
+
+    async def delete_by_document_id(self, document_id: str) -> int:
+        """
+        Deletes every cached entry, across all groups, that references the given document.
+        """
+        deleted = 0
+        query = Query(f"@document_id:{{{_escape_tag(document_id)}}}").no_content().paging(0, 1000).dialect(2)
+        for index_name in await self.client.execute_command("FT._LIST"):
+            if not index_name.startswith(f"{CACHE_INDEX_NAME}:"):
+                continue
+            while True:
+                result = await self.client.ft(index_name).search(query)
+                if not result.docs:
+                    break
+                deleted += await self.client.delete(*[doc.id for doc in result.docs])
+        return deleted
+
+
+class InMemoryCacheIndex:
+    """
+    In-process stand-in for RedisVectorCacheIndex, used for tests and local runs without Redis.
+
+    Embeddings live in a SimilarityEngine (one normalized float32 matrix per user group),
+    entries in a plain dict keyed by cache key. Expired rows are purged before each lookup.
+    """
+
+    def __init__(self):
+        self.engine = SimilarityEngine()
+        self._entries: Dict[str, Dict] = {}
+
+    async def add(self, key: str, entry: Dict, embedding, ttl_seconds: int) -> None:
+        # Raises ValueError for a zero-norm embedding before the entry is stored.
+        self.engine.add(entry["user_group"], key, embedding, ttl_seconds)
+        self._entries[key] = entry
+
+    async def search(self, user_group: str, embedding, k: int = 1) -> List[Tuple[Dict, float]]:
+        for key in self.engine.purge_expired(user_group):
+            self._entries.pop(key, None)
+        return [(self._entries[key], score * 100) for key, score in self.engine.search(user_group, embedding, k)]
+
+    async def delete_by_document_id(self, document_id: str) -> int:
+        deleted = 0
+        for key, entry in list(self._entries.items()):
+            if document_id in (entry.get("document_id") or "").split(","):
+                self.engine.remove(entry["user_group"], key)
+                del self._entries[key]
+                deleted += 1
+        return deleted
@@ -0,0 +1,154 @@
+import asyncio
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from utils.metrics import Metrics
+from utils.text_normalization import normalize_text
+from utils.token_counter import TokenCounter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Input token budget for the documents of the generation prompt.
+CONTEXT_MAX_INPUT_TOKENS = int(os.getenv("CONTEXT_MAX_INPUT_TOKENS", 3000))
+# A single document is trimmed to this many tokens, keeping its most query-relevant sentences.
+CONTEXT_MAX_DOCUMENT_TOKENS = int(os.getenv("CONTEXT_MAX_DOCUMENT_TOKENS", 800))
+# Tokens taken by the line introducing each document (index, name, page, link) besides its metadata.
+CONTEXT_DOCUMENT_OVERHEAD_TOKENS = 16
+
+# Sentences, or lines for lists and tables (a line break stays with the line it ends).
+SEGMENT_BOUNDARY = re.compile(r"(?<=[.!?])[ \t]+|(?<=\n)")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its my of on or our so "
+    "that the their there this to was what when where which who why will with you your".split()
+)
+
+
+def terms(text: str) -> List[str]:
+    return [term for term in re.findall(r"\w+", normalize_text(text)) if term not in STOPWORDS]
+
+
+@dataclass
+class PackingStats:
+    """
+    Token counts of one packed context.
+    """
+    documents_in: int
+    documents_out: int
+    tokens_in: int
+    tokens_out: int
+    budget: int
+
+
+class ContextPacker:
+    """
+    Fits the retrieved documents into an input token budget before they go into the generation prompt.
+
+      - Chunks of the same document page (overlapping chunks) are merged, without repeating sentences.
+      - A document above CONTEXT_MAX_DOCUMENT_TOKENS keeps only its most query-relevant sentences,
+        in their original order. Relevance is the overlap of the sentence terms with the query terms.
+      - Documents are added in rank order until the budget is spent; the last one is trimmed to fit.
+
+    Tokens are counted with the local tokenizer of the generation model (see TokenCounter).
+
+    Parameters:
+      - model_name: The generation model.
+      - max_input_tokens: The token budget for all the documents.
+      - max_document_tokens: The token limit of a single document.
+    """
+
+    def __init__(self, model_name: Optional[str] = None, max_input_tokens: int = CONTEXT_MAX_INPUT_TOKENS,
+                 max_document_tokens: int = CONTEXT_MAX_DOCUMENT_TOKENS):
+        self.token_counter = TokenCounter(model_name)
+        self.max_input_tokens = max_input_tokens
+        self.max_document_tokens = max_document_tokens
+
+    @staticmethod
+    def segments(content: str) -> List[str]:
+        return [segment for segment in SEGMENT_BOUNDARY.split(content) if segment.strip()]
+
+    @staticmethod
+    def join(segments: List[str]) -> str:
+        return "".join(segment if segment.endswith("\n") else segment + " " for segment in segments).strip()
+
+    def merge_duplicates(self, documents: List[Dict]) -> List[Dict]:
+        """
+        Merges the chunks that come from the same document page into the best ranked one.
+        """
+        merged: Dict[Tuple, Dict] = {}
+        seen: Dict[Tuple, set] = {}
+        packed = []
+        for doc in documents:
+            key = (doc.get("document_name"), doc.get("page_number"))
+            if key == (None, None):
+                packed.append(doc)
+                continue
+            segments = self.segments(doc.get("content", ""))
+            if key not in merged:
+                merged[key] = dict(doc)
+                seen[key] = {normalize_text(segment) for segment in segments}
+                packed.append(merged[key])
+                continue
+            new_segments = [segment for segment in segments if normalize_text(segment) not in seen[key]]
+            if new_segments:
+                seen[key].update(normalize_text(segment) for segment in new_segments)
+                merged[key]["content"] = self.join(self.segments(merged[key].get("content", "")) + new_segments)
+        return packed
+
+    def trim(self, query: str, content: str, max_tokens: int) -> str:
+        """
+        Keeps the most query-relevant sentences of the content that fit in max_tokens, in their original order.
+        """
+        if self.token_counter.count(content) <= max_tokens:
+            return content
+        segments = self.segments(content)
+        query_terms = set(terms(query))
+
+        def relevance(segment: str) -> float:
+            segment_terms = terms(segment)
+            if not segment_terms:
+                return 0.0
+            return sum(count for term, count in Counter(segment_terms).items() if term in query_terms) / math.sqrt(len(segment_terms))
+
+        ranked = sorted(range(len(segments)), key=lambda i: relevance(segments[i]), reverse=True)
+        kept, used = set(), 0
+        for i in ranked:
+            tokens = self.token_counter.count(segments[i]) + 1
+            if used + tokens <= max_tokens:
+                kept.add(i)
+                used += tokens
+        if not kept:
+            # Not even one sentence fits: cut the most relevant one.
+            return self.token_counter.truncate(segments[ranked[0]], max_tokens)
+        return self.join([segments[i] for i in sorted(kept)])
+
+    async def warmup(self) -> None:
+        """
+        Loads the tokenizer in a thread, so pack() never loads (or downloads) it on the event loop.
+        """
+        if not self.token_counter.loaded:
+            await asyncio.to_thread(self.token_counter.load)
+
+    def pack(self, query: str, documents: List[Dict]) -> Tuple[List[Dict], PackingStats]:
+        """
+        Returns the documents to put in the prompt (copies, with packed content) and the token counts.
+        """
+        tokens_in = sum(self.token_counter.count(doc.get("content", "")) for doc in documents)
+        packed, budget = [], self.max_input_tokens
+        for doc in self.merge_duplicates(documents):
+            metadata = f"{doc.get('document_name', 'N/A')} {doc.get('page_number', 'N/A')} {doc.get('document_url', 'N/A')}"
+            overhead = self.token_counter.count(metadata) + CONTEXT_DOCUMENT_OVERHEAD_TOKENS
+            available = min(self.max_document_tokens, budget - overhead)
+            if available <= 0:
+                break
+            content = self.trim(query, doc.get("content", ""), available)
+            packed.append({**doc, "content": content})
+            budget -= overhead + self.token_counter.count(content)
+        tokens_out = sum(self.token_counter.count(doc["content"]) for doc in packed)
+        stats = PackingStats(len(documents), len(packed), tokens_in, tokens_out, self.max_input_tokens)
+        Metrics.incr("context_tokens_in", stats.tokens_in)
+        Metrics.incr("context_tokens_out", stats.tokens_out)
+        return packed, stats
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import numpy as np
+from utils.micro_batcher import MicroBatcher
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes, each holding one warm model replica.
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 2))
+# Torch intra-op threads per worker; keeps replicas from oversubscribing the CPU.
+EMBEDDING_WORKER_THREADS = int(os.getenv("EMBEDDING_WORKER_THREADS", 1))
+# A micro-batch is sent to a worker once it holds this many texts or after this many milliseconds.
+EMBEDDING_WORKER_BATCH_SIZE = int(os.getenv("EMBEDDING_WORKER_BATCH_SIZE", 32))
+EMBEDDING_WORKER_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_WORKER_BATCH_WAIT_MS", 5))
+
+# The model replica of the current worker process, set by _init_worker.
+_worker_model = None
+
+
+def _init_worker(model_name: str, num_threads: int) -> None:
+    """
+    Loads the model once when the worker process starts.
+    """
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(num_threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    """
+    Encodes a batch of texts in the worker process into a float32 matrix.
+    """
+    embeddings = _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def _warmup() -> int:
+    _encode(["warmup"])
+    return os.getpid()
+
+
+class EmbeddingWorkerPool:
+    """
+    Runs a sentence-transformers model in a pool of worker processes, off the event loop and the GIL.
+
+    Texts submitted concurrently are gathered into micro-batches (up to EMBEDDING_WORKER_BATCH_SIZE
+    texts or EMBEDDING_WORKER_BATCH_WAIT_MS) and each batch is encoded by one of the warm replicas.
+    Results come back as float32 numpy arrays, never as Python lists.
+
+    Parameters:
+      - model_name: The sentence-transformers model to load in every worker.
+      - replicas: Number of worker processes (model replicas).
+    """
+
+    def __init__(self, model_name: str, replicas: int = EMBEDDING_WORKERS):
+        self.model_name = model_name
+        self.replicas = replicas
+        # Spawned rather than forked: torch does not survive a fork of a process that already uses threads.
+        self._executor = ProcessPoolExecutor(
+            max_workers=replicas,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, EMBEDDING_WORKER_THREADS),
+        )
+        self.batcher = MicroBatcher(self._encode_batch, max_batch_size=EMBEDDING_WORKER_BATCH_SIZE, max_wait_ms=EMBEDDING_WORKER_BATCH_WAIT_MS)
+
+    async def warmup(self) -> None:
+        """
+        Starts every worker and runs one encode on each replica so the first request pays no load time.
+        """
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warmup) for _ in range(self.replicas)))
+        logger.info("Embedding worker pool warm (%s) with %d process(es).", self.model_name, len(set(pids)))
+
+    async def _encode_batch(self, texts: List[str]) -> List[np.ndarray]:
+        loop = asyncio.get_running_loop()
+        matrix = await loop.run_in_executor(self._executor, _encode, texts)
+        return list(matrix)
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes the texts, batched with concurrent callers. Returns a float32 matrix (one row per text).
+        """
+        rows = await asyncio.gather(*(self.batcher.submit(text) for text in texts))
+        return np.stack(rows)
+
+    def encode_sync(self, texts: List[str]) -> np.ndarray:
+        """
+        Blocking variant of encode for synchronous callers (no micro-batching).
+        """
+        return self._executor.submit(_encode, texts).result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
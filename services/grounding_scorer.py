@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+from services.reranker import load_cross_encoder
+from services.similarity_engine import SimilarityEngine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "nli" (CPU cross-encoder, entailment probability) or "embedding" (cosine similarity with the embedding client).
+GROUNDING_BACKEND = os.getenv("GROUNDING_BACKEND", "nli").lower()
+GROUNDING_NLI_MODEL = os.getenv("GROUNDING_NLI_MODEL", "cross-encoder/nli-deberta-v3-xsmall")
+GROUNDING_NLI_MAX_LENGTH = int(os.getenv("GROUNDING_NLI_MAX_LENGTH", 256))
+GROUNDING_NLI_BATCH_SIZE = int(os.getenv("GROUNDING_NLI_BATCH_SIZE", 32))
+# Chunks are compared in windows of consecutive sentences, so a premise fits the NLI input length.
+GROUNDING_WINDOW_SENTENCES = int(os.getenv("GROUNDING_WINDOW_SENTENCES", 3))
+# Embedding backend: cosine similarities at or below the floor count as unsupported, at or above the ceiling as supported.
+GROUNDING_SIMILARITY_FLOOR = float(os.getenv("GROUNDING_SIMILARITY_FLOOR", 0.5))
+GROUNDING_SIMILARITY_CEILING = float(os.getenv("GROUNDING_SIMILARITY_CEILING", 0.85))
+# Sentences with fewer words ("Sure.", "Here is a summary:") carry no claim and are not scored.
+GROUNDING_MIN_SENTENCE_WORDS = int(os.getenv("GROUNDING_MIN_SENTENCE_WORDS", 4))
+# A streamed answer is only aborted once this many sentences have been scored.
+GROUNDING_STREAM_MIN_SENTENCES = int(os.getenv("GROUNDING_STREAM_MIN_SENTENCES", 2))
+
+CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+# The generated answer ends with a "References:" section listing the cited documents.
+REFERENCES_PATTERN = re.compile(r"^\s*[#*_]*\s*references\s*:?", re.IGNORECASE | re.MULTILINE)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[\"'(]?[A-Z0-9])")
+# Citations written after the full stop ("... days. [2]") belong to the sentence before them.
+TRAILING_CITATIONS = re.compile(r"([.!?])((?:\s*\[\d+\])+)")
+# End of a sentence (and its trailing citations) in text that is still being generated.
+SENTENCE_END = re.compile(r"[.!?](?:\s*\[\d+\])*(?=\s+[\"'(]?[A-Z0-9])")
+
+
+@dataclass
+class SentenceScore:
+    """
+    Support of one answer sentence by the retrieved documents, between 0 and 1.
+    """
+    text: str
+    citations: List[int]
+    support: float
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits text into sentences; markdown lines (list items, table rows) are kept as separate sentences.
+    """
+    sentences = []
+    for line in text.splitlines():
+        line = re.sub(r"^\s*(?:[-*+>#|]+|\d+[.)])\s*", "", line).strip()
+        if not re.search(r"[A-Za-z0-9]", line):
+            continue
+        sentences.extend(part.strip() for part in SENTENCE_BOUNDARY.split(line) if part.strip())
+    return sentences
+
+
+def answer_sentences(response: str) -> List[Tuple[str, List[int]]]:
+    """
+    Returns the claim-bearing sentences of a generated answer with the documents each one cites (1-based).
+    The references section is dropped.
+    """
+    match = REFERENCES_PATTERN.search(response)
+    body = TRAILING_CITATIONS.sub(r"\2\1", response[:match.start()] if match else response)
+    sentences = []
+    for sentence in split_sentences(body):
+        citations = sorted({int(n) for n in CITATION_PATTERN.findall(sentence)})
+        claim = re.sub(r"\s+([.,;:!?])", r"\1", CITATION_PATTERN.sub("", sentence)).strip()
+        if len(re.findall(r"\w+", claim)) >= GROUNDING_MIN_SENTENCE_WORDS:
+            sentences.append((claim, citations))
+    return sentences
+
+
+def aggregate(sentence_scores: List[SentenceScore]) -> float:
+    """
+    Share of the answer supported by the documents (0-100), weighting each sentence by its length.
+    An answer without any claim is fully supported.
+    """
+    if not sentence_scores:
+        return 100.0
+    weights = [len(score.text.split()) for score in sentence_scores]
+    return 100.0 * sum(weight * score.support for weight, score in zip(weights, sentence_scores)) / sum(weights)
+
+
+class GroundingScorer:
+    """
+    Scores how well an answer is supported by the retrieved documents without calling an LLM.
+
+    Each sentence of the answer is compared with the documents it cites (all the documents when
+    it cites none), split into windows of GROUNDING_WINDOW_SENTENCES sentences. A sentence's
+    support is its best match over those windows:
+      - nli: the entailment probability of a CPU NLI cross-encoder (window as premise, sentence as hypothesis);
+      - embedding: the cosine similarity of their embeddings, rescaled between GROUNDING_SIMILARITY_FLOOR and GROUNDING_SIMILARITY_CEILING.
+
+    Parameters:
+      - backend: "nli" or "embedding".
+      - embedding_client: The EmbeddingClient, required for the embedding backend.
+      - model: The NLI model name or local directory.
+    """
+
+    def __init__(self, backend: str = GROUNDING_BACKEND, embedding_client=None, model: str = GROUNDING_NLI_MODEL,
+                 max_length: int = GROUNDING_NLI_MAX_LENGTH):
+        self.backend = backend.lower()
+        if self.backend not in ("nli", "embedding"):
+            raise ValueError(f"Unsupported grounding backend: {backend}")
+        if self.backend == "embedding" and embedding_client is None:
+            raise ValueError("The embedding grounding backend needs an embedding client.")
+        self.embedding_client = embedding_client
+        self.model = model
+        self.max_length = max_length
+        self._entailment_index: Optional[int] = None
+
+    @staticmethod
+    def premises(document: str) -> List[str]:
+        sentences = split_sentences(document)
+        if len(sentences) <= GROUNDING_WINDOW_SENTENCES:
+            return [" ".join(sentences)] if sentences else []
+        stride = max(1, GROUNDING_WINDOW_SENTENCES - 1)
+        return [
+            " ".join(sentences[start:start + GROUNDING_WINDOW_SENTENCES])
+            for start in range(0, len(sentences) - GROUNDING_WINDOW_SENTENCES + stride, stride)
+        ]
+
+    def _entailment(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        Entailment probability of each (premise, hypothesis) pair (blocking, run in a thread).
+        """
+        model = load_cross_encoder(self.model, self.max_length)
+        if self._entailment_index is None:
+            labels = {index: label.lower() for index, label in model.model.config.id2label.items()}
+            self._entailment_index = next((index for index, label in labels.items() if label.startswith("entail")), 1)
+        probabilities = model.predict(pairs, apply_softmax=True, batch_size=GROUNDING_NLI_BATCH_SIZE, show_progress_bar=False)
+        return [float(row[self._entailment_index]) for row in probabilities]
+
+    async def _similarities(self, sentences: List[str], premises: List[str]) -> np.ndarray:
+        embeddings = await self.embedding_client.agenerate_embeddings(sentences + premises)
+        normalized = [SimilarityEngine.normalize(embedding) for embedding in embeddings]
+        dim = embeddings.shape[1]
+        matrix = np.stack([vector if vector is not None else np.zeros(dim, dtype=np.float32) for vector in normalized])
+        return matrix[:len(sentences)] @ matrix[len(sentences):].T
+
+    async def score_sentences(self, sentences: List[Tuple[str, List[int]]], context: List[str]) -> List[SentenceScore]:
+        """
+        Scores (sentence, citations) pairs against the context documents (citations are 1-based indexes into context).
+        """
+        if not sentences:
+            return []
+        document_premises = [self.premises(document) for document in context]
+        premises = list(dict.fromkeys(premise for document in document_premises for premise in document))
+        premise_index = {premise: i for i, premise in enumerate(premises)}
+        candidates = []
+        for _, citations in sentences:
+            cited = [n - 1 for n in citations if 1 <= n <= len(context)] or range(len(context))
+            candidates.append(sorted({premise_index[premise] for i in cited for premise in document_premises[i]}))
+
+        if not premises:
+            supports = [0.0] * len(sentences)
+        elif self.backend == "nli":
+            pairs = [(premises[p], claim) for (claim, _), premise_ids in zip(sentences, candidates) for p in premise_ids]
+            probabilities = await asyncio.to_thread(self._entailment, pairs)
+            supports, offset = [], 0
+            for premise_ids in candidates:
+                supports.append(max(probabilities[offset:offset + len(premise_ids)], default=0.0))
+                offset += len(premise_ids)
+        else:
+            similarities = await self._similarities([claim for claim, _ in sentences], premises)
+            span = GROUNDING_SIMILARITY_CEILING - GROUNDING_SIMILARITY_FLOOR
+            supports = [
+                float(np.clip((similarities[i, premise_ids].max() - GROUNDING_SIMILARITY_FLOOR) / span, 0.0, 1.0)) if premise_ids else 0.0
+                for i, premise_ids in enumerate(candidates)
+            ]
+        return [SentenceScore(claim, citations, support) for (claim, citations), support in zip(sentences, supports)]
+
+    async def score(self, response: str, context: List[str]) -> Tuple[float, List[SentenceScore]]:
+        """
+        Returns the grounding score of the answer (0-100, like the LLM judge) and the score of each sentence.
+        """
+        sentence_scores = await self.score_sentences(answer_sentences(response), context)
+        return aggregate(sentence_scores), sentence_scores
+
+    async def warmup(self) -> None:
+        """
+        Loads the NLI model and scores one pair, so the first request pays no load time.
+        """
+        if self.backend == "nli":
+            await asyncio.to_thread(self._entailment, [("warmup", "warmup")])
+
+
+class StreamingGrounding:
+    """
+    Scores the sentences of an answer while it is being generated.
+
+    feed() receives the generated tokens; every sentence is scored as soon as it is complete, in a
+    background task that batches the sentences completed in the meantime. When abort_below is
+    set, the check is marked as aborted as soon as the cumulative score of the sentences scored
+    so far (at least GROUNDING_STREAM_MIN_SENTENCES) drops below it, so the caller can stop the generation.
+    Once the generation has ended (end_generation() or finish()), the check no longer aborts.
+
+    Parameters:
+      - scorer: The GroundingScorer.
+      - context: The documents the answer is generated from.
+      - abort_below: Optional; the cumulative score (0-100) below which the answer is abandoned.
+    """
+
+    def __init__(self, scorer: GroundingScorer, context: List[str], abort_below: Optional[float] = None):
+        self.scorer = scorer
+        self.context = context
+        self.abort_below = abort_below
+        self.aborted = False
+        self.sentence_scores: List[SentenceScore] = []
+        self.error: Optional[Exception] = None
+        self._text = ""
+        self._emitted = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def score(self) -> float:
+        return aggregate(self.sentence_scores)
+
+    def _stable_end(self) -> int:
+        """
+        End of the text that can no longer change sentence boundaries: the last line break or sentence boundary.
+        """
+        end = self._text.rfind("\n") + 1
+        for match in SENTENCE_END.finditer(self._text, end):
+            end = match.end()
+        return end
+
+    def _emit(self, end: int) -> None:
+        sentences = answer_sentences(self._text[:end])
+        for sentence in sentences[self._emitted:]:
+            self._queue.put_nowait(sentence)
+        self._emitted = max(self._emitted, len(sentences))
+        if self._task is None and not self._queue.empty():
+            self._task = asyncio.create_task(self._run())
+
+    def feed(self, text: str) -> None:
+        self._text += text
+        self._emit(self._stable_end())
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                if self.error is None:
+                    self.sentence_scores.extend(await self.scorer.score_sentences(batch, self.context))
+                    if (self.abort_below is not None and len(self.sentence_scores) >= GROUNDING_STREAM_MIN_SENTENCES
+                            and self.score < self.abort_below):
+                        self.aborted = True
+            except Exception as e:
+                self.error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def end_generation(self) -> None:
+        """
+        Marks the answer as complete. An abort raised after the last token no longer counts,
+        since there is no generation left to stop.
+        """
+        self.abort_below = None
+        self.aborted = False
+
+    async def finish(self) -> Tuple[float, List[SentenceScore]]:
+        """
+        Scores the rest of the answer once generation has ended and returns the score of the whole answer.
+        Raises the error of a failed scoring batch.
+        """
+        self.end_generation()
+        self._emit(len(self._text))
+        await self._queue.join()
+        self.close()
+        if self.error is not None:
+            raise self.error
+        return self.score, self.sentence_scores
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
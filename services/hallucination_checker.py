@@ -1,16 +1,69 @@
-from typing import List, Optional
+import logging
+import os
+import re
+import time
+from typing import List, Optional, Tuple
+from services.grounding_scorer import GroundingScorer, SentenceScore, StreamingGrounding, GROUNDING_BACKEND
 from utils.langchain_client import LangChainClient
+from utils.metrics import Metrics
+from dotenv import load_dotenv
 import traceback
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Local grounding scores inside [low, high) are borderline and confirmed by the LLM judge.
+GROUNDING_LLM_BAND_LOW = float(os.getenv("GROUNDING_LLM_BAND_LOW", 50))
+GROUNDING_LLM_BAND_HIGH = float(os.getenv("GROUNDING_LLM_BAND_HIGH", 95))
+# A streamed answer whose cumulative local score drops below this is abandoned and regenerated.
+# Defaults to the bottom of the LLM band: lower scores are conclusive without the judge.
+GROUNDING_STREAM_ABORT_SCORE = float(os.getenv("GROUNDING_STREAM_ABORT_SCORE", GROUNDING_LLM_BAND_LOW))
+
+# Static instructions, sent as the system message so that vendors can cache this prompt prefix.
+HALLUCINATION_SYSTEM_PROMPT = (
+    "# Hallucination Detection Evaluation\n\n"
+    "## Evaluation Instructions\n"
+    "Analyze the response and determine if it is factually consistent with the provided context:\n\n"
+    "1. Identify all factual claims made in the response\n"
+    "2. Check each claim against the provided context\n"
+    "3. Claims directly supported by context get full points\n"
+    "4. Claims that contradict context get zero points\n"
+    "5. Claims not mentioned in context but are common knowledge may get partial points\n"
+    "6. Determine what percentage of the response is supported by the context\n\n"
+    "## Scoring Methodology\n"
+    "- 90-100%: Response is fully supported by context with minimal to no unsupported claims\n"
+    "- 70-89%: Response is mostly supported with minor unsupported claims\n"
+    "- 50-69%: Response has a mix of supported and unsupported claims\n"
+    "- 20-49%: Response contains mostly unsupported claims with some supported elements\n"
+    "- 0-19%: Response is almost entirely or completely hallucinated\n\n"
+    "## Output Format\n"
+    "Return ONLY a single number between 0 and 100 (without the % symbol) representing the factual consistency score.\n"
+)
+# Variable part of the prompt, sent after the system prompt.
+HALLUCINATION_PROMPT = (
+    "## Query\n"
+    "{query}\n\n"
+    "## Response to Evaluate\n"
+    "{response}\n\n"
+    "## Reference Context\n"
+    "{context}\n\n"
+    "## Factual Consistency Score:"
+)
+
 class HallucinationCheckService:
     """
     Service for detecting hallucinations in LLM-generated responses.
     
     This service compares a response against a given context and returns a percentage score
     (0 = completely hallucinated, 100 = fully consistent with context).
+
+    The response is first scored locally, sentence by sentence (see GroundingScorer); the LLM
+    judge is only asked when the local score is borderline, or for every response when
+    GROUNDING_BACKEND is "llm".
     """
     
-    def __init__(self, vendor: str, model_name: str, api_key: str):
+    def __init__(self, vendor: str, model_name: str, api_key: str, embedding_client=None):
         """
         Initializes the HallucinationCheckService with a LangChainClient.
         
@@ -18,57 +71,97 @@ class HallucinationCheckService:
           - vendor: The LLM vendor (e.g., "openai").
           - model_name: The model to use.
           - api_key: The API key for the vendor.
+          - embedding_client: Optional; the EmbeddingClient used by the embedding grounding backend.
         """
         self.langchain_client = LangChainClient(llm_vendor=vendor, model_name=model_name, api_key=api_key)
+        self.grounding_scorer = GroundingScorer(GROUNDING_BACKEND, embedding_client) if GROUNDING_BACKEND != "llm" else None
+
+    async def warmup(self) -> None:
+        """
+        Loads the local grounding model.
+        """
+        if self.grounding_scorer is not None:
+            await self.grounding_scorer.warmup()
     
     async def check_hallucination(self, query: str, response: str, context: List[str], prompt: Optional[str] = None) -> float:
         """
-        Evaluates the factual consistency of the response against the provided context.
+        Scores the factual consistency of the response against the provided context, locally when
+        the local score is conclusive and with the LLM judge otherwise (see judge_hallucination).
+        """
+        score, _ = await self.check_sentences(query, response, context, prompt)
+        return score
+
+    async def check_sentences(self, query: str, response: str, context: List[str], prompt: Optional[str] = None) -> Tuple[float, List[SentenceScore]]:
+        """
+        Like check_hallucination, also returning the local score of each sentence (empty without a local scorer).
+        """
+        if self.grounding_scorer is None:
+            return await self.judge_hallucination(query, response, context, prompt), []
+        start_time = time.perf_counter()
+        return await self._decide(self.grounding_scorer.score(response, context), start_time, query, response, context, prompt)
+
+    def start_streaming_check(self, context: List[str], abort_below: Optional[float] = None) -> Optional[StreamingGrounding]:
+        """
+        Starts scoring an answer while it is generated (see StreamingGrounding), or returns None
+        when there is no local scorer. Feed it the tokens, then call finish_streaming_check.
+        """
+        if self.grounding_scorer is None:
+            return None
+        return StreamingGrounding(self.grounding_scorer, context, abort_below)
+
+    async def finish_streaming_check(self, check: StreamingGrounding, query: str, response: str, context: List[str], prompt: Optional[str] = None) -> float:
+        """
+        Scores the complete answer like check_hallucination, reusing the sentences already scored during generation.
+        """
+        start_time = time.perf_counter()
+        score, _ = await self._decide(check.finish(), start_time, query, response, context, prompt)
+        return score
+
+    async def _decide(self, local_score, start_time: float, query: str, response: str, context: List[str],
+                      prompt: Optional[str]) -> Tuple[float, List[SentenceScore]]:
+        """
+        Returns the awaited local score when it is conclusive, and the LLM verdict when it is borderline or fails,
+        along with the local sentence scores.
+        """
+        sentence_scores = []
+        try:
+            score, sentence_scores = await local_score
+            Metrics.observe("grounding_local", (time.perf_counter() - start_time) * 1000)
+            if not GROUNDING_LLM_BAND_LOW <= score < GROUNDING_LLM_BAND_HIGH:
+                Metrics.incr("grounding_local_decided")
+                return score, sentence_scores
+            Metrics.incr("grounding_llm_judge")
+        except Exception as e:
+            # The LLM judge still gives a verdict when the local model is unavailable.
+            Metrics.incr("grounding_local_failures")
+            logger.warning("Local grounding check failed, using the LLM judge: %s", e)
+        return await self.judge_hallucination(query, response, context, prompt), sentence_scores
+    
+    async def judge_hallucination(self, query: str, response: str, context: List[str], prompt: Optional[str] = None) -> float:
+        """
+        Evaluates the factual consistency of the response against the provided context with the LLM.
         
         Parameters:
         - query: The original user query.
         - response: The LLM-generated response.
         - context: A list of strings containing the context (retrieved documents).
-        - prompt: Optional prompt to guide the hallucination detection. If not provided, a default prompt is used.
+        - prompt: Optional prompt to guide the hallucination detection. If not provided, the default system prompt and prompt are used.
         
         Returns:
         - A percentage score (float) where 100 means the response is fully supported by the context,
-            and 0 means it is entirely hallucinated.
+            and 0 means it is entirely hallucinated. An unparseable verdict scores 0.
         """
         if prompt is None:
-            prompt = (
-                "# Hallucination Detection Evaluation\n\n"
-                "## Query\n"
-                "{query}\n\n"
-                "## Response to Evaluate\n"
-                "{response}\n\n"
-                "## Reference Context\n"
-                "{context}\n\n"
-                "## Evaluation Instructions\n"
-                "Analyze the response and determine if it is factually consistent with the provided context:\n\n"
-                "1. Identify all factual claims made in the response\n"
-                "2. Check each claim against the provided context\n"
-                "3. Claims directly supported by context get full points\n"
-                "4. Claims that contradict context get zero points\n"
-                "5. Claims not mentioned in context but are common knowledge may get partial points\n"
-                "6. Determine what percentage of the response is supported by the context\n\n"
-                "## Scoring Methodology\n"
-                "- 90-100%: Response is fully supported by context with minimal to no unsupported claims\n"
-                "- 70-89%: Response is mostly supported with minor unsupported claims\n"
-                "- 50-69%: Response has a mix of supported and unsupported claims"
-                "- 20-49%: Response contains mostly unsupported claims with some supported elements\n"
-                "- 0-19%: Response is almost entirely or completely hallucinated\n\n"
-                "## Output Format\n"
-                "Return ONLY a single number between 0 and 100 (without the % symbol) representing the factual consistency score.\n\n"
-                "## Factual Consistency Score:"
-            )
+            prompt, system_prompt = HALLUCINATION_PROMPT, HALLUCINATION_SYSTEM_PROMPT
+        else:
+            system_prompt = None
         
-        result_str = await self.langchain_client.hallucination_check(query, response, context, prompt)
+        result_str = await self.langchain_client.hallucination_check(query, response, context, prompt, system_prompt)
         
+        score = 0.0
         # More robust parsing logic
         try:
             # Extract all numeric characters from the result
-            import re
             numeric_chars = re.findall(r'\d+\.?\d*', result_str)
             
             if numeric_chars:
@@ -77,6 +170,8 @@ class HallucinationCheckService:
                 
                 # Ensure the score is within the valid range
                 score = max(0.0, min(100.0, score))
+            else:
+                logger.warning("No score in the hallucination check verdict: %r", result_str)
             
         except Exception :
             traceback.print_exc()
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from services.session_service import SessionService
+from utils.metrics import Metrics
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Appends queued within this window are written together.
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", 10))
+HISTORY_MAX_BATCH_SIZE = int(os.getenv("HISTORY_MAX_BATCH_SIZE", 500))
+# Attempts per batch before its entries are dropped; the delay doubles after every failure.
+HISTORY_MAX_ATTEMPTS = int(os.getenv("HISTORY_MAX_ATTEMPTS", 5))
+HISTORY_RETRY_DELAY_SECONDS = float(os.getenv("HISTORY_RETRY_DELAY_SECONDS", 0.2))
+
+
+class HistoryWriter:
+    """
+    Write-behind queue for session history appends.
+
+    append() only queues the entry and returns. A background task collects the entries queued
+    within HISTORY_FLUSH_INTERVAL_MS and writes them with SessionService.append_history (one bulk
+    write per collection), retrying failed batches with exponential backoff. close() flushes
+    whatever is still queued and is called on application shutdown.
+
+    Parameters:
+      - flush_interval_ms: How long entries are collected before a flush.
+      - max_batch_size: Maximum number of entries per bulk write.
+      - max_attempts: Attempts per batch before its entries are dropped.
+    """
+
+    def __init__(self, flush_interval_ms: float = HISTORY_FLUSH_INTERVAL_MS, max_batch_size: int = HISTORY_MAX_BATCH_SIZE, max_attempts: int = HISTORY_MAX_ATTEMPTS):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        self._pending: List[Tuple[str, Dict]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def append(self, session_id: str, history_entry: Dict) -> None:
+        """
+        Queues a history entry for the session. Must be called from the event loop.
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._pending.append((session_id, history_entry))
+        Metrics.set_gauge("history_writer_queue_depth", len(self._pending))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closing:
+                await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if self._closing:
+                return
+
+    async def flush(self) -> None:
+        """
+        Writes all queued entries, in batches of at most max_batch_size.
+        """
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            Metrics.set_gauge("history_writer_queue_depth", len(self._pending))
+            await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[str, Dict]]) -> None:
+        delay = HISTORY_RETRY_DELAY_SECONDS
+        for attempt in range(1, self.max_attempts + 1):
+            start_time = time.perf_counter()
+            try:
+                await SessionService.append_history(batch)
+                Metrics.observe("history_writer_flush", (time.perf_counter() - start_time) * 1000)
+                Metrics.incr("history_writer_entries_written", len(batch))
+                return
+            except Exception as e:
+                logger.warning("History flush of %d entries failed (attempt %d/%d): %s", len(batch), attempt, self.max_attempts, e)
+                Metrics.incr("history_writer_flush_failures")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        logger.error("Dropped %d history entries after %d attempts.", len(batch), self.max_attempts)
+        Metrics.incr("history_writer_entries_dropped", len(batch))
+
+    async def close(self) -> None:
+        """
+        Flushes the remaining entries and stops the background task.
+        """
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            # Let the task finish the batch it may be writing rather than cancelling it.
+            self._wakeup.set()
+            await self._task
+        self._task = None
+        await self.flush()
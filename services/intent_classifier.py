@@ -1,5 +1,45 @@
+import logging
+import time
 from typing import Optional
+import numpy as np
+from services.local_intent_classifier import LocalIntentClassifier
 from utils.langchain_client import LangChainClient
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Static instructions, sent as the system message so that vendors can cache this prompt prefix.
+INTENT_SYSTEM_PROMPT = (
+    "# Intent Classification Task\n\n"
+    "## Classification Instructions\n"
+    "Analyze the query and determine if it falls into one of these categories:\n\n"
+    "### Greeting (Respond with 'greeting' only)\n"
+    "- Hello, hi, hey, good morning/afternoon/evening\n"
+    "- Initial conversation starters\n"
+    "- Welcome messages\n"
+    "- How are you/how's it going\n"
+    "- Introductions\n"
+    "### Domain (Respond with 'domain' only)\n"
+    "- Banking products and services (accounts, loans, mortgages, credit cards)\n"
+    "- Financial transactions and operations\n"
+    "- Banking policies, fees, and rates\n"
+    "- Financial regulations and compliance\n"
+    "- Customer account inquiries and management\n"
+    "- Banking technology and digital services\n\n"
+    "### Non-Domain (Respond with 'non-domain' only)\n"
+    "- General conversation and small talk\n"
+    "- Questions about topics unrelated to banking/finance\n"
+    "- Personal questions about the assistant\n"
+    "- Technical support for non-banking systems\n"
+    "- Requests that don't pertain to financial services\n\n"
+    "## Output Format\n"
+    "Respond with exactly one word: either 'domain' or 'non-domain'\n\n"
+)
+# Variable part of the prompt, sent after the system prompt.
+INTENT_PROMPT = (
+    "## Query to Classify :\n{query}\n\n"
+    "## Classification:\n"
+)
 
 class IntentClassificationService:
     """
@@ -8,9 +48,12 @@ class IntentClassificationService:
     For this application, we distinguish between:
       - "domain": Queries related to bank policies, credit cards, and other financial topics.
       - "non-domain": All other queries.
+
+    When an embedding client is given, a local nearest-exemplar classifier answers first from the
+    query embedding, and the LLM is only called when the local prediction is not confident.
     """
     
-    def __init__(self, vendor: str, model_name: str, api_key: str):
+    def __init__(self, vendor: str, model_name: str, api_key: str, embedding_client=None):
         """
         Initializes the IntentClassificationService with a LangChainClient.
         
@@ -18,51 +61,50 @@ class IntentClassificationService:
           - vendor: The LLM vendor (e.g., "openai").
           - model_name: The model name to be used.
           - api_key: The API key for the vendor.
+          - embedding_client: Optional; enables the local classifier (see LocalIntentClassifier).
         """
         self.langchain_client = LangChainClient(llm_vendor=vendor, model_name=model_name, api_key=api_key)
+        self.local_classifier = LocalIntentClassifier(embedding_client) if embedding_client is not None else None
+
+    async def warmup(self) -> None:
+        """
+        Embeds the exemplars of the local classifier.
+        """
+        if self.local_classifier is not None:
+            await self.local_classifier.fit()
     
-    async def classify_intent(self, query: str, prompt: Optional[str] = None) -> str:
+    async def classify_intent(self, query: str, prompt: Optional[str] = None, query_embedding: Optional[np.ndarray] = None) -> str:
         """
         Classifies the intent of the given query as either "domain" or "non-domain."
         
         Parameters:
           - query: The user query string.
-          - prompt: Optional custom prompt to guide the classification. If not provided, a default prompt is used.
+          - prompt: Optional custom prompt to guide the classification. If not provided, the default system prompt and prompt are used.
+          - query_embedding: Optional; the embedding of the query, used by the local classifier.
         
         Returns:
           - A string: either "domain" or "non-domain".
         """
+        if query_embedding is not None and self.local_classifier is not None:
+            start_time = time.perf_counter()
+            try:
+                intent, confident = await self.local_classifier.classify(query_embedding)
+                Metrics.observe("intent_local", (time.perf_counter() - start_time) * 1000)
+                if confident:
+                    Metrics.incr("intent_local_confident")
+                    return intent
+                Metrics.incr("intent_llm_fallback")
+            except Exception as e:
+                # The LLM still classifies the query when the local model or its exemplars are unavailable.
+                Metrics.incr("intent_local_failures")
+                logger.warning("Local intent classification failed, using the LLM: %s", e)
+
         if prompt is None:
-            prompt = (
-            "# Intent Classification Task\n\n"
-            "## Query to Classify :\n{query}\n\n"
-            "## Classification Instructions\n"
-            "Analyze the query and determine if it falls into one of these categories:\n\n"
-            "### Greeting (Respond with 'greeting' only)\n"
-            "- Hello, hi, hey, good morning/afternoon/evening\n"
-            "- Initial conversation starters\n"
-            "- Welcome messages\n"
-            "- How are you/how's it going\n"
-            "- Introductions\n"
-            "### Domain (Respond with 'domain' only)\n"
-            "- Banking products and services (accounts, loans, mortgages, credit cards)\n"
-            "- Financial transactions and operations\n"
-            "- Banking policies, fees, and rates\n"
-            "- Financial regulations and compliance\n"
-            "- Customer account inquiries and management\n"
-            "- Banking technology and digital services\n\n"
-            "### Non-Domain (Respond with 'non-domain' only)\n"
-            "- General conversation and small talk\n"
-            "- Questions about topics unrelated to banking/finance\n"
-            "- Personal questions about the assistant\n"
-            "- Technical support for non-banking systems\n"
-            "- Requests that don't pertain to financial services\n\n"
-            "## Output Format\n"
-            "Respond with exactly one word: either 'domain' or 'non-domain'\n\n"
-            "## Classification:\n"
-        )
+            prompt, system_prompt = INTENT_PROMPT, INTENT_SYSTEM_PROMPT
+        else:
+            system_prompt = None
         # Call the LangChainClient's classify_intent method.
-        intent = await self.langchain_client.classify_intent(query, prompt)
+        intent = await self.langchain_client.classify_intent(query, prompt, system_prompt)
         return intent.strip()
 
 
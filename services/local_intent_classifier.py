@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from services.similarity_engine import SimilarityEngine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Optional JSON file {"greeting": [...], "domain": [...], "non-domain": [...]} replacing the built-in exemplars.
+INTENT_EXEMPLARS_PATH = os.getenv("INTENT_EXEMPLARS_PATH")
+# Number of nearest exemplars per label averaged into the label's score.
+INTENT_LOCAL_TOP_K = int(os.getenv("INTENT_LOCAL_TOP_K", 3))
+# The local label is only trusted when its score is at least INTENT_LOCAL_MIN_SIMILARITY and beats
+# the runner-up label by INTENT_LOCAL_MIN_MARGIN (cosine similarity). Tune with evaluate_intent_classifier.py.
+INTENT_LOCAL_MIN_SIMILARITY = float(os.getenv("INTENT_LOCAL_MIN_SIMILARITY", 0.5))
+INTENT_LOCAL_MIN_MARGIN = float(os.getenv("INTENT_LOCAL_MIN_MARGIN", 0.08))
+
+DEFAULT_EXEMPLARS = {
+    "greeting": [
+        "hi",
+        "hello",
+        "hey there",
+        "good morning",
+        "good afternoon",
+        "good evening",
+        "hello, how are you?",
+        "hi, how's it going?",
+        "hey, nice to meet you",
+        "greetings",
+        "hi there, I have a question",
+        "hello chatbot",
+    ],
+    "domain": [
+        "What are the fees for an international wire transfer?",
+        "How do I dispute a credit card transaction?",
+        "What is the interest rate on a savings account?",
+        "How long does a SEPA payment take to settle?",
+        "What documents are needed to open a business account?",
+        "How can I increase my credit card limit?",
+        "What is the chargeback policy for merchants?",
+        "How do I set up a recurring direct debit?",
+        "What are the requirements for a mortgage application?",
+        "Which currencies are supported for cross-border payments?",
+        "How is card payment authorization processed?",
+        "What are the KYC requirements for new customers?",
+        "How do I block a lost or stolen card?",
+        "What is the daily limit for ATM withdrawals?",
+        "How are settlement reports generated for merchants?",
+        "What are the anti-money laundering rules for large transfers?",
+        "Can I make payments with a virtual card?",
+        "What happens if a payment is declined?",
+    ],
+    "non-domain": [
+        "What's the weather like today?",
+        "Tell me a joke",
+        "Who won the football match last night?",
+        "Can you recommend a good movie?",
+        "How do I cook pasta?",
+        "Why is the sky blue?",
+        "Write a poem about the sea",
+        "What is the capital of Australia?",
+        "How do I fix my printer?",
+        "Are you a robot?",
+        "What is your favorite color?",
+        "Translate this sentence into French",
+        "How do I install Python on Windows?",
+        "Who is the president of France?",
+        "Give me a workout plan",
+    ],
+}
+
+
+def load_exemplars(path: Optional[str] = INTENT_EXEMPLARS_PATH) -> Dict[str, List[str]]:
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    return DEFAULT_EXEMPLARS
+
+
+class LocalIntentClassifier:
+    """
+    Nearest-exemplar intent classifier working on query embeddings, so it adds no model call
+    on top of the embedding the pipeline already computes.
+
+    Each label's score is the mean cosine similarity of the query to its INTENT_LOCAL_TOP_K closest
+    exemplars. The prediction is only confident when the best score is high enough and clearly
+    ahead of the runner-up; otherwise the caller falls back to the LLM.
+
+    Parameters:
+      - embedding_client: The EmbeddingClient used for queries (exemplars must share its vector space).
+      - exemplars: Labeled example queries. Defaults to INTENT_EXEMPLARS_PATH or the built-in set.
+    """
+
+    def __init__(self, embedding_client, exemplars: Optional[Dict[str, List[str]]] = None,
+                 min_similarity: float = INTENT_LOCAL_MIN_SIMILARITY, min_margin: float = INTENT_LOCAL_MIN_MARGIN):
+        self.embedding_client = embedding_client
+        self.exemplars = exemplars or load_exemplars()
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.engine: Optional[SimilarityEngine] = None
+        self._fit_lock = asyncio.Lock()
+
+    async def fit(self) -> None:
+        """
+        Embeds the exemplars (through the embedding cache) and builds one matrix per label.
+        """
+        async with self._fit_lock:
+            if self.engine is not None:
+                return
+            engine = SimilarityEngine(initial_capacity=64)
+            for label, texts in self.exemplars.items():
+                embeddings = await self.embedding_client.agenerate_embeddings(texts)
+                for i, embedding in enumerate(embeddings):
+                    engine.add(label, str(i), embedding)
+            self.engine = engine
+            logger.info("Local intent classifier ready with %d exemplars.", sum(len(texts) for texts in self.exemplars.values()))
+
+    def scores(self, query_embedding: np.ndarray) -> Dict[str, float]:
+        """
+        Returns the score of every label for the query embedding.
+        """
+        scores = {}
+        for label in self.exemplars:
+            matches = self.engine.search(label, query_embedding, INTENT_LOCAL_TOP_K)
+            scores[label] = float(np.mean([score for _, score in matches])) if matches else -1.0
+        return scores
+
+    async def classify(self, query_embedding: np.ndarray) -> Tuple[str, bool]:
+        """
+        Returns (label, confident) for the query embedding.
+        """
+        if self.engine is None:
+            await self.fit()
+        ranked = sorted(self.scores(query_embedding).items(), key=lambda item: item[1], reverse=True)
+        (label, best), runner_up = ranked[0], (ranked[1][1] if len(ranked) > 1 else -1.0)
+        return label, best >= self.min_similarity and best - runner_up >= self.min_margin
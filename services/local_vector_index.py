@@ -0,0 +1,407 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+from bson import ObjectId, json_util
+from pymongo.errors import OperationFailure
+from services.similarity_engine import GroupEmbeddingMatrix, SimilarityEngine
+from services.vector_search import VectorStore
+from utils.mongodb_client import MongoDBClient
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_SNAPSHOT_DIR = os.getenv("LOCAL_INDEX_SNAPSHOT_DIR", "./vector_index")
+# "polling" reads new chunks by increasing _id, "change_stream" also picks up updates and deletes.
+LOCAL_INDEX_REFRESH_MODE = os.getenv("LOCAL_INDEX_REFRESH_MODE", "polling")
+LOCAL_INDEX_REFRESH_SECONDS = float(os.getenv("LOCAL_INDEX_REFRESH_SECONDS", 30))
+# How often the refreshed index is written back as a snapshot (by one worker per snapshot directory).
+LOCAL_INDEX_SNAPSHOT_SECONDS = float(os.getenv("LOCAL_INDEX_SNAPSHOT_SECONDS", 600))
+# How long load() waits for the change stream to replay the changes since the snapshot (change_stream
+# mode). After that, searches are served from the snapshot while the refresh keeps retrying.
+LOCAL_INDEX_CATCH_UP_TIMEOUT_SECONDS = float(os.getenv("LOCAL_INDEX_CATCH_UP_TIMEOUT_SECONDS", 30))
+
+# Change stream errors meaning the resume token is no longer in the oplog (CappedPositionLost,
+# ChangeStreamFatalError, ChangeStreamHistoryLost); the index has to be rebuilt.
+RESUME_TOKEN_LOST_CODES = {136, 280, 286}
+
+METADATA_FIELDS = ["content", "document_name", "document_url", "document_type", "page_number", "file_link"]
+
+
+class Partition:
+    """
+    The chunks of one group: a read-only base matrix (memory-mapped from the snapshot)
+    plus a mutable delta of chunks added since the snapshot. Rows are L2-normalized.
+    """
+
+    def __init__(self, dim: int, base: Optional[np.ndarray] = None, base_rows: Optional[List[Dict]] = None):
+        self.base = base if base is not None else np.zeros((0, dim), dtype=np.float32)
+        self.base_rows = base_rows or []
+        self.base_alive = np.ones(len(self.base_rows), dtype=bool)
+        self.base_positions = {row["_id"]: i for i, row in enumerate(self.base_rows)}
+        self.delta = GroupEmbeddingMatrix(dim, initial_capacity=64)
+        self.delta_rows: Dict[str, Dict] = {}
+
+    def add(self, row: Dict, vector: np.ndarray) -> None:
+        self.remove(row["_id"])
+        self.delta.add(row["_id"], vector)
+        self.delta_rows[row["_id"]] = row
+
+    def remove(self, row_id: str) -> None:
+        position = self.base_positions.get(row_id)
+        if position is not None:
+            self.base_alive[position] = False
+        if self.delta.remove(row_id):
+            del self.delta_rows[row_id]
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, Dict]]:
+        matches = []
+        if len(self.base_rows):
+            scores = self.base @ query
+            scores[~self.base_alive] = -np.inf
+            top = min(k, len(scores))
+            candidates = np.argpartition(scores, -top)[-top:]
+            matches += [(float(scores[i]), self.base_rows[i]) for i in candidates if self.base_alive[i]]
+        matches += [(score, self.delta_rows[key]) for key, score in self.delta.top_k(query, k)]
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches[:k]
+
+    def rows(self):
+        """
+        Yields (row, vector) for every live chunk.
+        """
+        for i, row in enumerate(self.base_rows):
+            if self.base_alive[i]:
+                yield row, self.base[i]
+        for key, row in self.delta_rows.items():
+            yield row, self.delta.get(key)
+
+
+class SnapshotLock:
+    """
+    Exclusive lock on a snapshot directory (flock on a lock file), held by the worker that
+    rebuilds the index or writes a snapshot, so workers sharing the directory take turns.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, ".lock")
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Takes the lock, waiting for it if blocking. Returns False if it is held elsewhere and not blocking.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store serving searches from an in-process index built from the MongoDB chunk collection.
+
+    Every group gets its own partition, so a search only scores the chunks of the caller's group,
+    as a single matrix-vector product. The index is persisted as a snapshot (a float32 .npy file
+    plus JSON metadata) that workers memory-map at startup instead of rebuilding; the OS page cache
+    shares it between workers. After loading, the index is refreshed incrementally by polling for
+    new chunks or following a change stream, and written back as a new snapshot every
+    LOCAL_INDEX_SNAPSHOT_SECONDS.
+
+    In change_stream mode the snapshot records the stream's resume token, and a worker resumes
+    the stream from it, so the changes made while it was down are replayed before it serves a
+    search. If the token is missing or no longer in the oplog, the index is rebuilt. Rebuilds and
+    snapshot writes hold a lock on the snapshot directory: a worker that waited for another
+    one's rebuild loads the resulting snapshot instead of scanning the collection again.
+    """
+
+    def __init__(self, snapshot_dir: str = LOCAL_INDEX_SNAPSHOT_DIR, refresh_mode: str = LOCAL_INDEX_REFRESH_MODE):
+        self.snapshot_dir = snapshot_dir
+        self.refresh_mode = refresh_mode
+        self.collection_name = os.getenv("VECTOR_SEARCH_COLLECTION")
+        self.filter_field = os.getenv("VECTOR_SEARCH_FILTER_FIELD")
+        self.embedding_path = os.getenv("VECTOR_SEARCH_PATH")
+        self.partitions: Dict[str, Partition] = {}
+        self.dim: Optional[int] = None
+        self.last_id: Optional[ObjectId] = None
+        self.resume_token: Optional[Dict] = None
+        self._snapshot_lock = SnapshotLock(snapshot_dir)
+        self._last_snapshot_at = time.monotonic()
+        self._load_lock = asyncio.Lock()
+        self._loaded = False
+        # Set once the change stream has replayed everything since the snapshot (change_stream mode).
+        self._caught_up = asyncio.Event()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    # Building and refreshing
+
+    def _groups_of(self, doc: Dict) -> List[str]:
+        groups = doc.get(self.filter_field)
+        return [str(group) for group in (groups if isinstance(groups, list) else [groups]) if group is not None]
+
+    def _apply(self, doc: Dict) -> None:
+        """
+        Adds (or replaces) a chunk document in the partitions of its groups.
+        """
+        vector = SimilarityEngine.normalize(doc.get(self.embedding_path) or [])
+        if vector is None:
+            return
+        if self.dim is None:
+            self.dim = vector.shape[0]
+        row_id = str(doc["_id"])
+        self._remove(row_id)
+        for group in self._groups_of(doc):
+            row = {"_id": row_id, "group_id": group, **{field: doc.get(field) for field in METADATA_FIELDS}}
+            partition = self.partitions.get(group)
+            if partition is None:
+                partition = self.partitions[group] = Partition(self.dim)
+            partition.add(row, vector)
+        if self.last_id is None or doc["_id"] > self.last_id:
+            self.last_id = doc["_id"]
+
+    def _remove(self, row_id: str) -> None:
+        for partition in self.partitions.values():
+            partition.remove(row_id)
+
+    async def _poll(self, query: Optional[Dict] = None) -> int:
+        collection = await MongoDBClient.get_collection(self.collection_name)
+        query = query if query is not None else ({"_id": {"$gt": self.last_id}} if self.last_id else {})
+        count = 0
+        async for doc in collection.find(query).sort("_id", 1):
+            self._apply(doc)
+            count += 1
+        return count
+
+    async def _current_resume_token(self) -> Optional[Dict]:
+        """
+        Returns a resume token for the current position of the collection's change stream.
+        """
+        collection = await MongoDBClient.get_collection(self.collection_name)
+        async with collection.watch() as stream:
+            # The token (the server's post-batch resume token) is only read on the first fetch.
+            await stream.try_next()
+            return stream.resume_token
+
+    async def rebuild(self) -> None:
+        """
+        Builds the index from a full scan of the chunk collection and writes a snapshot.
+
+        In change_stream mode the resume token is taken before the scan, so changes made
+        during the scan are replayed (idempotently) when the stream resumes from it.
+        The current index keeps serving searches until the new one is complete.
+        """
+        resume_token = await self._current_resume_token() if self.refresh_mode == "change_stream" else None
+        builder = LocalVectorStore(self.snapshot_dir, self.refresh_mode)
+        count = await builder._poll({})
+        self.partitions, self.dim, self.last_id = builder.partitions, builder.dim or self.dim, builder.last_id
+        self.resume_token = resume_token
+        logger.info("Built local vector index from %d chunks in %d groups.", count, len(self.partitions))
+        await asyncio.to_thread(self.save_snapshot)
+
+    def _snapshot_usable(self) -> bool:
+        return self.refresh_mode != "change_stream" or self.resume_token is not None
+
+    def _snapshot_mtime(self) -> Optional[float]:
+        metadata_path = os.path.join(self.snapshot_dir, "index.json")
+        return os.path.getmtime(metadata_path) if os.path.exists(metadata_path) else None
+
+    async def _rebuild_or_reload(self) -> None:
+        """
+        Rebuilds the index under the snapshot lock. If another worker wrote a usable snapshot
+        while this one waited for the lock, that snapshot is loaded instead.
+        """
+        known_mtime = self._snapshot_mtime()
+        await asyncio.to_thread(self._snapshot_lock.acquire)
+        try:
+            if self._snapshot_mtime() != known_mtime and await asyncio.to_thread(self.load_snapshot) and self._snapshot_usable():
+                return
+            await self.rebuild()
+        finally:
+            self._snapshot_lock.release()
+
+    async def _maybe_snapshot(self) -> None:
+        """
+        Writes a snapshot once LOCAL_INDEX_SNAPSHOT_SECONDS have passed, unless another worker
+        holds the snapshot lock or has written one within that interval.
+        """
+        if time.monotonic() - self._last_snapshot_at < LOCAL_INDEX_SNAPSHOT_SECONDS:
+            return
+        self._last_snapshot_at = time.monotonic()
+        if not await asyncio.to_thread(self._snapshot_lock.acquire, False):
+            return
+        try:
+            mtime = self._snapshot_mtime()
+            if mtime is None or time.time() - mtime >= LOCAL_INDEX_SNAPSHOT_SECONDS:
+                await asyncio.to_thread(self.save_snapshot)
+        finally:
+            self._snapshot_lock.release()
+
+    async def _follow_change_stream(self) -> None:
+        if self.resume_token is None:
+            await self._rebuild_or_reload()
+        collection = await MongoDBClient.get_collection(self.collection_name)
+        try:
+            async with collection.watch(full_document="updateLookup", resume_after=self.resume_token) as stream:
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is None:
+                        # Everything since the resume token has been applied.
+                        self._caught_up.set()
+                    elif change["operationType"] == "delete":
+                        self._remove(str(change["documentKey"]["_id"]))
+                    elif change.get("fullDocument") is not None:
+                        self._apply(change["fullDocument"])
+                    if stream.resume_token is not None:
+                        self.resume_token = stream.resume_token
+                    await self._maybe_snapshot()
+        except OperationFailure as e:
+            if e.code in RESUME_TOKEN_LOST_CODES:
+                logger.warning("Local vector index resume token expired, rebuilding the index.")
+                self.resume_token = None
+            raise
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                if self.refresh_mode == "change_stream":
+                    await self._follow_change_stream()
+                else:
+                    count = await self._poll()
+                    if count:
+                        logger.info("Added %d new chunks to the local vector index.", count)
+                    await self._maybe_snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Local vector index refresh failed: %s", e)
+            await asyncio.sleep(LOCAL_INDEX_REFRESH_SECONDS)
+
+    async def load(self) -> None:
+        """
+        Loads the snapshot (or builds the index if there is none) and starts the background refresh.
+        In change_stream mode, returns once the changes made since the snapshot have been replayed,
+        or after LOCAL_INDEX_CATCH_UP_TIMEOUT_SECONDS (the snapshot is then served as it is).
+        """
+        async with self._load_lock:
+            if self._loaded:
+                return
+            if not await asyncio.to_thread(self.load_snapshot):
+                await self._rebuild_or_reload()
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+            if self.refresh_mode == "change_stream":
+                try:
+                    await asyncio.wait_for(self._caught_up.wait(), LOCAL_INDEX_CATCH_UP_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning("Local vector index change stream did not catch up within %.0fs, "
+                                   "serving the snapshot until it does.", LOCAL_INDEX_CATCH_UP_TIMEOUT_SECONDS)
+            self._loaded = True
+
+    async def warmup(self) -> None:
+        await self.load()
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    # Snapshots
+
+    def save_snapshot(self) -> None:
+        """
+        Writes all live chunks to a new snapshot. The matrix file is written first and the
+        metadata file (which names it) is swapped in atomically, so readers never see a partial snapshot.
+        """
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        vectors, rows, partitions = [], [], {}
+        for group, partition in self.partitions.items():
+            start = len(rows)
+            for row, vector in partition.rows():
+                rows.append(row)
+                vectors.append(vector)
+            partitions[group] = [start, len(rows)]
+        matrix_file = f"embeddings-{uuid.uuid4().hex}.npy"
+        matrix = np.stack(vectors).astype(np.float32) if vectors else np.zeros((0, self.dim or 0), dtype=np.float32)
+        np.save(os.path.join(self.snapshot_dir, matrix_file), matrix)
+        metadata = {
+            "matrix_file": matrix_file,
+            "dim": self.dim,
+            "last_id": str(self.last_id) if self.last_id else None,
+            "resume_token": json_util.dumps(self.resume_token) if self.resume_token is not None else None,
+            "created_at": time.time(),
+            "partitions": partitions,
+            "rows": rows,
+        }
+        metadata_path = os.path.join(self.snapshot_dir, "index.json")
+        with open(metadata_path + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(metadata_path + ".tmp", metadata_path)
+        self._last_snapshot_at = time.monotonic()
+        # Keep the previous matrix around for workers that are still loading it.
+        matrices = sorted(glob.glob(os.path.join(self.snapshot_dir, "embeddings-*.npy")), key=os.path.getmtime)
+        for stale in matrices[:-2]:
+            os.remove(stale)
+
+    def load_snapshot(self) -> bool:
+        """
+        Memory-maps the latest snapshot. Returns False if there is none.
+        """
+        metadata_path = os.path.join(self.snapshot_dir, "index.json")
+        if not os.path.exists(metadata_path):
+            return False
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        matrix = np.load(os.path.join(self.snapshot_dir, metadata["matrix_file"]), mmap_mode="r")
+        self.dim = metadata["dim"]
+        self.last_id = ObjectId(metadata["last_id"]) if metadata["last_id"] else None
+        resume_token = metadata.get("resume_token")
+        self.resume_token = json_util.loads(resume_token) if resume_token else None
+        rows = metadata["rows"]
+        self.partitions = {
+            group: Partition(self.dim, matrix[start:end], rows[start:end])
+            for group, (start, end) in metadata["partitions"].items()
+        }
+        logger.info("Loaded local vector index snapshot with %d chunks in %d groups.", len(rows), len(self.partitions))
+        return True
+
+    # Search
+
+    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3, **options) -> Tuple[List[Dict], float]:
+        """
+        Perform a vector search over the group's partition.
+        Returns a tuple containing the search results and the execution time in milliseconds.
+
+        The score is (1 + cosine similarity) / 2, the same scale as Atlas' vectorSearchScore.
+        """
+        if not self._loaded:
+            await self.load()
+        start_time = time.perf_counter()
+        results = []
+        query = SimilarityEngine.normalize(query_embedding)
+        partition = self.partitions.get(authorization_filter)
+        if partition is not None and query is not None:
+            for score, row in partition.search(query, limit):
+                result = {key: value for key, value in row.items() if key != "_id"}
+                result["score"] = (1 + score) / 2
+                results.append(result)
+        end_time = time.perf_counter()
+
+        duration_ms = (end_time - start_time) * 1000
+        return results, duration_ms
@@ -0,0 +1,124 @@
+import os
+import time
+from typing import List, Dict, Tuple, Optional
+from services.vector_search import VectorStore
+from utils.postgres_client import PostgresClient
+from dotenv import load_dotenv
+load_dotenv()
+
+PGVECTOR_TABLE = os.getenv("PGVECTOR_TABLE", "document_chunks")
+# HNSW build parameters, used when the index is created.
+PGVECTOR_HNSW_M = int(os.getenv("PGVECTOR_HNSW_M", 16))
+PGVECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", 64))
+# Default size of the HNSW candidate list at query time; can be overridden per query.
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", 100))
+# pgvector >= 0.8 only: "relaxed_order" or "strict_order" keeps scanning the graph until
+# enough rows pass the group filter. Empty leaves the server default.
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN", "")
+
+COLUMNS = ["content", "document_name", "document_url", "document_type", "page_number", "group_id", "file_link"]
+
+
+def to_vector_literal(embedding) -> str:
+    """
+    Formats an embedding as a pgvector text literal, e.g. '[0.1,0.2]'.
+    """
+    if hasattr(embedding, "tolist"):
+        embedding = embedding.tolist()
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+class PgVectorStore(VectorStore):
+    """
+    Vector store backed by Postgres with the pgvector extension.
+
+    Chunks live in one table with an indexed group_id column for authorization
+    filtering and an HNSW index (cosine distance) on the embedding column.
+    Connections come from the shared asyncpg pool.
+    """
+
+    def __init__(self, table: str = PGVECTOR_TABLE):
+        self.table = table
+
+    async def warmup(self) -> None:
+        # Opens the pool with its POSTGRES_MIN_POOL_SIZE connections.
+        await PostgresClient.connect()
+
+    async def close(self) -> None:
+        await PostgresClient.close_connection()
+
+    async def ensure_schema(self, dimension: int) -> None:
+        """
+        Creates the extension, chunk table and its group_id and HNSW indexes if they do not exist.
+        """
+        pool = await PostgresClient.get_pool()
+        async with pool.acquire() as connection:
+            await connection.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            await connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    id BIGSERIAL PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    document_name TEXT,
+                    document_url TEXT,
+                    document_type TEXT,
+                    page_number INTEGER,
+                    group_id TEXT NOT NULL,
+                    file_link TEXT,
+                    embedding VECTOR({int(dimension)}) NOT NULL
+                )
+            """)
+            await connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_group_id_idx ON {self.table} (group_id)")
+            await connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_embedding_hnsw_idx ON {self.table} "
+                f"USING hnsw (embedding vector_cosine_ops) "
+                f"WITH (m = {PGVECTOR_HNSW_M}, ef_construction = {PGVECTOR_HNSW_EF_CONSTRUCTION})"
+            )
+
+    async def insert_chunks(self, chunks: List[Dict]) -> None:
+        """
+        Inserts chunks (dicts with the table columns and an 'embedding') in one batch.
+        """
+        pool = await PostgresClient.get_pool()
+        rows = [
+            tuple(chunk.get(column) for column in COLUMNS) + (to_vector_literal(chunk["embedding"]),)
+            for chunk in chunks
+        ]
+        async with pool.acquire() as connection:
+            await connection.executemany(
+                f"INSERT INTO {self.table} ({', '.join(COLUMNS)}, embedding) "
+                f"VALUES ($1, $2, $3, $4, $5, $6, $7, $8::vector)",
+                rows,
+            )
+
+    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3,
+                     ef_search: Optional[int] = None, **options) -> Tuple[List[Dict], float]:
+        """
+        Perform an HNSW vector search restricted to the group.
+        Returns a tuple containing the search results and the execution time in milliseconds.
+
+        Parameters:
+          - ef_search: Optional; HNSW candidate list size for this query (higher is more accurate
+                       and slower). Defaults to PGVECTOR_EF_SEARCH.
+
+        The score is (1 + cosine similarity) / 2, the same scale as Atlas' vectorSearchScore.
+        """
+        pool = await PostgresClient.get_pool()
+        query = (
+            f"SELECT {', '.join(COLUMNS)}, 1 - (embedding <=> $1::vector) / 2 AS score "
+            f"FROM {self.table} WHERE group_id = $2 "
+            f"ORDER BY embedding <=> $1::vector LIMIT $3"
+        )
+
+        start_time = time.perf_counter()
+        async with pool.acquire() as connection:
+            # SET LOCAL scopes the tuning to this transaction, so pooled connections stay clean.
+            async with connection.transaction():
+                await connection.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search or PGVECTOR_EF_SEARCH))
+                if PGVECTOR_ITERATIVE_SCAN:
+                    await connection.execute("SELECT set_config('hnsw.iterative_scan', $1, true)", PGVECTOR_ITERATIVE_SCAN)
+                records = await connection.fetch(query, to_vector_literal(query_embedding), authorization_filter, limit)
+        end_time = time.perf_counter()
+
+        results = [dict(record) for record in records]
+        duration_ms = (end_time - start_time) * 1000
+        return results, duration_ms
@@ -1,45 +1,82 @@
+import asyncio
+import hashlib
+import logging
+import os
 from typing import List, Optional
 import numpy as np
+from utils.lru_cache import LRUCache
+from utils.micro_batcher import MicroBatcher
+from utils.redis_client import RedisClient
+from utils.text_normalization import normalize_text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# In-process cache tier: number of embeddings kept per worker.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+# Shared Redis cache tier: how long an embedding is kept (default 7 days). Set to 0 to disable the Redis tier.
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# Texts requested within this window are embedded in one vendor call.
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 64))
+
 
 class EmbeddingClient:
     """
     A client for generating text embeddings using either OpenAI or Cohere.
-    
+
     Parameters:
       - vendor: A string identifier for the vendor ("openai" or "cohere").
       - api_key: The API key for the chosen vendor.
       - model: (Optional) The model name; defaults are provided if not specified.
+
+    The async API (agenerate_embeddings) batches concurrent requests into a single vendor
+    call and caches results in two tiers: an in-process LRU and a shared Redis tier. Both are
+    keyed by a hash of (vendor, model, normalized text) and hold float32 vectors.
     """
-    
+
     def __init__(self, vendor: str, api_key: str, model: Optional[str] = None):
         self.vendor = vendor.lower()
         self.api_key = api_key
         self.model = model
-        
+
         if self.vendor == "openai":
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
             self.client = OpenAI(api_key=self.api_key)
+            self.async_client = AsyncOpenAI(api_key=self.api_key)
             if self.model is None:
                 self.model = "text-embedding-3-small"
         elif self.vendor == "cohere":
             import cohere
             self.client = cohere.Client(api_key=self.api_key)
+            self.async_client = cohere.AsyncClient(api_key=self.api_key)
             if self.model is None:
                 self.model = "embed-english-v3.0"
         elif self.vendor == "sentence_transformers":
-            from sentence_transformers import SentenceTransformer
+            from services.embedding_worker_pool import EmbeddingWorkerPool
             self.model = "sentence-transformers/all-MiniLM-L6-v2"
-            self.model_instance = SentenceTransformer(self.model)
+            # The model runs in dedicated worker processes, which also batch concurrent texts.
+            self.worker_pool = EmbeddingWorkerPool(self.model)
         else:
             raise ValueError(f"Unsupported vendor: {vendor}")
-    
+
+        self._lru = LRUCache(EMBEDDING_CACHE_SIZE)
+        # Embeddings currently being computed, keyed like the cache.
+        self._inflight = {}
+        if self.vendor == "sentence_transformers":
+            self._batcher = self.worker_pool.batcher
+        else:
+            self._batcher = MicroBatcher(self._embed_batch, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_wait_ms=EMBEDDING_BATCH_WAIT_MS)
+
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generates embeddings for the given text.
-        
+
         Parameters:
           - text: The input text for which to generate the embedding.
-        
+
         Returns:
           - A list of floats representing the embedding vector.
         """
@@ -59,10 +96,106 @@ class EmbeddingClient:
                 embedding_types=["float"]
             )
             # Returns the embedding vector for the text (the first in the list)
-            return res.embeddings[0]
+            return self._cohere_floats(res)[0]
         elif self.vendor == "sentence_transformers":
-            embedding = self.model_instance.encode([text])[0]
-            if isinstance(embedding, np.ndarray):
-               embedding = embedding.tolist()
-            return embedding
+            return self.worker_pool.encode_sync([text])[0].tolist()
+
+    @staticmethod
+    def _cohere_floats(res) -> List[List[float]]:
+        # With embedding_types set, Cohere returns the vectors grouped by type.
+        embeddings = res.embeddings
+        return embeddings.float_ if hasattr(embeddings, "float_") else embeddings
 
+    def _cache_key(self, normalized_text: str) -> str:
+        digest = hashlib.sha256(f"{self.vendor}:{self.model}\x00{normalized_text}".encode("utf-8")).hexdigest()
+        return f"embedding:{digest}"
+
+    async def _embed_batch(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embeds a batch of texts with a single vendor call (sentence_transformers batches in its worker pool).
+        """
+        if self.vendor == "openai":
+            response = await self.async_client.embeddings.create(input=texts, model=self.model)
+            vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        elif self.vendor == "cohere":
+            res = await self.async_client.embed(
+                texts=texts,
+                model=self.model,
+                input_type="search_query",
+                embedding_types=["float"]
+            )
+            vectors = self._cohere_floats(res)
+        else:
+            raise ValueError(f"Vendor {self.vendor} does not embed through the client batcher.")
+        return [np.asarray(vector, dtype=np.float32) for vector in vectors]
+
+    async def agenerate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Generates embeddings for several texts, serving repeated texts from the cache.
+
+        Parameters:
+          - texts: The input texts.
+
+        Returns:
+          - A float32 array of shape (len(texts), dimension).
+        """
+        keys = [self._cache_key(normalize_text(text)) for text in texts]
+        vectors = {key: self._lru.get(key) for key in set(keys)}
+
+        # Second tier: the shared Redis cache (best effort).
+        missing = [key for key, vector in vectors.items() if vector is None]
+        if missing and EMBEDDING_CACHE_TTL_SECONDS > 0:
+            try:
+                for key, raw in zip(missing, await RedisClient.mget(missing, binary=True)):
+                    if raw is not None:
+                        vectors[key] = np.frombuffer(raw, dtype=np.float32)
+                        self._lru.set(key, vectors[key])
+            except Exception as e:
+                logger.warning("Embedding cache lookup in Redis failed: %s", e)
+
+        # Whatever is left goes to the vendor, batched with concurrent requests. A text that is
+        # already being embedded for another request is awaited rather than requested again.
+        first_text = dict(zip(reversed(keys), reversed(texts)))
+        for key in [key for key, vector in vectors.items() if vector is None]:
+            vectors[key] = self._lru.get(key)
+        missing = [key for key, vector in vectors.items() if vector is None]
+        owned = []
+        for key in missing:
+            if key not in self._inflight:
+                future = asyncio.ensure_future(self._batcher.submit(first_text[key]))
+                future.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+                self._inflight[key] = future
+                owned.append(key)
+        if missing:
+            # Shielded so that a cancelled request does not cancel the embedding for other waiters.
+            computed = await asyncio.gather(*[asyncio.shield(self._inflight[key]) for key in missing])
+            vectors.update(zip(missing, computed))
+            for key in owned:
+                self._lru.set(key, vectors[key])
+            if owned and EMBEDDING_CACHE_TTL_SECONDS > 0:
+                try:
+                    await RedisClient.mset({key: vectors[key].tobytes() for key in owned}, ex=EMBEDDING_CACHE_TTL_SECONDS, binary=True)
+                except Exception as e:
+                    logger.warning("Embedding cache write to Redis failed: %s", e)
+
+        return np.stack([vectors[key] for key in keys])
+
+    async def warmup(self) -> None:
+        """
+        Starts the model replicas (sentence_transformers) and embeds one text through the batcher.
+        The LRU and Redis tiers are bypassed, so the vendor connection (or worker pool) is always
+        exercised even when the warmup text is already cached.
+        """
+        if self.vendor == "sentence_transformers":
+            await self.worker_pool.warmup()
+        await self._batcher.submit("warmup")
+
+    def close(self) -> None:
+        if self.vendor == "sentence_transformers":
+            self.worker_pool.close()
+
+    async def agenerate_embedding(self, text: str) -> np.ndarray:
+        """
+        Generates the embedding of a single text as a float32 vector (see agenerate_embeddings).
+        """
+        return (await self.agenerate_embeddings([text]))[0]
@@ -1,6 +1,28 @@
 from typing import List, Optional
 from utils.langchain_client import LangChainClient
 
+# Static instructions, sent as the system message so that vendors can cache this prompt prefix.
+REFORMULATION_SYSTEM_PROMPT = (
+    "# Query Reformulation Task\n\n"
+    "## Context : \n"
+    "You are an AI assistant helping to reformulate a user query to improve retrieval and search from a vector database.\n\n"
+    "## Instructions\n"
+    "1. Analyze if this query is a follow-up question that depends on previous context\n"
+    "2. If it's a follow-up, explicitly incorporate relevant entities and context from the conversation history, if it is not a follow up question do not add context from previous history\n"
+    "3. Expand any ambiguous terms, acronyms, or pronouns (like 'it', 'they', 'this')\n"
+    "4. Add specificity to improve vector search accuracy\n"
+    "5. Maintain the original intent and core question\n"
+    "6. Do not add unnecessary information that could dilute the search\n"
+    "7. Keep the reformulation concise and focused\n\n"
+    "**very important** :  Do not always add context from previous history if the new query is not related to the previous ones\n if the new query has different intent, do not add context from previous history\n"
+)
+# Variable part of the prompt, sent after the system prompt.
+REFORMULATION_PROMPT = (
+    "## Conversation History\n{history}\n\n"
+    "## Original Query\n{query}\n\n"
+    "## Reformulated Query : \n"
+)
+
 class QueryReformulationService:
     """
     Service for query reformulation using LangChainClient.
@@ -28,31 +50,17 @@ class QueryReformulationService:
           - query: The original user query.
           - short_term_memory: A list of recent messages (could be empty if none).
           - prompt: Optional custom prompt to guide the reformulation process. If not provided, 
-                    a default prompt is used.
+                    the default system prompt and prompt are used.
                     
         Returns:
           - A string containing the reformulated query.
         """
         if prompt is None:
-          prompt = (
-              "# Query Reformulation Task\n\n"
-              "## Context : \n"
-              "You are an AI assistant helping to reformulate a user query to improve retrieval and search from a vector database.\n\n"
-              "## Conversation History\n{history}\n\n"
-              "## Original Query\n{query}\n\n"
-              "## Instructions\n"
-              "1. Analyze if this query is a follow-up question that depends on previous context\n"
-              "2. If it's a follow-up, explicitly incorporate relevant entities and context from the conversation history, if it is not a follow up question do not add context from previous history\n"
-              "3. Expand any ambiguous terms, acronyms, or pronouns (like 'it', 'they', 'this')\n"
-              "4. Add specificity to improve vector search accuracy\n"
-              "5. Maintain the original intent and core question\n"
-              "6. Do not add unnecessary information that could dilute the search\n"
-              "7. Keep the reformulation concise and focused\n\n"
-              "**very important** :  Do not always add context from previous history if the new query is not related to the previous ones\n if the new query has different intent, do not add context from previous history\n"
-              "## Reformulated Query : \n"
-          )
+            prompt, system_prompt = REFORMULATION_PROMPT, REFORMULATION_SYSTEM_PROMPT
+        else:
+            system_prompt = None
         
-        reformulated = await self.langchain_client.reformulate_query(query, short_term_memory, prompt)
+        reformulated = await self.langchain_client.reformulate_query(query, short_term_memory, prompt, system_prompt)
         return reformulated
 
 
@@ -1,59 +1,196 @@
 # services/reranker.py
 
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 import os
 from dotenv import load_dotenv
+from utils.micro_batcher import MicroBatcher
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Per-request timeout, after which the vector search ordering is used instead.
+RERANKER_TIMEOUT_SECONDS = float(os.getenv("RERANKER_TIMEOUT_SECONDS", 2.0))
+# Requests arriving within this window are coalesced into one batch.
+RERANKER_BATCH_WAIT_MS = float(os.getenv("RERANKER_BATCH_WAIT_MS", 5))
+RERANKER_MAX_BATCH_SIZE = int(os.getenv("RERANKER_MAX_BATCH_SIZE", 16))
+# Token limit for each (query, document) pair fed to the local cross-encoder; longer pairs are truncated.
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", 512))
+# Pairs scored per forward pass by the local cross-encoder.
+RERANKER_FORWARD_BATCH_SIZE = int(os.getenv("RERANKER_FORWARD_BATCH_SIZE", 64))
+
+# Local cross-encoder models, loaded once per worker process and keyed by (model, max_length).
+_local_models: Dict[Tuple[str, int], Any] = {}
+# Held while a model loads, so the reranker and the grounding scorer (warming up in threads) never load it twice.
+_local_models_lock = threading.Lock()
+
+
+def load_cross_encoder(model: str, max_length: int = RERANKER_MAX_LENGTH):
+    """
+    Returns the CPU cross-encoder for the model, loading it on first use.
+    The model can be a Hugging Face model name or a local directory (for offline use).
+    """
+    key = (model, max_length)
+    with _local_models_lock:
+        if key not in _local_models:
+            from sentence_transformers import CrossEncoder
+            _local_models[key] = CrossEncoder(model, max_length=max_length, device="cpu")
+        return _local_models[key]
+
 class Reranker:
     """
     Reranker service using a specified vendor to rank document relevance.
-    
+
     Currently supports:
-      - cohere (using the rerank API)
-    
+      - cohere (using the async rerank API)
+      - local (an on-box sentence-transformers cross-encoder running on CPU, no API key needed)
+
+    Concurrent rerank requests are coalesced by a MicroBatcher. For cohere, identical
+    (query, documents, top_n) requests within a batch share a single vendor call and the
+    remaining ones are sent concurrently (the rerank API takes a single query per call).
+    For local, the (query, document) pairs of every request in the batch are scored in
+    one forward pass.
+
     Methods:
-      - rerank(query: str, documents: List[str], top_n: Optional[int] = None)
+      - rerank(query: str, documents: List[str], top_n: Optional[int] = None, fallback_scores: Optional[List[float]] = None)
           Ranks the documents by their relevance to the provided query and returns
           a list of dictionaries containing the document index and relevance score.
     """
-    
-    def __init__(self, vendor: str, api_key: str, model: Optional[str] = None):
+
+    def __init__(self, vendor: str, api_key: Optional[str] = None, model: Optional[str] = None, timeout: float = RERANKER_TIMEOUT_SECONDS,
+                 max_length: int = RERANKER_MAX_LENGTH):
         """
         Initializes the reranker client.
-        
+
         Parameters:
-          - vendor: The LLM vendor, e.g. "cohere".
-          - api_key: The API key for the vendor.
-          - model: Optional; the model to use. For Cohere, defaults to "rerank-v3.5".
+          - vendor: The LLM vendor, e.g. "cohere" or "local".
+          - api_key: The API key for the vendor (unused for "local").
+          - model: Optional; the model to use. For Cohere, defaults to "rerank-v3.5", for local
+                   to "cross-encoder/ms-marco-MiniLM-L-6-v2".
+          - timeout: Seconds to wait for a ranking before falling back to the vector search order.
+          - max_length: Token limit per (query, document) pair for the local cross-encoder.
         """
         self.vendor = vendor.lower()
         self.api_key = api_key
-        
+        self.timeout = timeout
+
         if self.vendor == "cohere":
             import cohere
-            # Using the ClientV2 for reranking functionality.
-            self.client = cohere.ClientV2(api_key=self.api_key)
+            # Using the async ClientV2 so reranking never blocks the event loop.
+            self.client = cohere.AsyncClientV2(api_key=self.api_key)
             self.model = model if model is not None else "rerank-v3.5"
+        elif self.vendor == "local":
+            self.model = model if model is not None else "cross-encoder/ms-marco-MiniLM-L-6-v2"
+            self.max_length = max_length
+            # Loaded on first use, or ahead of time by warmup().
+            self.client = None
         else:
             raise ValueError(f"Unsupported vendor: {vendor}")
-    
-    def rerank(self, query: str, documents: List[str], top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+
+        self._batcher = MicroBatcher(self._rerank_batch, max_batch_size=RERANKER_MAX_BATCH_SIZE, max_wait_ms=RERANKER_BATCH_WAIT_MS)
+
+    async def _rerank_one(self, query: str, documents: List[str], top_n: int) -> List[Dict[str, Any]]:
+        if self.vendor == "cohere":
+            result = await self.client.rerank(
+                model=self.model,
+                query=query,
+                documents=documents,
+                top_n=top_n
+            )
+            # The result is expected to contain a key "results" with the list of rankings.
+            return [
+                {"index": ranking.index, "relevance_score": ranking.relevance_score}
+                for ranking in result.results
+            ]
+        else:
+            raise ValueError(f"Vendor {self.vendor} not supported for reranking.")
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        Scores (query, document) pairs with the local cross-encoder (blocking, run in a thread).
+
+        The sigmoid is passed explicitly: it overrides the model's default activation (Identity for
+        the ms-marco cross-encoders, Sigmoid otherwise), so the logits are squashed exactly once into
+        the same 0-1 relevance scale as the Cohere scores (the relevance cutoff in retrieval relies on it).
+        """
+        import torch
+        if self.client is None:
+            self.client = load_cross_encoder(self.model, self.max_length)
+        scores = self.client.predict(pairs, batch_size=RERANKER_FORWARD_BATCH_SIZE, show_progress_bar=False,
+                                     activation_fct=torch.nn.Sigmoid())
+        return [float(score) for score in scores]
+
+    async def _rerank_local_batch(self, items: List[Tuple[str, Tuple[str, ...], int]]) -> List[List[Dict[str, Any]]]:
+        """
+        Ranks a batch of requests with a single cross-encoder forward pass over all their pairs.
+        """
+        pairs = [(query, document) for query, documents, _ in items for document in documents]
+        scores = await asyncio.to_thread(self._score_pairs, pairs) if pairs else []
+        rankings, offset = [], 0
+        for _, documents, top_n in items:
+            item_scores = scores[offset:offset + len(documents)]
+            offset += len(documents)
+            order = sorted(range(len(documents)), key=lambda i: item_scores[i], reverse=True)
+            rankings.append([{"index": i, "relevance_score": item_scores[i]} for i in order[:top_n]])
+        return rankings
+
+    async def _rerank_batch(self, items: List[Tuple[str, Tuple[str, ...], int]]) -> List[List[Dict[str, Any]]]:
+        """
+        Ranks a batch of (query, documents, top_n) requests, making one vendor call per distinct request.
+        """
+        if self.vendor == "local":
+            return await self._rerank_local_batch(items)
+        unique = list(dict.fromkeys(items))
+        rankings = await asyncio.gather(
+            *(self._rerank_one(query, list(documents), top_n) for query, documents, top_n in unique),
+            return_exceptions=True,
+        )
+        by_item = dict(zip(unique, rankings))
+        # A failed call is returned as its exception so it only affects the requests that made it.
+        return [by_item[item] for item in items]
+
+    async def warmup(self) -> None:
+        """
+        Loads the local cross-encoder and scores one pair, so the first request pays no load time.
+        """
+        if self.vendor == "local":
+            await asyncio.to_thread(self._score_pairs, [("warmup", "warmup")])
+
+    @staticmethod
+    def fallback_ranking(documents: List[str], fallback_scores: Optional[List[float]], top_n: int) -> List[Dict[str, Any]]:
+        """
+        Ranking used when the reranker is unavailable: the vector search order and scores.
+
+        Vector search scores are not on the reranker's 0-1 relevance scale, so each entry is
+        flagged with "fallback": True and callers should not apply a relevance cutoff to it.
+        """
+        scores = fallback_scores if fallback_scores is not None else [1.0] * len(documents)
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        return [{"index": i, "relevance_score": scores[i], "fallback": True} for i in order[:top_n]]
+
+    async def rerank(self, query: str, documents: List[str], top_n: Optional[int] = None,
+                     fallback_scores: Optional[List[float]] = None) -> List[Dict[str, Any]]:
         """
         Ranks the provided documents by relevance to the query.
-        
+
         Parameters:
           - query: The input query string.
           - documents: A list of document strings to be reranked.
-          - top_n: Optional; the maximum number of top documents to return. 
+          - top_n: Optional; the maximum number of top documents to return.
                    If not provided, returns scores for all documents.
-        
+          - fallback_scores: Optional; the vector search score of each document. If the reranker
+                   times out or fails, documents are ranked by these scores instead.
+
         Returns:
           - A list of dictionaries, each containing:
               * index: The index of the document in the original list.
               * relevance_score: The relevance score (as a float between 0 and 1).
-          
+              * fallback: Only present (True) when the reranker timed out or failed; the
+                entries are then in vector search order with vector search scores.
+
           Example output:
             [
               {"index": 3, "relevance_score": 0.9990564},
@@ -64,21 +201,14 @@ class Reranker:
         # If top_n is not specified, return scores for all documents.
         if top_n is None:
             top_n = len(documents)
-        
-        if self.vendor == "cohere":
-            result = self.client.rerank(
-                model=self.model,
-                query=query,
-                documents=documents,
-                top_n=top_n
-            )
-            # The result is expected to contain a key "results" with the list of rankings.
-            ranked_results = []
-            for idx, result in enumerate(result.results):
-                ranked_results.append({
-                    "index": result.index,
-                    "relevance_score": result.relevance_score
-                })
-            return ranked_results
-        else:
-            raise ValueError(f"Vendor {self.vendor} not supported for reranking.")
+
+        try:
+            result = await asyncio.wait_for(self._batcher.submit((query, tuple(documents), top_n)), self.timeout)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        except asyncio.TimeoutError:
+            logger.warning("Reranking timed out after %.1fs, falling back to vector search order.", self.timeout)
+        except Exception as e:
+            logger.warning("Reranking failed (%s), falling back to vector search order.", e)
+        return self.fallback_ranking(documents, fallback_scores, top_n)
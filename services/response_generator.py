@@ -1,5 +1,70 @@
-from typing import List, Dict, Optional
-from utils.langchain_client import LangChainClient
+import os
+import re
+from typing import List, Dict, Optional, Tuple, AsyncIterator
+from utils.langchain_client import LangChainClient, LLM_MAX_TOKENS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Output token limit of a generated answer.
+RESPONSE_MAX_TOKENS = int(os.getenv("RESPONSE_MAX_TOKENS", LLM_MAX_TOKENS))
+
+# Static instructions, sent as the system message so that vendors can cache this prompt prefix.
+RESPONSE_SYSTEM_PROMPT = (
+    "# Expert Response Generation Task\n\n"
+    "## Context and Role\n"
+    "You are an expert AI assistant tasked with providing accurate, concise answers based solely on the provided documents. Your response must be fully grounded in these documents with no external knowledge or speculation.\n\n"
+    "## Response Requirements\n"
+    "1. Provide a clear, direct answer to the query based only on the provided documents\n"
+    "2. Use inline citations in the format [1], [2], etc. after each sentence or claim\n"
+    "3. If multiple documents support a claim, include all relevant citations: [1][3]\n"
+    "4. If information is not found in the documents, state this clearly rather than speculating\n"
+    "5. Synthesize information across documents when relevant\n"
+    "6. Prioritize the most relevant information to the query\n"
+    "7. Make sure to display any list or table information in a pretty way (markdown) \n"
+    "8. Keep your answer concise and focused \n"
+    "9. Use objective, factual language\n\n"
+    "## References Section Format\n"
+    "After your answer, include a 'References:' section with each cited source listed as:\n"
+    "[#] Document: [document_name] | Page: [page_number] | Source: [file_link]\n\n"
+    "## Answer Format\n"
+    "[Your concise, well-structured answer with proper citations]\n\n"
+    "References:\n"
+    "[1] Document: [document_name] | Page: [page_number] | Source: [file_link]\n"
+    "[2] Document: [document_name] | Page: [page_number] | Source: [file_link]\n"
+    "...\n"
+)
+# Variable part of the prompt, sent after the system prompt.
+RESPONSE_PROMPT = (
+    "## Documents\n"
+    "{documents}\n\n"
+    "## User Query\n"
+    "{query}\n\n"
+    "## Answer:"
+)
+
+REPAIR_SYSTEM_PROMPT = (
+    "# Answer Repair Task\n\n"
+    "## Instructions\n"
+    "You are given documents, a user query, the current answer to it, and a numbered list of sentences taken from the current answer that are not supported by the documents. For each of them:\n"
+    "1. Rewrite it so that it only states what the documents support, keeping its role in the answer\n"
+    "2. Use inline citations in the format [1], [2], etc., numbered like the documents\n"
+    "3. If the documents do not support any version of the sentence, write REMOVE instead\n"
+    "4. Do not rewrite or repeat any other part of the answer\n\n"
+    "## Output Format\n"
+    "Return exactly one line per sentence, numbered like the input: <number>. <rewritten sentence or REMOVE>\n"
+)
+REPAIR_PROMPT = (
+    "## Documents\n"
+    "{documents}\n\n"
+    "## User Query\n"
+    "{query}\n\n"
+    "## Current Answer\n"
+    "{response}\n\n"
+    "## Unsupported Sentences\n"
+    "{sentences}\n\n"
+    "## Repaired Sentences:"
+)
 
 class ResponseGeneratorService:
     """
@@ -10,7 +75,7 @@ class ResponseGeneratorService:
     page number, and file link for each cited document.
     """
     
-    def __init__(self, vendor: str, model_name: str, api_key: str):
+    def __init__(self, vendor: str, model_name: str, api_key: str, max_tokens: int = RESPONSE_MAX_TOKENS):
         """
         Initializes the ResponseGeneratorService with a LangChainClient.
         
@@ -18,10 +83,41 @@ class ResponseGeneratorService:
           - vendor: The LLM vendor (e.g., "openai").
           - model_name: The model name to be used.
           - api_key: The API key for the vendor.
+          - max_tokens: The output token limit of an answer.
+        """
+        self.langchain_client = LangChainClient(llm_vendor=vendor, model_name=model_name, api_key=api_key, max_tokens=max_tokens)
+    
+    def _prepare_prompt(self, documents: List[Dict], prompt: Optional[str] = None, doc_context: Optional[str] = None) -> Tuple[str, Optional[str], str]:
+        """
+        Returns the prompt template and system prompt (the default ones if no prompt is given) and the
+        enumerated document context (doc_context if it was already built).
         """
-        self.langchain_client = LangChainClient(llm_vendor=vendor, model_name=model_name, api_key=api_key)
+        if prompt is None:
+            prompt, system_prompt = RESPONSE_PROMPT, RESPONSE_SYSTEM_PROMPT
+        else:
+            system_prompt = None
+        
+        return prompt, system_prompt, doc_context if doc_context is not None else self.document_context(documents)
+
+    @staticmethod
+    def document_context(documents: List[Dict]) -> str:
+        """
+        Returns the documents as one string, enumerated with the indexes used by the citations.
+        """
+        # Prepare the document context as a single string, enumerating each document with an index.
+        doc_context_lines = []
+        for i, doc in enumerate(documents, start=1):
+            # Assuming each document has 'content', 'document_name', 'page_number', and 'file_link'
+            doc_line = (
+                f"[{i}] Document Name: {doc.get('document_name', 'N/A')}, "
+                f"Page: {doc.get('page_number', 'N/A')}, "
+                f"Link: {doc.get('document_url', 'N/A')}\n"
+                f"Content: {doc.get('content', '')}"
+            )
+            doc_context_lines.append(doc_line)
+        return "\n\n".join(doc_context_lines)
     
-    async def generate_response(self, query: str, documents: List[Dict], prompt: Optional[str] = None) -> str:
+    async def generate_response(self, query: str, documents: List[Dict], prompt: Optional[str] = None, doc_context: Optional[str] = None) -> str:
         """
         Generates a response based on the query and provided documents.
         
@@ -35,59 +131,60 @@ class ResponseGeneratorService:
                 - document_name
                 - page_number
                 - file_link
-          - prompt: Optional custom prompt template. If not provided, a default prompt is used.
+          - prompt: Optional custom prompt template. If not provided, the default system prompt and prompt are used.
+          - doc_context: Optional; document_context(documents) when the caller has already built it.
         
         Returns:
           - A string containing the generated answer with inline references and a references section.
         """
-        if prompt is None:
-            prompt = (
-                "# Expert Response Generation Task\n\n"
-                "## Context and Role\n"
-                "You are an expert AI assistant tasked with providing accurate, concise answers based solely on the provided documents. Your response must be fully grounded in these documents with no external knowledge or speculation.\n\n"
-                "## Documents\n"
-                "{documents}\n\n"
-                "## User Query\n"
-                "{query}\n\n"
-                "## Response Requirements\n"
-                "1. Provide a clear, direct answer to the query based only on the provided documents\n"
-                "2. Use inline citations in the format [1], [2], etc. after each sentence or claim\n"
-                "3. If multiple documents support a claim, include all relevant citations: [1][3]\n"
-                "4. If information is not found in the documents, state this clearly rather than speculating\n"
-                "5. Synthesize information across documents when relevant\n"
-                "6. Prioritize the most relevant information to the query\n"
-                "7. Make sure to display any list or table information in a pretty way (markdown) \n"
-                "8. Keep your answer concise and focused \n"
-                "9. Use objective, factual language\n\n"
-                "## References Section Format\n"
-                "After your answer, include a 'References:' section with each cited source listed as:\n"
-                "[#] Document: [document_name] | Page: [page_number] | Source: [file_link]\n\n"
-                "## Answer Format\n"
-                "[Your concise, well-structured answer with proper citations]\n\n"
-                "References:\n"
-                "[1] Document: [document_name] | Page: [page_number] | Source: [file_link]\n"
-                "[2] Document: [document_name] | Page: [page_number] | Source: [file_link]\n"
-                "...\n\n"
-                "## Answer:"
-            )
-        
-        # Prepare the document context as a single string, enumerating each document with an index.
-        doc_context_lines = []
-        for i, doc in enumerate(documents, start=1):
-            # Assuming each document has 'content', 'document_name', 'page_number', and 'file_link'
-            doc_line = (
-                f"[{i}] Document Name: {doc.get('document_name', 'N/A')}, "
-                f"Page: {doc.get('page_number', 'N/A')}, "
-                f"Link: {doc.get('document_url', 'N/A')}\n"
-                f"Content: {doc.get('content', '')}"
-            )
-            doc_context_lines.append(doc_line)
-        doc_context = "\n\n".join(doc_context_lines)
+        prompt, system_prompt, doc_context = self._prepare_prompt(documents, prompt, doc_context)
         
         # Use the LangChainClient's generate_response method.
         # The chain expects a list of strings for the 'documents' parameter.
-        response = await self.langchain_client.generate_response(query, [doc_context], prompt)
+        response = await self.langchain_client.generate_response(query, [doc_context], prompt, system_prompt)
         return response
-
-
     
+    async def stream_response(self, query: str, documents: List[Dict], prompt: Optional[str] = None, doc_context: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Streams the response to the query token by token, as it is generated.
+        
+        Takes the same parameters as generate_response; the concatenated tokens form the same
+        answer with inline citations and a references section.
+        """
+        prompt, system_prompt, doc_context = self._prepare_prompt(documents, prompt, doc_context)
+        async for token in self.langchain_client.stream_response(query, [doc_context], prompt, system_prompt):
+            yield token
+    
+    async def rewrite_sentences(self, query: str, documents: List[Dict], response: str, sentences: List[str], prompt: Optional[str] = None,
+                                doc_context: Optional[str] = None) -> List[Optional[str]]:
+        """
+        Rewrites the given sentences of a response so that they are supported by the documents,
+        instead of generating the whole response again.
+        
+        Parameters:
+          - query: The user's query.
+          - documents: The documents the response was generated from (same order, so citations keep their numbers).
+          - response: The full response, given to the LLM for context.
+          - sentences: The sentences to rewrite.
+          - prompt: Optional custom prompt template. If not provided, the default system prompt and prompt are used.
+          - doc_context: Optional; the document context the response was generated with, reused instead of rebuilt.
+        
+        Returns:
+          - The rewritten sentence (with inline citations) for each input sentence, or None when it should be removed.
+        """
+        if prompt is None:
+            prompt, system_prompt = REPAIR_PROMPT, REPAIR_SYSTEM_PROMPT
+        else:
+            system_prompt = None
+        
+        if doc_context is None:
+            doc_context = self.document_context(documents)
+        result = await self.langchain_client.repair_response(query, [doc_context], response, sentences, prompt, system_prompt)
+        # A sentence that is missing from the output is removed, like an explicit REMOVE.
+        rewrites: List[Optional[str]] = [None] * len(sentences)
+        for line in result.splitlines():
+            match = re.match(r"^\s*(\d+)[.)]\s*(.*\S)\s*$", line)
+            if match and 1 <= int(match.group(1)) <= len(sentences):
+                text = match.group(2)
+                rewrites[int(match.group(1)) - 1] = None if text.strip("*` ").upper() == "REMOVE" else text
+        return rewrites
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from services.grounding_scorer import SentenceScore, aggregate, CITATION_PATTERN, REFERENCES_PATTERN
+from services.hallucination_checker import HallucinationCheckService
+from services.response_generator import ResponseGeneratorService
+from utils.metrics import Metrics
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sentences whose local support (0-1) is below this are rewritten or removed.
+RESPONSE_REPAIR_MIN_SUPPORT = float(os.getenv("RESPONSE_REPAIR_MIN_SUPPORT", 0.5))
+# Rewrite rounds, and the time they may take together, before the unsupported sentences are simply removed.
+RESPONSE_REPAIR_MAX_ATTEMPTS = int(os.getenv("RESPONSE_REPAIR_MAX_ATTEMPTS", 2))
+RESPONSE_REPAIR_BUDGET_SECONDS = float(os.getenv("RESPONSE_REPAIR_BUDGET_SECONDS", 8))
+
+# Returned when no sentence of the answer survives the repair.
+UNSUPPORTED_RESPONSE = "Sorry, I could not find this information in the documents."
+
+# Punctuation and citations that close a sentence in the response.
+SENTENCE_TAIL = r"(?:\s*\[\d+\]|[.!?:;,)\"'*_])*"
+# Markdown list items left empty once their sentence is removed.
+EMPTY_LIST_ITEM = re.compile(r"^[ \t]*(?:[-*+>]|\d+[.)])[ \t]*\n", re.MULTILINE)
+# An entry of the references section: "[2] Document: ... | Page: ... | Source: ...".
+REFERENCE_LINE = re.compile(r"^[ \t]*(?:[-*+][ \t]*)?\[(\d+)\].*(?:\n|$)", re.MULTILINE)
+
+
+def sentence_span(response: str, sentence: str) -> Optional[Tuple[int, int]]:
+    """
+    Locates a scored sentence (citations stripped) in the response, with its punctuation and citations.
+    """
+    words = re.findall(r"\w+", sentence)
+    if not words:
+        return None
+    pattern = r"\b" + r"(?:\[\d+\]|\W)+".join(re.escape(word) for word in words) + SENTENCE_TAIL
+    match = re.search(pattern, response)
+    return match.span() if match else None
+
+
+def prune_references(response: str) -> str:
+    """
+    Drops the entries of the references section that the answer no longer cites, and the
+    section itself when no entry is left.
+    """
+    match = REFERENCES_PATTERN.search(response)
+    if match is None:
+        return response
+    body, references = response[:match.start()], response[match.start():]
+    cited = {int(n) for n in CITATION_PATTERN.findall(body)}
+    references = REFERENCE_LINE.sub(lambda line: line.group(0) if int(line.group(1)) in cited else "", references)
+    if not REFERENCE_LINE.search(references):
+        return body.rstrip() + "\n"
+    return body + references
+
+
+def replace_sentences(response: str, replacements: Dict[str, Optional[str]]) -> str:
+    """
+    Replaces sentences of the response by their rewrite, or removes them when the rewrite is None.
+    Sentences that cannot be located are left unchanged. References that are no longer cited are dropped.
+    """
+    spans = []
+    for sentence, rewrite in replacements.items():
+        span = sentence_span(response, sentence)
+        if span is None:
+            logger.warning("Sentence to repair not found in the response: %r", sentence)
+            continue
+        spans.append((span, rewrite))
+    for (start, end), rewrite in sorted(spans, reverse=True):
+        if rewrite is None:
+            while end < len(response) and response[end] in " \t":
+                end += 1
+        response = response[:start] + (rewrite or "") + response[end:]
+    return prune_references(EMPTY_LIST_ITEM.sub("", response))
+
+
+class ResponseRepairService:
+    """
+    Repairs a response that failed the hallucination check by rewriting only its unsupported
+    sentences (and removing those the documents cannot support), instead of generating the
+    whole response again.
+
+    Each round rewrites the sentences whose local support is below RESPONSE_REPAIR_MIN_SUPPORT and
+    checks the repaired response again. After RESPONSE_REPAIR_MAX_ATTEMPTS rounds, or once
+    RESPONSE_REPAIR_BUDGET_SECONDS have passed, the sentences that are still unsupported are removed.
+
+    Parameters:
+      - response_generator: The ResponseGeneratorService that generated the response.
+      - hallucination_checker: The HallucinationCheckService that scored it.
+    """
+
+    def __init__(self, response_generator: ResponseGeneratorService, hallucination_checker: HallucinationCheckService):
+        self.response_generator = response_generator
+        self.hallucination_checker = hallucination_checker
+
+    async def repair(self, query: str, documents: List[Dict], response: str, sentence_scores: List[SentenceScore],
+                     threshold: float, doc_context: Optional[str] = None) -> Tuple[str, Optional[float]]:
+        """
+        Returns the repaired response and its consistency score. doc_context is the document context
+        the response was generated with (see ResponseGeneratorService.document_context), reused for the rewrites.
+
+        Without sentence scores to act on (no local scorer, or no sentence below RESPONSE_REPAIR_MIN_SUPPORT),
+        the response is generated again in full and returned with a None score, as it has not been checked.
+        """
+        if doc_context is None:
+            doc_context = self.response_generator.document_context(documents)
+        if not any(score.support < RESPONSE_REPAIR_MIN_SUPPORT for score in sentence_scores):
+            Metrics.incr("response_repair_full_regenerations")
+            return await self.response_generator.generate_response(query, documents, doc_context=doc_context), None
+
+        context = [doc.get("content", "") for doc in documents]
+        deadline = time.monotonic() + RESPONSE_REPAIR_BUDGET_SECONDS
+        for _ in range(RESPONSE_REPAIR_MAX_ATTEMPTS):
+            unsupported = [score.text for score in sentence_scores if score.support < RESPONSE_REPAIR_MIN_SUPPORT]
+            remaining = deadline - time.monotonic()
+            if not unsupported or remaining <= 0:
+                break
+            Metrics.incr("response_repair_attempts")
+            try:
+                rewrites = await asyncio.wait_for(
+                    self.response_generator.rewrite_sentences(query, documents, response, unsupported, doc_context=doc_context), remaining)
+                repaired = replace_sentences(response, dict(zip(unsupported, rewrites)))
+                score, repaired_scores = await asyncio.wait_for(
+                    self.hallucination_checker.check_sentences(query, repaired, context), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                # The unchecked rewrite is discarded, the last checked response is kept.
+                Metrics.incr("response_repair_timeouts")
+                logger.warning("Response repair ran out of its %.1fs budget.", RESPONSE_REPAIR_BUDGET_SECONDS)
+                break
+            response, sentence_scores = repaired, repaired_scores
+            if score >= threshold:
+                Metrics.incr("response_repair_successes")
+                return response, score
+            if not sentence_scores:
+                # Local scoring failed, so no sentence can be targeted: the LLM verdict is final.
+                return response, score
+
+        # Out of attempts or time: keep only the supported sentences.
+        Metrics.incr("response_repair_removals")
+        response = replace_sentences(response, {score.text: None for score in sentence_scores if score.support < RESPONSE_REPAIR_MIN_SUPPORT})
+        supported = [score for score in sentence_scores if score.support >= RESPONSE_REPAIR_MIN_SUPPORT]
+        if not supported:
+            return UNSUPPORTED_RESPONSE, None
+        return response, aggregate(supported)
@@ -0,0 +1,150 @@
+import datetime
+import json
+import os
+import time
+from typing import Dict, List, Optional
+import redis
+from utils.lru_cache import LRUCache
+from utils.redis_client import RedisClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of recent turns kept in a session summary.
+SESSION_CACHE_TURNS = int(os.getenv("SESSION_CACHE_TURNS", 3))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", 24 * 3600))
+# In-process layer in front of Redis. Other workers may see an append or a deletion this much later.
+SESSION_LOCAL_CACHE_TTL_SECONDS = float(os.getenv("SESSION_LOCAL_CACHE_TTL_SECONDS", 2))
+SESSION_LOCAL_CACHE_SIZE = int(os.getenv("SESSION_LOCAL_CACHE_SIZE", 10000))
+
+EPOCH = datetime.datetime(1970, 1, 1)
+DELETED_VERSION = 2 ** 62
+
+
+def session_version(updated_at: datetime.datetime) -> int:
+    """
+    The version of a session snapshot: its updated_at in epoch milliseconds (Mongo's precision).
+    """
+    return int((updated_at - EPOCH).total_seconds() * 1000)
+
+
+class SessionCache:
+    """
+    Compact session summaries (owner and the last SESSION_CACHE_TURNS turns) cached in Redis,
+    with a short-lived in-process layer in front. SessionService reads through it.
+
+    A summary is two keys: a hash 'session:{id}' with user_id, version and complete, and a list
+    'session:{id}:turns' of JSON turns. Every write is a WATCH/MULTI transaction that compares
+    versions (the session's updated_at), so a summary filled from an older Mongo read never
+    replaces a newer one. An append on a session that is not cached leaves an incomplete marker
+    with the new version, which makes a concurrent fill from before the append fail.
+    """
+
+    def __init__(self, turns: int = SESSION_CACHE_TURNS):
+        self.turns = turns
+        self._local = LRUCache(SESSION_LOCAL_CACHE_SIZE)
+
+    @staticmethod
+    def _keys(session_id: str):
+        return f"session:{session_id}", f"session:{session_id}:turns"
+
+    @staticmethod
+    def _turn(entry: Dict) -> str:
+        return json.dumps({"reformulated_query": entry.get("reformulated_query", ""), "response": entry.get("response", "")})
+
+    # In-process layer (event loop thread only)
+
+    def get_local(self, session_id: str) -> Optional[Dict]:
+        local = self._local.get(session_id)
+        if local is not None and local[0] > time.monotonic():
+            return local[1]
+        return None
+
+    def remember(self, session_id: str, summary: Dict) -> None:
+        self._local.set(session_id, (time.monotonic() + SESSION_LOCAL_CACHE_TTL_SECONDS, summary))
+
+    def forget(self, session_id: str) -> None:
+        self._local.pop(session_id)
+
+    # Redis layer
+
+    async def fetch(self, session_id: str) -> Optional[Dict]:
+        """
+        Returns {"user_id", "recent_history"} for a session cached in Redis, or None on a miss.
+        """
+        meta_key, turns_key = self._keys(session_id)
+        async with RedisClient.get_client().pipeline(transaction=False) as pipe:
+            pipe.hgetall(meta_key)
+            pipe.lrange(turns_key, 0, -1)
+            meta, turns = await pipe.execute()
+        if meta.get("complete") != "1":
+            return None
+        return {"user_id": json.loads(meta["user_id"]), "recent_history": [json.loads(turn) for turn in turns]}
+
+    async def _transaction(self, session_id: str, write) -> None:
+        meta_key, turns_key = self._keys(session_id)
+        async with RedisClient.get_client().pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(meta_key)
+                    await write(pipe, await pipe.hgetall(meta_key), meta_key, turns_key)
+                    return
+                except redis.WatchError:
+                    continue
+
+    async def store(self, session_id: str, user_id, recent_history: List[Dict], updated_at: datetime.datetime) -> None:
+        """
+        Stores a summary read from Mongo, unless Redis already holds a newer version.
+        """
+        version = session_version(updated_at)
+        turns = [self._turn(entry) for entry in recent_history[-self.turns:]]
+
+        async def write(pipe, meta, meta_key, turns_key):
+            if int(meta.get("version", -1)) > version:
+                await pipe.reset()
+                return
+            pipe.multi()
+            pipe.delete(turns_key)
+            if turns:
+                pipe.rpush(turns_key, *turns)
+            pipe.hset(meta_key, mapping={"user_id": json.dumps(user_id), "version": version, "complete": 1})
+            pipe.expire(meta_key, SESSION_CACHE_TTL_SECONDS)
+            pipe.expire(turns_key, SESSION_CACHE_TTL_SECONDS)
+            await pipe.execute()
+
+        await self._transaction(session_id, write)
+
+    async def push(self, session_id: str, entries: List[Dict], updated_at: datetime.datetime) -> None:
+        """
+        Appends turns that were just written to Mongo (RPUSH + LTRIM in one transaction).
+        """
+        version = session_version(updated_at)
+        turns = [self._turn(entry) for entry in entries]
+
+        async def write(pipe, meta, meta_key, turns_key):
+            complete = meta.get("complete") == "1" and int(meta.get("version", -1)) <= version
+            pipe.multi()
+            if complete:
+                pipe.rpush(turns_key, *turns)
+                pipe.ltrim(turns_key, -self.turns, -1)
+                pipe.expire(turns_key, SESSION_CACHE_TTL_SECONDS)
+                pipe.hset(meta_key, "version", version)
+            else:
+                pipe.delete(turns_key)
+                pipe.hset(meta_key, mapping={"version": max(version, int(meta.get("version", -1))), "complete": 0})
+            pipe.expire(meta_key, SESSION_CACHE_TTL_SECONDS)
+            await pipe.execute()
+
+        await self._transaction(session_id, write)
+
+    async def delete(self, session_id: str) -> None:
+        """
+        Replaces the summary with a tombstone that outranks any version, so a fill from a read
+        made before the deletion cannot bring the session back.
+        """
+        meta_key, turns_key = self._keys(session_id)
+        async with RedisClient.get_client().pipeline() as pipe:
+            pipe.delete(meta_key, turns_key)
+            pipe.hset(meta_key, mapping={"version": DELETED_VERSION, "complete": 0})
+            pipe.expire(meta_key, SESSION_CACHE_TTL_SECONDS)
+            await pipe.execute()
@@ -1,11 +1,47 @@
 import datetime
+import hashlib
+import logging
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from bson import ObjectId  
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from services.session_cache import SessionCache, SESSION_CACHE_TURNS
 from utils.mongodb_client import MongoDBClient
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class InvalidCursorError(ValueError):
+    """
+    Raised for a pagination cursor that was not returned by this service (malformed or tampered with).
+    """
+
+
+def parse_cursor(cursor: str) -> Tuple[str, ObjectId]:
+    """
+    Splits a '{sort key}_{ObjectId}' pagination cursor into its sort key and ObjectId.
+    Raises InvalidCursorError if the cursor is malformed.
+    """
+    key, separator, object_id = cursor.rpartition("_")
+    if not separator or not key or not ObjectId.is_valid(object_id):
+        raise InvalidCursorError(f"Invalid cursor: {cursor!r}")
+    return key, ObjectId(object_id)
+
+
+def parse_cursor_timestamp(key: str) -> datetime.datetime:
+    """
+    Parses the ISO timestamp sort key of a cursor. Raises InvalidCursorError if it is malformed.
+    """
+    try:
+        return datetime.datetime.fromisoformat(key)
+    except ValueError:
+        raise InvalidCursorError(f"Invalid cursor timestamp: {key!r}") from None
+
 
 class SessionService:
     """
@@ -14,32 +50,87 @@ class SessionService:
       - _id: The unique session id (automatically generated by MongoDB)
       - user_id: The id of the user owning the session
       - title: A human-friendly title to be displayed in the UI
-      - history: A list of JSON objects, where each object includes:
+      - recent_history: The last RECENT_HISTORY_SIZE history entries, each including:
           * query: The user's query
           * response: The system's response
           * sources: A list of sources associated with the response
           * timestamp: The timestamp when this history entry was added
       - created_at: The timestamp of session creation
       - updated_at: The timestamp of the last update
+
+    The full history is stored in a separate collection, one document per entry with a
+    session_id field, indexed by (session_id, timestamp). Sessions created before this
+    layout keep their entries in an embedded 'history' array until their history is first
+    read, when the entries are moved into the history collection (see migrate_legacy_history).
     """
 
     COLLECTION_NAME = os.getenv("SESSIONS_COLLECTION_NAME")
+    HISTORY_COLLECTION_NAME = os.getenv("HISTORY_COLLECTION_NAME", "session_history")
+    # Number of entries kept on the session document for building short-term memory.
+    RECENT_HISTORY_SIZE = int(os.getenv("RECENT_HISTORY_SIZE", 10))
+    _indexes_ready = False
+    cache = SessionCache()
 
     @classmethod
     async def get_collection(cls):
         """
-        Returns the sessions collection from the database.
+        Returns the sessions collection from the database, creating the indexes on first use.
+        """
+        collection = await MongoDBClient.get_collection(cls.COLLECTION_NAME)
+        if not cls._indexes_ready:
+            await cls.ensure_indexes()
+        return collection
+
+    @classmethod
+    async def get_history_collection(cls):
+        """
+        Returns the history collection, creating the indexes on first use.
+        """
+        collection = await MongoDBClient.get_collection(cls.HISTORY_COLLECTION_NAME)
+        if not cls._indexes_ready:
+            await cls.ensure_indexes()
+        return collection
+
+    @classmethod
+    async def ensure_indexes(cls) -> None:
         """
-        return await MongoDBClient.get_collection(cls.COLLECTION_NAME)
+        Creates the indexes used by the session queries (a no-op if they already exist).
+        """
+        sessions = await MongoDBClient.get_collection(cls.COLLECTION_NAME)
+        await sessions.create_index([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)])
+        history = await MongoDBClient.get_collection(cls.HISTORY_COLLECTION_NAME)
+        await history.create_index([("session_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+        cls._indexes_ready = True
 
     @classmethod
-    async def get_sessions_for_user(cls, user_id: str) -> List[Dict]:
+    async def get_sessions_for_user(cls, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
         """
-        Retrieves all sessions associated with a given user_id.
+        Retrieves one page of the sessions of a given user_id, most recently updated first.
+        Only _id, user_id, title and updated_at are returned.
+
+        The returned cursor fetches the next page and is None on the last page.
+        Raises InvalidCursorError for a malformed cursor.
         """
+        query = {"user_id": user_id}
+        if cursor:
+            updated_at, session_id = parse_cursor(cursor)
+            updated_at = parse_cursor_timestamp(updated_at)
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$lt": session_id}},
+            ]
         collection = await cls.get_collection()
-        sessions = await collection.find({"user_id": user_id}).to_list(length=None)
-        return sessions
+        sessions = await (
+            collection.find(query, {"user_id": 1, "title": 1, "updated_at": 1})
+            .sort([("updated_at", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = f"{sessions[-1]['updated_at'].isoformat()}_{sessions[-1]['_id']}"
+        return sessions, next_cursor
 
     @classmethod
     async def get_session_by_id(cls, session_id: str) -> Optional[Dict]:
@@ -50,6 +141,137 @@ class SessionService:
         session = await collection.find_one({"_id": ObjectId(session_id)})
         return session
 
+    @classmethod
+    async def session_exists(cls, session_id: str) -> bool:
+        collection = await cls.get_collection()
+        return await collection.find_one({"_id": ObjectId(session_id)}, {"_id": 1}) is not None
+
+    @classmethod
+    async def get_session_context(cls, session_id: str, turns: int = 3) -> Optional[Dict]:
+        """
+        Retrieves a session with only its last `turns` history entries, for building short-term memory.
+        The entries are returned under 'recent_history', oldest first.
+        """
+        collection = await cls.get_collection()
+        session = await collection.find_one(
+            {"_id": ObjectId(session_id)},
+            {
+                "user_id": 1,
+                "updated_at": 1,
+                "recent_history": {"$slice": -turns},
+                # Sessions created before the history collection existed.
+                "history": {"$slice": -turns},
+            },
+        )
+        if session is not None and not session.get("recent_history"):
+            session["recent_history"] = session.get("history", [])
+        if session is not None:
+            session.pop("history", None)
+        return session
+
+    @classmethod
+    async def get_session_summary(cls, session_id: str) -> Optional[Dict]:
+        """
+        Returns the owner and the last SESSION_CACHE_TURNS turns of a session, or None if it does not exist.
+        Reads through the session cache (in-process, then Redis) before falling back to MongoDB.
+        """
+        summary = cls.cache.get_local(session_id)
+        if summary is not None:
+            return summary
+        try:
+            summary = await cls.cache.fetch(session_id)
+        except Exception as e:
+            logger.warning("Session cache lookup failed: %s", e)
+        if summary is None:
+            session = await cls.get_session_context(session_id, turns=SESSION_CACHE_TURNS)
+            if session is None:
+                return None
+            summary = {"user_id": session["user_id"], "recent_history": session["recent_history"]}
+            if session.get("updated_at") is not None:
+                try:
+                    await cls.cache.store(session_id, session["user_id"], session["recent_history"], session["updated_at"])
+                except Exception as e:
+                    logger.warning("Session cache write failed: %s", e)
+        cls.cache.remember(session_id, summary)
+        return summary
+
+    @classmethod
+    async def get_history_page(cls, session_id: str, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of a session's history, paging backwards from the newest entry.
+
+        The entries of a page are ordered oldest first. The returned cursor fetches the next (older)
+        page and is None when there is nothing older. Raises InvalidCursorError for a malformed cursor.
+        """
+        query = {"session_id": ObjectId(session_id)}
+        if cursor:
+            timestamp, entry_id = parse_cursor(cursor)
+            # Timestamps are stored as ISO strings, so the key is validated but compared as a string.
+            parse_cursor_timestamp(timestamp)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": entry_id}},
+            ]
+        else:
+            await cls.migrate_legacy_history(session_id)
+        collection = await cls.get_history_collection()
+        entries = await (
+            collection.find(query, {"session_id": 0})
+            .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+            .to_list(length=limit + 1)
+        )
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = f"{entries[-1]['timestamp']}_{entries[-1]['_id']}"
+        for entry in entries:
+            entry.pop("_id")
+        entries.reverse()
+        return entries, next_cursor
+
+    @classmethod
+    async def migrate_legacy_history(cls, session_id: str) -> bool:
+        """
+        Moves the embedded 'history' array of a session created before the history collection
+        into that collection, so it is paged together with the newer entries. Returns True if
+        the session had a legacy history.
+
+        The entries get _ids derived from the session id and their position, so concurrent or
+        retried migrations insert each entry once. The last entries also seed recent_history
+        if the session has not recorded any new turn yet.
+        """
+        collection = await cls.get_collection()
+        session = await collection.find_one({"_id": ObjectId(session_id), "history": {"$exists": True}}, {"history": 1})
+        if session is None:
+            return False
+        prefix = hashlib.sha1(str(session_id).encode("utf-8")).digest()[:9]
+        entries = [
+            {**entry, "_id": ObjectId(prefix + position.to_bytes(3, "big"))}
+            for position, entry in enumerate(session.get("history") or [])
+        ]
+        if entries:
+            history = await cls.get_history_collection()
+            try:
+                await history.bulk_write(
+                    [InsertOne({**entry, "session_id": ObjectId(session_id)}) for entry in entries],
+                    ordered=False,
+                )
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                    raise
+        recent = entries[-cls.RECENT_HISTORY_SIZE:]
+        await collection.update_one(
+            {"_id": ObjectId(session_id), "history": {"$exists": True}},
+            [
+                {"$set": {"recent_history": {"$cond": [
+                    {"$gt": [{"$size": {"$ifNull": ["$recent_history", []]}}, 0]}, "$recent_history", {"$literal": recent},
+                ]}}},
+                {"$unset": "history"},
+            ],
+        )
+        return True
+
     @classmethod
     async def create_session(cls, user_id: str, title: Optional[str]="New Chat") -> Dict:
         """
@@ -59,7 +281,7 @@ class SessionService:
         session = {
             "user_id": user_id,
             "title": title,
-            "history": [],
+            "recent_history": [],
             "created_at": datetime.datetime.utcnow(),
             "updated_at": datetime.datetime.utcnow()
         }
@@ -72,17 +294,63 @@ class SessionService:
         """
         Appends a new entry to the session's history.
         The history_entry should include keys like 'query', 'response', 'sources', and 'timestamp'.
+        The entry is stored in the history collection and in the session's capped recent_history.
         Returns True if the update was successful.
         """
+        return await cls.append_history([(session_id, history_entry)]) > 0
+
+    @classmethod
+    async def append_history(cls, items: List[Tuple[str, Dict]]) -> int:
+        """
+        Appends several (session_id, history_entry) pairs with one bulk write per collection.
+        Returns the number of sessions updated.
+
+        Every entry gets its _id before it is written, so the call can be retried after a failure:
+        history documents that were already inserted are skipped, and a session's recent_history
+        is only pushed to if it does not contain the entries yet.
+        """
+        if not items:
+            return 0
+        by_session: Dict[str, List[Dict]] = {}
+        for session_id, history_entry in items:
+            history_entry.setdefault("_id", ObjectId())
+            by_session.setdefault(session_id, []).append(history_entry)
+
+        history = await cls.get_history_collection()
+        try:
+            await history.bulk_write(
+                [InsertOne({**entry, "session_id": ObjectId(session_id)}) for session_id, entry in items],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                raise
+
         collection = await cls.get_collection()
-        result = await collection.update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {"history": history_entry},
-                "$set": {"updated_at": datetime.datetime.utcnow()}
-            }
+        now = datetime.datetime.utcnow()
+        # Truncated to Mongo's millisecond precision, so it matches the stored updated_at exactly.
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        result = await collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": ObjectId(session_id), "recent_history._id": {"$nin": [entry["_id"] for entry in entries]}},
+                    {
+                        "$push": {"recent_history": {"$each": entries, "$slice": -cls.RECENT_HISTORY_SIZE}},
+                        "$set": {"updated_at": now}
+                    }
+                )
+                for session_id, entries in by_session.items()
+            ],
+            ordered=False,
         )
-        return result.modified_count > 0
+
+        for session_id, entries in by_session.items():
+            cls.cache.forget(session_id)
+            try:
+                await cls.cache.push(session_id, entries, now)
+            except Exception as e:
+                logger.warning("Session cache append failed: %s", e)
+        return result.modified_count
 
     @classmethod
     async def delete_session(cls, session_id: str) -> bool:
@@ -92,4 +360,11 @@ class SessionService:
         """
         collection = await cls.get_collection()
         result = await collection.delete_one({"_id": ObjectId(session_id)})
+        cls.cache.forget(session_id)
+        try:
+            await cls.cache.delete(session_id)
+        except Exception as e:
+            logger.warning("Session cache invalidation failed: %s", e)
+        history = await cls.get_history_collection()
+        await history.delete_many({"session_id": ObjectId(session_id)})
         return result.deleted_count > 0
@@ -0,0 +1,164 @@
+import threading
+import time
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+
+# Rows reserved when a group's matrix is first created; capacity doubles when full.
+INITIAL_CAPACITY = 1024
+
+
+class GroupEmbeddingMatrix:
+    """
+    Embeddings of one group kept as rows of a single contiguous, L2-normalized float32 matrix.
+
+    A lookup is one matrix-vector product over the live rows followed by an argpartition
+    for the top-k. Removing a row moves the last row into its slot, so the live rows
+    always stay packed at the top of the matrix.
+    """
+
+    def __init__(self, dim: int, initial_capacity: int = INITIAL_CAPACITY):
+        self.dim = dim
+        self.size = 0
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._expires_at = np.full(initial_capacity, np.inf, dtype=np.float64)
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+
+    def _grow(self) -> None:
+        capacity = self._matrix.shape[0] * 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self.size] = self._matrix[:self.size]
+        expires_at = np.full(capacity, np.inf, dtype=np.float64)
+        expires_at[:self.size] = self._expires_at[:self.size]
+        self._matrix, self._expires_at = matrix, expires_at
+
+    def add(self, key: str, vector: np.ndarray, expires_at: float = np.inf) -> None:
+        """
+        Appends a normalized row for the key, replacing any previous row with the same key.
+        """
+        if key in self._rows:
+            self.remove(key)
+        if self.size == self._matrix.shape[0]:
+            self._grow()
+        self._matrix[self.size] = vector
+        self._expires_at[self.size] = expires_at
+        self._keys.append(key)
+        self._rows[key] = self.size
+        self.size += 1
+
+    def remove(self, key: str) -> bool:
+        """
+        Removes the key's row by moving the last row into its place.
+        """
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        last = self.size - 1
+        if row != last:
+            moved_key = self._keys[last]
+            self._matrix[row] = self._matrix[last]
+            self._expires_at[row] = self._expires_at[last]
+            self._keys[row] = moved_key
+            self._rows[moved_key] = row
+        self._keys.pop()
+        self._expires_at[last] = np.inf
+        self.size = last
+        return True
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Returns the stored (normalized) row of the key, or None.
+        """
+        row = self._rows.get(key)
+        return self._matrix[row] if row is not None else None
+
+    def purge_expired(self, now: float) -> List[str]:
+        """
+        Removes all rows whose expiry time has passed and returns their keys.
+        """
+        expired = [self._keys[row] for row in np.flatnonzero(self._expires_at[:self.size] <= now)]
+        for key in expired:
+            self.remove(key)
+        return expired
+
+    def top_k(self, query: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """
+        Returns the k (key, cosine similarity) pairs closest to the normalized query, best first.
+        """
+        if self.size == 0 or k <= 0:
+            return []
+        scores = self._matrix[:self.size] @ query
+        k = min(k, self.size)
+        if k < self.size:
+            candidates = np.argpartition(scores, -k)[-k:]
+        else:
+            candidates = np.arange(self.size)
+        best = candidates[np.argsort(-scores[candidates])]
+        return [(self._keys[row], float(scores[row])) for row in best]
+
+
+class SimilarityEngine:
+    """
+    Cosine similarity search over per-group embedding matrices.
+
+    Vectors are normalized once on insert, so a lookup never re-normalizes stored rows.
+    Safe to call from worker threads. Backs the in-process indexes (the "memory" semantic
+    cache backend and the intent exemplars); the Redis semantic cache searches with HNSW instead.
+    """
+
+    def __init__(self, initial_capacity: int = INITIAL_CAPACITY):
+        self.initial_capacity = initial_capacity
+        self._groups: Dict[str, GroupEmbeddingMatrix] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(embedding) -> Optional[np.ndarray]:
+        """
+        Returns the embedding as a unit-length float32 vector, or None for a zero vector.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def add(self, group: str, key: str, embedding, ttl_seconds: Optional[float] = None) -> None:
+        """
+        Adds the embedding under the key. Raises ValueError for a zero vector, which could never match.
+        """
+        vector = self.normalize(embedding)
+        if vector is None:
+            raise ValueError(f"Cannot index a zero-norm embedding (key {key!r}).")
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else np.inf
+        with self._lock:
+            matrix = self._groups.get(group)
+            if matrix is None:
+                matrix = self._groups[group] = GroupEmbeddingMatrix(vector.shape[0], self.initial_capacity)
+            matrix.add(key, vector, expires_at)
+
+    def remove(self, group: str, key: str) -> bool:
+        with self._lock:
+            matrix = self._groups.get(group)
+            return matrix.remove(key) if matrix is not None else False
+
+    def purge_expired(self, group: str) -> List[str]:
+        with self._lock:
+            matrix = self._groups.get(group)
+            return matrix.purge_expired(time.monotonic()) if matrix is not None else []
+
+    def search(self, group: str, embedding, k: int = 1) -> List[Tuple[str, float]]:
+        """
+        Returns up to k (key, cosine similarity) pairs from the group, best first.
+        """
+        query = self.normalize(embedding)
+        if query is None:
+            return []
+        with self._lock:
+            matrix = self._groups.get(group)
+            if matrix is None:
+                return []
+            return matrix.top_k(query, k)
+
+    def size(self, group: str) -> int:
+        matrix = self._groups.get(group)
+        return matrix.size if matrix is not None else 0
@@ -1,13 +1,46 @@
 import os
 import time
-from typing import List, Dict, Tuple
+from abc import ABC, abstractmethod
+from typing import List, Dict, Tuple, Optional
 from utils.mongodb_client import MongoDBClient
 from dotenv import load_dotenv
 load_dotenv()
 
-class VectorSearchService:
+# Which vector store serves the search: "atlas" (MongoDB Atlas $vectorSearch), "pgvector",
+# or "local" (in-process index built from the Atlas chunk collection).
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "atlas")
+
+
+class VectorStore(ABC):
+    """
+    Interface implemented by the vector store backends of VectorSearchService.
+
+    search is abstract, so a backend that does not implement it cannot be instantiated;
+    warmup and close default to no-ops.
+    """
+
+    @abstractmethod
+    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3, **options) -> Tuple[List[Dict], float]:
+        """
+        Returns the closest chunks readable by the authorization filter (group id) and the
+        execution time in milliseconds. Each chunk has the keys content, document_name,
+        document_url, document_type, page_number, group_id, file_link and score.
+        """
+
+    async def warmup(self) -> None:
+        """
+        Opens connections and loads whatever the store needs before serving its first search.
+        """
+
+    async def close(self) -> None:
+        """
+        Releases the store's connections and background tasks.
+        """
+
+
+class AtlasVectorStore(VectorStore):
     """
-    Service for performing vector search on documents stored in MongoDB.
+    Vector store performing vector search on documents stored in MongoDB Atlas.
     
     The documents are expected to have the following fields:
       - chunk: Text content of the document chunk.
@@ -26,7 +59,7 @@ class VectorSearchService:
         self.vector_index_name = os.getenv("VECTOR_INDEX_NAME")
         
 
-    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3) -> Tuple[List[Dict], float]:
+    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3, **options) -> Tuple[List[Dict], float]:
         """
         Perform a vector search using the $vectorSearch stage with an authorization filter.
         Returns a tuple containing the search results and the execution time in milliseconds.
@@ -39,6 +72,10 @@ class VectorSearchService:
           - file_link (text for grounding)
           - score (vector search score)
         """
+        # MongoDB expects the query vector as a list of numbers.
+        if hasattr(query_embedding, "tolist"):
+            query_embedding = query_embedding.tolist()
+
         # Retrieve the collection asynchronously
         collection = await MongoDBClient.get_collection(self.collection_name)
 
@@ -64,6 +101,7 @@ class VectorSearchService:
                     "page_number": 1,
                     "group_id": 1,
                     "file_link": 1,
+                    "score": {"$meta": "vectorSearchScore"},
                     "_id": 0
                 }
             }
@@ -78,3 +116,44 @@ class VectorSearchService:
 
         duration_ms = (end_time - start_time) * 1000 
         return results, duration_ms
+
+
+class VectorSearchService:
+    """
+    Service for performing vector search over the document chunks.
+
+    Delegates to the configured VectorStore backend, so callers get the same
+    search(query_embedding, authorization_filter, limit) contract whichever store is used.
+    """
+
+    def __init__(self, backend: Optional[str] = None):
+        """
+        Parameters:
+          - backend: "atlas", "pgvector" or "local". Defaults to the VECTOR_STORE_BACKEND environment variable.
+        """
+        self.backend = (backend or VECTOR_STORE_BACKEND).lower()
+        if self.backend == "atlas":
+            self.store = AtlasVectorStore()
+        elif self.backend == "pgvector":
+            from services.pgvector_store import PgVectorStore
+            self.store = PgVectorStore()
+        elif self.backend == "local":
+            from services.local_vector_index import LocalVectorStore
+            self.store = LocalVectorStore()
+        else:
+            raise ValueError(f"Unsupported vector store backend: {backend}")
+
+    async def search(self, query_embedding: List[float], authorization_filter: str, limit: int = 3, **options) -> Tuple[List[Dict], float]:
+        """
+        Perform a vector search restricted to the authorization filter (group id).
+        Returns a tuple containing the search results and the execution time in milliseconds.
+
+        Backend specific options (e.g. ef_search for pgvector) are passed through as keyword arguments.
+        """
+        return await self.store.search(query_embedding, authorization_filter, limit, **options)
+
+    async def warmup(self) -> None:
+        await self.store.warmup()
+
+    async def close(self) -> None:
+        await self.store.close()
@@ -0,0 +1,88 @@
+from services.context_packer import ContextPacker, CONTEXT_DOCUMENT_OVERHEAD_TOKENS
+from utils.token_counter import TokenCounter
+
+# Counts are exact with the tiktoken encoding and approximate without it, so the assertions only
+# compare counts made by the same counter. It is shared so the encoding is loaded once.
+TOKEN_COUNTER = TokenCounter()
+
+RELEVANT = "A SEPA transfer settles within one business day."
+FILLER = [
+    "The branch in Lyon opened in 1998 with twelve employees.",
+    "Our mascot is a blue heron named Pierre.",
+    "Quarterly reports are printed on recycled paper.",
+    "The cafeteria serves vegetarian dishes on Fridays.",
+]
+
+
+def packer(max_input_tokens: int = 3000, max_document_tokens: int = 800) -> ContextPacker:
+    context_packer = ContextPacker(max_input_tokens=max_input_tokens, max_document_tokens=max_document_tokens)
+    context_packer.token_counter = TOKEN_COUNTER
+    return context_packer
+
+
+def chunk(content: str, name: str = "sepa.pdf", page: int = 4) -> dict:
+    return {"content": content, "document_name": name, "page_number": page, "document_url": "x"}
+
+
+# Merge
+
+def test_chunks_of_the_same_page_are_merged_without_repeating_sentences():
+    documents = [
+        chunk("Transfers are sent in euros. They settle within one day."),
+        chunk("Other bank, other page.", name="fees.pdf"),
+        chunk("They settle within one day. Fees are shared."),
+    ]
+    merged = packer().merge_duplicates(documents)
+    assert [doc["content"] for doc in merged] == [
+        "Transfers are sent in euros. They settle within one day. Fees are shared.",
+        "Other bank, other page.",
+    ]
+    assert documents[0]["content"] == "Transfers are sent in euros. They settle within one day."
+
+
+def test_documents_without_page_metadata_are_never_merged():
+    documents = [{"content": "Same text."}, {"content": "Same text."}]
+    assert packer().merge_duplicates(documents) == documents
+
+
+# Trim
+
+def test_short_content_is_not_trimmed():
+    content = " ".join(FILLER)
+    assert packer().trim("sepa transfer", content, TOKEN_COUNTER.count(content)) == content
+
+
+def test_trim_keeps_the_relevant_sentences_in_order():
+    content = " ".join([FILLER[0], RELEVANT, FILLER[1], "Transfer fees for SEPA are shared.", FILLER[2]])
+    max_tokens = TOKEN_COUNTER.count(RELEVANT) + TOKEN_COUNTER.count("Transfer fees for SEPA are shared.") + 2
+    trimmed = packer().trim("How long does a SEPA transfer take?", content, max_tokens)
+    assert trimmed == RELEVANT + " Transfer fees for SEPA are shared."
+
+
+def test_trim_cuts_the_most_relevant_sentence_when_none_fits():
+    content = " ".join([FILLER[0], RELEVANT, FILLER[1]])
+    trimmed = packer().trim("How long does a SEPA transfer take?", content, 3)
+    assert RELEVANT.startswith(trimmed)
+    assert 0 < TOKEN_COUNTER.count(trimmed) <= 3
+
+
+# Budget
+
+def test_pack_stays_within_the_budget_and_drops_the_remaining_documents():
+    documents = [chunk(" ".join(FILLER * 5), page=page) for page in range(5)]
+    context_packer = packer(max_input_tokens=200, max_document_tokens=100)
+    packed, stats = context_packer.pack("sepa transfer", documents)
+    overhead = sum(TOKEN_COUNTER.count(f"{doc['document_name']} {doc['page_number']} {doc['document_url']}")
+                   + CONTEXT_DOCUMENT_OVERHEAD_TOKENS for doc in packed)
+    assert 0 < stats.documents_out < stats.documents_in == 5
+    assert all(TOKEN_COUNTER.count(doc["content"]) <= 100 for doc in packed)
+    assert stats.tokens_out + overhead <= stats.budget == 200
+    assert stats.tokens_in == sum(TOKEN_COUNTER.count(doc["content"]) for doc in documents)
+    assert [doc["page_number"] for doc in packed] == list(range(stats.documents_out))
+
+
+def test_pack_keeps_documents_that_fit_unchanged():
+    documents = [chunk(RELEVANT), chunk(FILLER[0], page=5)]
+    packed, stats = packer().pack("sepa transfer", documents)
+    assert packed == documents and packed[0] is not documents[0]
+    assert stats.tokens_in == stats.tokens_out
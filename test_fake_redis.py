@@ -0,0 +1,139 @@
+import os
+
+# The Redis backend is chosen at import time, so it has to be set before the services are imported.
+os.environ["REDIS_BACKEND"] = "fake"
+
+import asyncio
+import datetime
+import pytest
+from services.cache_index import InMemoryCacheIndex
+from services.cache_service import CacheService
+from services.session_cache import SessionCache, DELETED_VERSION
+from utils.redis_client import RedisClient
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    # Each test runs its own event loop, so it gets fresh clients on a fresh fake server.
+    RedisClient._clients, RedisClient._pools, RedisClient._fake_server = {}, {}, None
+    yield
+    RedisClient._clients, RedisClient._pools, RedisClient._fake_server = {}, {}, None
+
+
+def at(minute: int) -> datetime.datetime:
+    return datetime.datetime(2025, 1, 1, 12, minute)
+
+
+def turn(n: int) -> dict:
+    return {"reformulated_query": f"query {n}", "response": f"response {n}"}
+
+
+# Semantic cache
+
+def test_cache_service_uses_in_memory_index_on_fake_redis():
+    assert isinstance(CacheService().index, InMemoryCacheIndex)
+    assert isinstance(CacheService(backend="redis").index, InMemoryCacheIndex)
+
+
+def test_cache_hit_and_miss():
+    async def scenario():
+        cache = CacheService()
+        await cache.insert_cache("u1", "group", "what is a chargeback?", "An answer.", [], [1.0, 0.0, 0.0], "doc1")
+        hits = await cache.get_similar_cache_entries("group", [0.99, 0.05, 0.0], threshold=95.0)
+        misses = await cache.get_similar_cache_entries("group", [0.0, 1.0, 0.0], threshold=95.0)
+        return hits, misses
+
+    hits, misses = asyncio.run(scenario())
+    assert len(hits) == 1
+    assert hits[0][0]["response"] == "An answer."
+    assert hits[0][1] >= 95.0
+    assert misses == []
+
+
+def test_cache_entries_do_not_leak_across_groups():
+    async def scenario():
+        cache = CacheService()
+        await cache.insert_cache("u1", "a:b", "query", "answer of a:b", [], [1.0, 0.0], "doc1")
+        return await cache.get_similar_cache_entries("a", [1.0, 0.0], threshold=0.0)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_cache_delete_by_document_id():
+    async def scenario():
+        cache = CacheService()
+        await cache.insert_cache("u1", "group", "query", "answer", [], [1.0, 0.0], "doc1,doc2")
+        await cache.delete_cache_by_document_id("doc2")
+        return await cache.get_similar_cache_entries("group", [1.0, 0.0], threshold=0.0)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_cache_rejects_zero_norm_embedding():
+    async def scenario():
+        cache = CacheService()
+        with pytest.raises(ValueError):
+            await cache.insert_cache("u1", "group", "query", "answer", [], [0.0, 0.0], "doc1")
+        return cache.index._entries
+
+    assert asyncio.run(scenario()) == {}
+
+
+# Session cache
+
+def test_session_cache_store_and_fetch():
+    async def scenario():
+        cache = SessionCache(turns=2)
+        await cache.store("s1", 7, [turn(1), turn(2), turn(3)], at(0))
+        return await cache.fetch("s1")
+
+    summary = asyncio.run(scenario())
+    assert summary == {"user_id": 7, "recent_history": [turn(2), turn(3)]}
+
+
+def test_session_cache_push_appends_and_trims():
+    async def scenario():
+        cache = SessionCache(turns=2)
+        await cache.store("s1", 7, [turn(1), turn(2)], at(0))
+        await cache.push("s1", [turn(3)], at(1))
+        return await cache.fetch("s1")
+
+    assert asyncio.run(scenario())["recent_history"] == [turn(2), turn(3)]
+
+
+def test_session_cache_keeps_newer_version():
+    async def scenario():
+        cache = SessionCache(turns=2)
+        await cache.store("s1", 7, [turn(2)], at(5))
+        # A fill from a Mongo read made before the last write must not replace the newer summary.
+        await cache.store("s1", 7, [turn(1)], at(0))
+        return await cache.fetch("s1")
+
+    assert asyncio.run(scenario())["recent_history"] == [turn(2)]
+
+
+def test_session_cache_push_on_uncached_session_blocks_older_fill():
+    async def scenario():
+        cache = SessionCache(turns=2)
+        await cache.push("s1", [turn(2)], at(5))
+        missing = await cache.fetch("s1")
+        await cache.store("s1", 7, [turn(1)], at(0))
+        return missing, await cache.fetch("s1")
+
+    missing, after_stale_fill = asyncio.run(scenario())
+    assert missing is None
+    assert after_stale_fill is None
+
+
+def test_session_cache_delete_leaves_tombstone():
+    async def scenario():
+        cache = SessionCache(turns=2)
+        await cache.store("s1", 7, [turn(1)], at(0))
+        await cache.delete("s1")
+        await cache.store("s1", 7, [turn(1)], at(1))
+        meta = await RedisClient.get_client().hgetall("session:s1")
+        return await cache.fetch("s1"), meta
+
+    summary, meta = asyncio.run(scenario())
+    assert summary is None
+    assert int(meta["version"]) == DELETED_VERSION
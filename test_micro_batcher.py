@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from utils.micro_batcher import MicroBatcher
+
+
+class RecordingHandler:
+    """
+    Batch handler that records every batch it receives and doubles each item.
+    """
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return [item * 2 for item in items]
+
+
+def test_concurrent_submissions_are_coalesced():
+    handler = RecordingHandler()
+
+    async def scenario():
+        batcher = MicroBatcher(handler, max_batch_size=10, max_wait_ms=20)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+
+    assert asyncio.run(scenario()) == [0, 2, 4, 6]
+    assert handler.batches == [[0, 1, 2, 3]]
+
+
+def test_full_batch_is_flushed_without_waiting():
+    handler = RecordingHandler()
+
+    async def scenario():
+        # The wait is far longer than the test, so only the size limit can flush the batches.
+        batcher = MicroBatcher(handler, max_batch_size=2, max_wait_ms=60_000)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), 1)
+
+    assert asyncio.run(scenario()) == [0, 2, 4, 6]
+    assert handler.batches == [[0, 1], [2, 3]]
+
+
+def test_submissions_after_the_window_go_in_a_new_batch():
+    handler = RecordingHandler()
+
+    async def scenario():
+        batcher = MicroBatcher(handler, max_batch_size=10, max_wait_ms=5)
+        first = await batcher.submit(1)
+        second = await batcher.submit(2)
+        return first, second
+
+    assert asyncio.run(scenario()) == (2, 4)
+    assert handler.batches == [[1], [2]]
+
+
+def test_handler_error_reaches_every_caller_of_the_batch():
+    handler = RecordingHandler(error=RuntimeError("vendor unavailable"))
+
+    async def scenario():
+        batcher = MicroBatcher(handler, max_batch_size=10, max_wait_ms=5)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(handler.batches) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_caller_is_dropped_from_the_batch():
+    handler = RecordingHandler()
+
+    async def scenario():
+        batcher = MicroBatcher(handler, max_batch_size=10, max_wait_ms=20)
+        abandoned = asyncio.ensure_future(batcher.submit(1))
+        kept = asyncio.ensure_future(batcher.submit(2))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        return await kept
+
+    assert asyncio.run(scenario()) == 4
+    assert handler.batches == [[2]]
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from services.reranker import Reranker
+
+torch = pytest.importorskip("torch")
+
+RELEVANT = ("How long does a SEPA transfer take?", "A SEPA credit transfer is settled within one business day.")
+IRRELEVANT = ("How long does a SEPA transfer take?", "Preheat the oven to 200 degrees and bake the bread for 40 minutes.")
+
+
+class FakeCrossEncoder:
+    """
+    Mimics CrossEncoder.predict of a single-label model: the logit goes through the caller's
+    activation, or through the model's default activation when none is given.
+    """
+
+    def __init__(self, default_activation):
+        self.default_activation = default_activation
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=None, activation_fct=None):
+        logits = torch.tensor([8.0 if pair == RELEVANT else -8.0 for pair in pairs])
+        activation = activation_fct if activation_fct is not None else self.default_activation
+        return activation(logits).numpy()
+
+
+def local_reranker(client=None) -> Reranker:
+    reranker = Reranker("local")
+    reranker.client = client
+    return reranker
+
+
+@pytest.mark.parametrize("default_activation", [torch.nn.Identity(), torch.nn.Sigmoid()])
+def test_local_scores_are_squashed_once(default_activation):
+    reranker = local_reranker(FakeCrossEncoder(default_activation))
+    relevant, irrelevant = reranker._score_pairs([RELEVANT, IRRELEVANT])
+    assert relevant > 0.99
+    assert irrelevant < 0.01
+
+
+def test_local_rerank_orders_by_relevance():
+    async def scenario():
+        reranker = local_reranker(FakeCrossEncoder(torch.nn.Identity()))
+        return await reranker.rerank(RELEVANT[0], [IRRELEVANT[1], RELEVANT[1]])
+
+    ranking = asyncio.run(scenario())
+    assert [result["index"] for result in ranking] == [1, 0]
+    assert "fallback" not in ranking[0]
+
+
+def test_fallback_ranking_is_flagged():
+    ranking = Reranker.fallback_ranking(["a", "b", "c"], [0.2, 0.9, 0.5], top_n=2)
+    assert [result["index"] for result in ranking] == [1, 2]
+    assert all(result["fallback"] for result in ranking)
+
+
+def test_default_model_scores_straddle_the_relevance_cutoff():
+    pytest.importorskip("sentence_transformers")
+    reranker = local_reranker()
+    try:
+        relevant, irrelevant = reranker._score_pairs([RELEVANT, IRRELEVANT])
+    except OSError as e:
+        pytest.skip(f"Cross-encoder model not available: {e}")
+    # retrieve() keeps documents scoring at least 0.4.
+    assert relevant >= 0.4 > irrelevant
@@ -0,0 +1,132 @@
+import asyncio
+from services.grounding_scorer import SentenceScore, aggregate, answer_sentences
+from services.response_repair import ResponseRepairService, UNSUPPORTED_RESPONSE, prune_references, replace_sentences
+
+REFERENCES = "References:\n[1] Document: sepa.pdf | Page: 4 | Source: x\n[2] Document: fees.pdf | Page: 9 | Source: y"
+RESPONSE = ("SEPA transfers are supported within one business day [1]. "
+            "Instant transfers are free for everyone [2].\n\n" + REFERENCES)
+DOCUMENTS = [{"content": "SEPA transfers settle within one business day."}]
+
+
+def scores_of(response: str):
+    sentences = answer_sentences(response)
+    return [SentenceScore(claim, citations, 1.0 if "supported" in claim else 0.0) for claim, citations in sentences]
+
+
+class FakeGenerator:
+    """
+    Stand-in for ResponseGeneratorService: rewrites each sentence with the next rewrite from a list,
+    and records the calls it receives.
+    """
+
+    def __init__(self, rewrites=None):
+        self.rewrites = list(rewrites or [])
+        self.rewrite_calls = []
+        self.generated = 0
+
+    def document_context(self, documents):
+        return "context"
+
+    async def rewrite_sentences(self, query, documents, response, sentences, doc_context=None):
+        self.rewrite_calls.append(list(sentences))
+        return [self.rewrites.pop(0) for _ in sentences]
+
+    async def generate_response(self, query, documents, doc_context=None):
+        self.generated += 1
+        return "A fresh response."
+
+
+class KeywordChecker:
+    """
+    Stand-in for HallucinationCheckService: a sentence is supported when it mentions "supported".
+    """
+
+    async def check_sentences(self, query, response, context):
+        sentence_scores = scores_of(response)
+        return aggregate(sentence_scores), sentence_scores
+
+
+# Sentence replacement
+
+def test_replace_sentence_keeps_citations_and_references():
+    repaired = replace_sentences(RESPONSE, {"Instant transfers are free for everyone.": "Instant transfers cost 0.50 EUR [2]."})
+    assert repaired.startswith("SEPA transfers are supported within one business day [1]. Instant transfers cost 0.50 EUR [2].\n")
+    assert repaired.endswith(REFERENCES)
+
+
+def test_removed_sentence_drops_its_reference():
+    repaired = replace_sentences(RESPONSE, {"Instant transfers are free for everyone.": None})
+    assert repaired == ("SEPA transfers are supported within one business day [1]. \n\n"
+                        "References:\n[1] Document: sepa.pdf | Page: 4 | Source: x\n")
+
+
+def test_removed_list_item_leaves_no_empty_bullet():
+    response = "Fees:\n- Transfers are free.\n- Cards cost 2 EUR.\n"
+    assert replace_sentences(response, {"Cards cost 2 EUR.": None}) == "Fees:\n- Transfers are free.\n"
+
+
+def test_sentence_not_found_is_left_unchanged():
+    assert replace_sentences(RESPONSE, {"Something the answer never said.": None}) == RESPONSE
+
+
+# Reference pruning
+
+def test_references_section_is_dropped_when_nothing_is_cited():
+    assert prune_references("An answer without citations.\n\n" + REFERENCES) == "An answer without citations.\n"
+
+
+def test_response_without_references_is_unchanged():
+    assert prune_references("An answer [1].") == "An answer [1]."
+
+
+# Repair
+
+def test_repair_rewrites_only_the_unsupported_sentence():
+    generator = FakeGenerator(rewrites=["Instant transfers are supported for a 0.50 EUR fee [2]."])
+
+    async def scenario():
+        service = ResponseRepairService(generator, KeywordChecker())
+        return await service.repair("query", DOCUMENTS, RESPONSE, scores_of(RESPONSE), threshold=80)
+
+    response, score = asyncio.run(scenario())
+    assert generator.rewrite_calls == [["Instant transfers are free for everyone."]]
+    assert "Instant transfers are supported for a 0.50 EUR fee [2]." in response
+    assert response.endswith(REFERENCES)
+    assert score == 100.0
+
+
+def test_repair_removes_sentences_that_stay_unsupported():
+    generator = FakeGenerator(rewrites=["Instant transfers are free [2].", "Instant transfers are free for all [2]."])
+
+    async def scenario():
+        service = ResponseRepairService(generator, KeywordChecker())
+        return await service.repair("query", DOCUMENTS, RESPONSE, scores_of(RESPONSE), threshold=80)
+
+    response, score = asyncio.run(scenario())
+    assert len(generator.rewrite_calls) == 2
+    assert "Instant" not in response and "[2]" not in response
+    assert response.startswith("SEPA transfers are supported within one business day [1].")
+    assert score == 100.0
+
+
+def test_repair_without_any_supported_sentence_gives_up():
+    response = "Instant transfers are free for everyone."
+    generator = FakeGenerator(rewrites=["Instant transfers never cost anything.", "Instant transfers are always free of charge."])
+
+    async def scenario():
+        service = ResponseRepairService(generator, KeywordChecker())
+        return await service.repair("query", DOCUMENTS, response, scores_of(response), threshold=80)
+
+    assert asyncio.run(scenario()) == (UNSUPPORTED_RESPONSE, None)
+
+
+def test_repair_without_sentence_scores_regenerates_the_response():
+    generator = FakeGenerator()
+
+    async def scenario():
+        service = ResponseRepairService(generator, KeywordChecker())
+        return await service.repair("query", DOCUMENTS, RESPONSE, [], threshold=80)
+
+    assert asyncio.run(scenario()) == ("A fresh response.", None)
+    assert generator.generated == 1
+    assert generator.rewrite_calls == []
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import pytest
+from utils.stage_graph import StageGraph
+
+
+async def value(result, delay: float = 0.0):
+    await asyncio.sleep(delay)
+    return result
+
+
+def test_stages_receive_dependency_results_in_declared_order():
+    async def scenario():
+        graph = StageGraph()
+        graph.add("a", lambda: value("a"))
+        graph.add("b", lambda: value("b"))
+        graph.add("joined", lambda b, a: value(b + a), deps=["b", "a"])
+        graph.start()
+        try:
+            return await graph.result("joined")
+        finally:
+            graph.cancel_all()
+
+    assert asyncio.run(scenario()) == "ba"
+
+
+def test_independent_stages_overlap():
+    async def scenario():
+        graph = StageGraph()
+        graph.add("root", lambda: value(None))
+        graph.add("cache", lambda _: value("cache", 0.1), deps=["root"])
+        graph.add("search", lambda _: value("search", 0.1), deps=["root"])
+        start = time.perf_counter()
+        graph.start()
+        results = await asyncio.gather(graph.result("cache"), graph.result("search"))
+        return results, time.perf_counter() - start, graph.timings
+
+    results, elapsed, timings = asyncio.run(scenario())
+    assert results == ["cache", "search"]
+    assert elapsed < 0.18
+    assert timings["cache"] >= 90 and timings["search"] >= 90
+
+
+def test_cancelling_a_speculative_stage_cancels_its_dependents():
+    started = []
+
+    async def search(_):
+        started.append("search")
+        await asyncio.sleep(10)
+
+    async def scenario():
+        graph = StageGraph()
+        graph.add("embed", lambda: value("embedding"))
+        graph.add("search", search, deps=["embed"])
+        graph.add("rerank", lambda results: value(results), deps=["search"])
+        graph.start()
+        await graph.result("embed")
+        await asyncio.sleep(0)
+        graph.cancel("search")
+        with pytest.raises(asyncio.CancelledError):
+            await graph.result("search")
+        with pytest.raises(asyncio.CancelledError):
+            await graph.result("rerank")
+        graph.cancel_all()
+
+    asyncio.run(scenario())
+    assert started == ["search"]
+
+
+def test_a_failing_stage_fails_its_dependents():
+    async def fail():
+        raise RuntimeError("session store down")
+
+    async def scenario():
+        graph = StageGraph()
+        graph.add("session", fail)
+        graph.add("reformulate", lambda session: value(session), deps=["session"])
+        graph.start()
+        try:
+            with pytest.raises(RuntimeError, match="session store down"):
+                await graph.result("reformulate")
+        finally:
+            graph.cancel_all()
+
+    asyncio.run(scenario())
+
+
+def test_cancel_all_stops_unfinished_stages():
+    async def scenario():
+        graph = StageGraph()
+        graph.add("slow", lambda: value("slow", 10))
+        graph.start()
+        await asyncio.sleep(0)
+        graph.cancel_all()
+        with pytest.raises(asyncio.CancelledError):
+            await graph.result("slow")
+
+    asyncio.run(scenario())
+
+
+def test_unknown_dependency_is_rejected():
+    graph = StageGraph()
+    with pytest.raises(ValueError):
+        graph.add("search", lambda embedding: value(embedding), deps=["embed"])
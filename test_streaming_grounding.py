@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from services.grounding_scorer import StreamingGrounding, SentenceScore, answer_sentences
+
+
+class KeywordScorer:
+    """
+    Stand-in for GroundingScorer: a sentence is supported when it mentions "supported".
+    Records the batches it scores.
+    """
+
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def score_sentences(self, sentences, context):
+        self.batches.append([claim for claim, _ in sentences])
+        await asyncio.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return [SentenceScore(claim, citations, 1.0 if "supported" in claim else 0.0) for claim, citations in sentences]
+
+
+async def feed_and_settle(check: StreamingGrounding, tokens):
+    for token in tokens:
+        check.feed(token)
+        await asyncio.sleep(0.03)
+
+
+def test_sentences_are_scored_as_they_complete():
+    async def scenario():
+        scorer = KeywordScorer()
+        check = StreamingGrounding(scorer, ["doc"])
+        await feed_and_settle(check, ["This claim is well supported [1]. ", "And this sentence is"])
+        scored_during_generation = [score.text for score in check.sentence_scores]
+        check.feed(" also supported here.")
+        score, sentence_scores = await check.finish()
+        return scored_during_generation, score, sentence_scores
+
+    during, score, sentence_scores = asyncio.run(scenario())
+    assert during == ["This claim is well supported."]
+    assert score == 100.0
+    assert [s.citations for s in sentence_scores] == [[1], []]
+
+
+def test_poorly_grounded_answer_is_aborted_early():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(), ["doc"], abort_below=50)
+        await feed_and_settle(check, ["The moon is made of cheese. ", "Banks pay ten percent interest daily. ", "Then"])
+        return check.aborted
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_no_abort_before_the_minimum_number_of_sentences():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(), ["doc"], abort_below=50)
+        await feed_and_settle(check, ["The moon is made of cheese. ", "Still going"])
+        aborted = check.aborted
+        check.close()
+        return aborted
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_well_grounded_answer_is_not_aborted():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(), ["doc"], abort_below=50)
+        await feed_and_settle(check, ["This claim is well supported. ", "That one is supported too. "])
+        aborted = check.aborted
+        check.close()
+        return aborted
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_finish_scores_the_whole_answer_even_after_a_late_abort():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(), ["doc"], abort_below=50)
+        await feed_and_settle(check, ["The moon is made of cheese. ", "Banks pay ten percent interest daily. ", "Then"])
+        aborted_before_finish = check.aborted
+        check.feed(" this last claim is supported.")
+        score, sentence_scores = await check.finish()
+        return aborted_before_finish, check.aborted, len(sentence_scores)
+
+    aborted_before_finish, aborted_after_finish, scored = asyncio.run(scenario())
+    assert aborted_before_finish is True
+    assert aborted_after_finish is False
+    assert scored == 3
+
+
+def test_end_generation_disables_the_abort():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(), ["doc"], abort_below=50)
+        check.feed("The moon is made of cheese. Banks pay ten percent interest daily. Then")
+        check.end_generation()
+        await asyncio.sleep(0.05)
+        aborted = check.aborted
+        check.close()
+        return aborted
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_finish_raises_the_scoring_error():
+    async def scenario():
+        check = StreamingGrounding(KeywordScorer(error=RuntimeError("model unavailable")), ["doc"])
+        check.feed("This claim is well supported. ")
+        with pytest.raises(RuntimeError, match="model unavailable"):
+            await check.finish()
+
+    asyncio.run(scenario())
+
+
+def test_references_section_is_not_scored():
+    response = "Transfers settle within one business day [1].\n\nReferences:\n[1] Document: sepa.pdf | Page: 4 | Source: x"
+    assert answer_sentences(response) == [("Transfers settle within one business day.", [1])]
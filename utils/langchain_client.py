@@ -1,86 +1,182 @@
-from typing import List
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from typing import List, Dict, AsyncIterator, Optional
+import hashlib
+import json
+import logging
+import os
+import time
+from langchain_core.messages import SystemMessage
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.runnables import Runnable
+from utils.llm_registry import LLMRegistry
+from utils.lru_cache import LRUCache
+from utils.metrics import Metrics
+from utils.redis_client import RedisClient
+from utils.text_normalization import normalize_text
+
+# Compiled chains kept per client, keyed by prompt template.
+LANGCHAIN_CHAIN_CACHE_SIZE = int(os.getenv("LANGCHAIN_CHAIN_CACHE_SIZE", 128))
+# Memoized LLM outputs: entries kept per worker, and how long they stay in Redis (0 disables the Redis tier).
+LLM_MEMO_CACHE_SIZE = int(os.getenv("LLM_MEMO_CACHE_SIZE", 10000))
+LLM_MEMO_TTL_SECONDS = int(os.getenv("LLM_MEMO_TTL_SECONDS", 24 * 3600))
+# Default output token limit of a completion.
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1000))
+
+logger = logging.getLogger(__name__)
 
 class LangChainClient:
     """
     A client to interact with different LLM vendors using LangChain as an orchestrator.
     It supports hallucination checks, document relevancy checks, intent classification, 
     response generation, and query reformulation.
+
+    The chain for a prompt (prompt template | llm) is compiled once and reused; the variables of
+    each call are passed as an input dict when the chain is invoked.
+
+    A prompt may come with a system prompt: static instructions sent as a system message ahead of
+    the variable part, so that vendors can cache the prompt prefix across requests. The token
+    usage of every call (including the cached input tokens) is reported per method in Metrics.
+
+    Intent classification and reformulation without history are memoized: the output is cached
+    (in-process LRU, then Redis) under a hash of the model, the prompt and the normalized inputs.
     """
-    def __init__(self, llm_vendor: str, model_name: str, api_key: str , temperature: float = 0.01, max_tokens: int  = 1000):
+    def __init__(self, llm_vendor: str, model_name: str, api_key: str , temperature: float = 0.01, max_tokens: int = LLM_MAX_TOKENS):
         """
         Initializes the LangChainClient with a specific LLM vendor and model.
         """
-        if llm_vendor.lower() == "openai":
-            self.llm = ChatOpenAI(model_name=model_name, api_key=api_key,temperature=temperature, max_tokens = max_tokens)
-        else:
-            raise ValueError(f"Unsupported LLM vendor: {llm_vendor}")
+        # Shared with every other client using the same settings (see LLMRegistry).
+        self.llm = LLMRegistry.get_llm(llm_vendor, model_name, api_key, temperature, max_tokens)
+        self._chains = LRUCache(LANGCHAIN_CHAIN_CACHE_SIZE)
+        self._memo = LRUCache(LLM_MEMO_CACHE_SIZE)
     
-    async def generate_response(self, query: str, documents: List[str], prompt: str) -> str:
+    def _chain(self, prompt: str, system_prompt: Optional[str] = None) -> Runnable:
+        """
+        Returns the compiled chain for the prompt template (and system prompt), building it on first use.
+        """
+        chain = self._chains.get((system_prompt, prompt))
+        if chain is None:
+            if system_prompt is None:
+                template = PromptTemplate.from_template(prompt)
+            else:
+                # A message instance is sent verbatim, so the system prompt is not parsed as a template.
+                template = ChatPromptTemplate.from_messages([SystemMessage(content=system_prompt), ("human", prompt)])
+            chain = template | self.llm
+            self._chains.set((system_prompt, prompt), chain)
+        return chain
+
+    @staticmethod
+    def _record_usage(name: str, usage: Optional[UsageMetadata]) -> None:
+        """
+        Adds the token usage of a call to the llm_<name>_* counters. Cached tokens are the input
+        tokens the vendor served from its prompt cache.
+        """
+        Metrics.incr(f"llm_{name}_calls")
+        if not usage:
+            return
+        Metrics.incr(f"llm_{name}_input_tokens", usage.get("input_tokens", 0))
+        Metrics.incr(f"llm_{name}_cached_tokens", (usage.get("input_token_details") or {}).get("cache_read", 0))
+        Metrics.incr(f"llm_{name}_output_tokens", usage.get("output_tokens", 0))
+
+    async def _invoke(self, name: str, prompt: str, inputs: Dict[str, str], system_prompt: Optional[str] = None) -> str:
+        """
+        Invokes the prompt's chain and returns the text of the reply, recording its latency and token usage.
+        """
+        start_time = time.perf_counter()
+        message = await self._chain(prompt, system_prompt).ainvoke(inputs)
+        Metrics.observe(f"llm_{name}", (time.perf_counter() - start_time) * 1000)
+        self._record_usage(name, message.usage_metadata)
+        return message.content
+
+    async def _stream(self, name: str, prompt: str, inputs: Dict[str, str], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Streams the text of the reply, recording the time to the first token and the token usage
+        (also when the consumer stops early).
+        """
+        start_time = time.perf_counter()
+        usage = None
+        first = True
+        try:
+            async for chunk in self._chain(prompt, system_prompt).astream(inputs):
+                if chunk.usage_metadata:
+                    usage = add_usage(usage, chunk.usage_metadata)
+                if chunk.content:
+                    if first:
+                        Metrics.observe(f"llm_{name}_first_token", (time.perf_counter() - start_time) * 1000)
+                        first = False
+                    yield chunk.content
+        finally:
+            self._record_usage(name, usage)
+    
+    def _memo_key(self, prompt: str, inputs: Dict[str, str], system_prompt: Optional[str] = None) -> str:
+        normalized = {name: normalize_text(value) for name, value in inputs.items()}
+        prompt_hash = hashlib.sha256(f"{system_prompt or ''}\x00{prompt}".encode("utf-8")).hexdigest()
+        payload = json.dumps([self.llm.model_name, prompt_hash, normalized], sort_keys=True)
+        return f"llm:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    async def _memoized(self, name: str, prompt: str, inputs: Dict[str, str], system_prompt: Optional[str] = None) -> str:
+        """
+        Invokes the prompt's chain, or returns the output cached for the same model, prompts and inputs.
+        """
+        key = self._memo_key(prompt, inputs, system_prompt)
+        output = self._memo.get(key)
+        if output is not None:
+            Metrics.incr(f"llm_memo_{name}_hits_local")
+            return output
+        if LLM_MEMO_TTL_SECONDS > 0:
+            try:
+                output = await RedisClient.get_client().get(key)
+            except Exception as e:
+                logger.warning("LLM memo lookup in Redis failed: %s", e)
+            if output is not None:
+                Metrics.incr(f"llm_memo_{name}_hits_redis")
+                self._memo.set(key, output)
+                return output
+        Metrics.incr(f"llm_memo_{name}_misses")
+        output = (await self._invoke(name, prompt, inputs, system_prompt)).strip()
+        self._memo.set(key, output)
+        if LLM_MEMO_TTL_SECONDS > 0:
+            try:
+                await RedisClient.get_client().set(key, output, ex=LLM_MEMO_TTL_SECONDS)
+            except Exception as e:
+                logger.warning("LLM memo write to Redis failed: %s", e)
+        return output
+    
+    async def generate_response(self, query: str, documents: List[str], prompt: str, system_prompt: Optional[str] = None) -> str:
         """Generates a response using the LLM based on the user query and retrieved documents."""
-        prompt_template = PromptTemplate.from_template(prompt)
-        
-        chain = (
-            {"query": RunnablePassthrough(), "documents": lambda x: "\n".join(documents)}
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        response = await chain.ainvoke(query)
+        response = await self._invoke("generate_response", prompt, {"query": query, "documents": "\n".join(documents)}, system_prompt)
         return response
     
-    async def hallucination_check(self, query: str, response: str, context: List[str], prompt: str) -> bool:
+    async def stream_response(self, query: str, documents: List[str], prompt: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """Streams the response generated from the user query and retrieved documents, token by token."""
+        async for token in self._stream("stream_response", prompt, {"query": query, "documents": "\n".join(documents)}, system_prompt):
+            yield token
+    
+    async def hallucination_check(self, query: str, response: str, context: List[str], prompt: str, system_prompt: Optional[str] = None) -> str:
         """Checks if the generated response contains hallucinations by comparing it against retrieved context."""
-        prompt_template = PromptTemplate.from_template(prompt)
-        
-        chain = (
-            {
-                "query": lambda x: query, 
-                "response": lambda x: response, 
-                "context": lambda x: "\n".join(context)
-            }
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        validation_result = await chain.ainvoke({})
+        validation_result = await self._invoke("hallucination_check", prompt, {"query": query, "response": response, "context": "\n".join(context)}, system_prompt)
         return validation_result.strip()
     
-    async def classify_intent(self, query: str, prompt: str) -> str:
+    async def repair_response(self, query: str, documents: List[str], response: str, sentences: List[str], prompt: str,
+                              system_prompt: Optional[str] = None) -> str:
+        """Rewrites the given sentences of a response so that they are supported by the retrieved documents."""
+        numbered = "\n".join(f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1))
+        inputs = {"query": query, "documents": "\n".join(documents), "response": response, "sentences": numbered}
+        repaired = await self._invoke("repair_response", prompt, inputs, system_prompt)
+        return repaired.strip()
+    
+    async def classify_intent(self, query: str, prompt: str, system_prompt: Optional[str] = None) -> str:
         """Classifies the intent of the user query."""
-        prompt_template = PromptTemplate.from_template(prompt)
-        
-        chain = (
-            {"query": RunnablePassthrough()}
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        intent = await chain.ainvoke(query)
-        return intent.strip()
+        intent = await self._memoized("classify_intent", prompt, {"query": query}, system_prompt)
+        return intent
     
-    async def reformulate_query(self, query: str, short_term_memory: List[str], prompt: str) -> str:
+    async def reformulate_query(self, query: str, short_term_memory: List[str], prompt: str, system_prompt: Optional[str] = None) -> str:
         """
         Reformulates a user query based on short-term memory to improve retrieval accuracy.
         Short-term memory contains recent interactions to provide context for refinement.
         """
-        prompt_template = PromptTemplate.from_template(prompt)
-        
-        chain = (
-            {
-                "query": lambda x: query, 
-                "history": lambda x: "\n".join(short_term_memory)
-            }
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        reformulated_query = await chain.ainvoke({})
+        inputs = {"query": query, "history": "\n".join(short_term_memory)}
+        if not short_term_memory:
+            # Without history the reformulation only depends on the query, so first turns are memoized.
+            return await self._memoized("reformulate_query", prompt, inputs, system_prompt)
+        reformulated_query = await self._invoke("reformulate_query", prompt, inputs, system_prompt)
         return reformulated_query.strip()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import importlib.util
+import logging
+import os
+from typing import Dict, Tuple
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connection pool of each shared HTTP client.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", 60))
+LLM_HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+LLM_HTTP_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_TIMEOUT_SECONDS", 60))
+# HTTP/2 multiplexes concurrent requests over one connection; needs the h2 package.
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+
+class LLMRegistry:
+    """
+    Process-wide registry of chat models, shared by every LLM-backed service.
+
+    Services asking for the same (vendor, model, temperature, max_tokens) get the same model
+    object, backed by one tuned httpx.AsyncClient, so keep-alive (and, where available, HTTP/2)
+    connections to the vendor are reused across the pipeline stages.
+    """
+    _models: Dict[Tuple, object] = {}
+    _http_clients: Dict[Tuple, httpx.AsyncClient] = {}
+
+    @classmethod
+    def _create_http_client(cls) -> httpx.AsyncClient:
+        http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+        logger.info("Creating shared LLM HTTP client (http2=%s).", http2)
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT_SECONDS, connect=LLM_HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+
+    @classmethod
+    def get_llm(cls, llm_vendor: str, model_name: str, api_key: str, temperature: float, max_tokens: int):
+        """
+        Returns the shared chat model for the settings, creating it (and its HTTP client) on first use.
+        """
+        vendor = llm_vendor.lower()
+        # The API key is part of the key so that services configured with different keys never share a client.
+        key = (vendor, model_name, temperature, max_tokens, api_key)
+        if key not in cls._models:
+            if vendor == "openai":
+                from langchain_openai import ChatOpenAI
+                http_client = cls._create_http_client()
+                cls._models[key] = ChatOpenAI(
+                    model_name=model_name, api_key=api_key, temperature=temperature, max_tokens=max_tokens,
+                    http_async_client=http_client, request_timeout=LLM_HTTP_TIMEOUT_SECONDS,
+                    # Streamed replies also report their token usage (see LangChainClient).
+                    stream_usage=True,
+                )
+                cls._http_clients[key] = http_client
+            else:
+                raise ValueError(f"Unsupported LLM vendor: {llm_vendor}")
+        return cls._models[key]
+
+    @classmethod
+    async def close(cls) -> None:
+        for http_client in cls._http_clients.values():
+            await http_client.aclose()
+        cls._models, cls._http_clients = {}, {}
@@ -0,0 +1,54 @@
+import threading
+from collections import deque
+from typing import Dict
+import numpy as np
+
+# Number of recent observations kept per timing for the percentiles.
+TIMING_WINDOW = 1024
+
+
+class Metrics:
+    """
+    Process-wide registry of counters, gauges and timings, exposed at /metrics.
+
+    Values are per worker process. Timings keep a window of the most recent observations
+    and are reported as count, p50, p95 and max in milliseconds.
+    """
+    _lock = threading.Lock()
+    _counters: Dict[str, float] = {}
+    _gauges: Dict[str, float] = {}
+    _timings: Dict[str, deque] = {}
+    _timing_counts: Dict[str, int] = {}
+
+    @classmethod
+    def incr(cls, name: str, value: float = 1) -> None:
+        with cls._lock:
+            cls._counters[name] = cls._counters.get(name, 0) + value
+
+    @classmethod
+    def set_gauge(cls, name: str, value: float) -> None:
+        with cls._lock:
+            cls._gauges[name] = value
+
+    @classmethod
+    def observe(cls, name: str, milliseconds: float) -> None:
+        with cls._lock:
+            window = cls._timings.get(name)
+            if window is None:
+                window = cls._timings[name] = deque(maxlen=TIMING_WINDOW)
+            window.append(milliseconds)
+            cls._timing_counts[name] = cls._timing_counts.get(name, 0) + 1
+
+    @classmethod
+    def snapshot(cls) -> Dict:
+        with cls._lock:
+            timings = {}
+            for name, window in cls._timings.items():
+                values = np.fromiter(window, dtype=np.float64)
+                timings[name] = {
+                    "count": cls._timing_counts[name],
+                    "p50_ms": float(np.percentile(values, 50)),
+                    "p95_ms": float(np.percentile(values, 95)),
+                    "max_ms": float(values.max()),
+                }
+            return {"counters": dict(cls._counters), "gauges": dict(cls._gauges), "timings": timings}
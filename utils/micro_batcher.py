@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects items submitted concurrently and processes them in batches.
+
+    A batch is flushed once it reaches max_batch_size items or max_wait_ms after its
+    first item arrived, whichever comes first. The handler receives the list of items
+    and must return one result per item, in the same order. If the handler raises,
+    every caller of that batch gets the exception.
+
+    Usage:
+        batcher = MicroBatcher(embed_many, max_batch_size=32, max_wait_ms=5)
+        vector = await batcher.submit(text)
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_handle = None
+        # Strong references to in-flight batches so they are not garbage collected.
+        self._tasks = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Adds the item to the current batch and waits for its result.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._process(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        # Callers that gave up (timeout, cancellation) are dropped from the batch.
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            logger.warning("Micro-batch of %d items failed: %s", len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -63,6 +64,14 @@ class MongoDBClient:
         db = await cls.get_database()
         return db[collection_name]
 
+    @classmethod
+    async def warmup(cls):
+        """
+        Opens MIN_POOL_SIZE connections up front by issuing that many concurrent pings.
+        """
+        db = await cls.get_database()
+        await asyncio.gather(*(db.command("ping") for _ in range(MIN_POOL_SIZE)))
+
     @classmethod
     async def close_connection(cls):
         if cls._client:
@@ -0,0 +1,50 @@
+import os
+import logging
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Retrieve Postgres configuration from environment variables
+POSTGRES_URI = os.getenv("POSTGRES_URI")
+
+# Connection pool settings
+MAX_POOL_SIZE = int(os.getenv("POSTGRES_MAX_POOL_SIZE", 20))
+MIN_POOL_SIZE = int(os.getenv("POSTGRES_MIN_POOL_SIZE", 5))
+COMMAND_TIMEOUT_SECONDS = float(os.getenv("POSTGRES_COMMAND_TIMEOUT_SECONDS", 10))
+
+logger = logging.getLogger(__name__)
+
+class PostgresClient:
+    """Async singleton class for a Postgres connection pool using asyncpg."""
+    _pool: asyncpg.Pool = None
+
+    @classmethod
+    async def connect(cls):
+        if cls._pool is None:
+            try:
+                cls._pool = await asyncpg.create_pool(
+                    POSTGRES_URI,
+                    min_size=MIN_POOL_SIZE,
+                    max_size=MAX_POOL_SIZE,
+                    command_timeout=COMMAND_TIMEOUT_SECONDS
+                )
+                logger.info("Async Postgres connection pool established.")
+            except Exception as e:
+                logger.error("Failed to connect to Postgres: %s", e)
+                raise e
+        return cls._pool
+
+    @classmethod
+    async def get_pool(cls):
+        if cls._pool is None:
+            await cls.connect()
+        return cls._pool
+
+    @classmethod
+    async def close_connection(cls):
+        if cls._pool:
+            await cls._pool.close()
+            cls._pool = None
+            logger.info("Async Postgres connection pool closed.")
@@ -1,24 +1,140 @@
+import asyncio
+import logging
 import os
-import redis
+from typing import Dict, List, Optional
+from redis.asyncio import ConnectionPool, Redis
+from utils.metrics import Metrics
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# "redis" connects to REDIS_HOST, "fake" uses an in-process fakeredis server (tests / local runs).
+REDIS_BACKEND = os.getenv("REDIS_BACKEND", "redis")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+# Connections opened per pool at startup.
+REDIS_MIN_CONNECTIONS = int(os.getenv("REDIS_MIN_CONNECTIONS", 5))
+REDIS_SOCKET_TIMEOUT_SECONDS = float(os.getenv("REDIS_SOCKET_TIMEOUT_SECONDS", 2))
+REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_SECONDS", 2))
+# Idle connections are pinged before reuse once they have been idle this long.
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_SECONDS", 30))
+
+logger = logging.getLogger(__name__)
+
+
 class RedisClient:
     """
-    Redis client using connection pooling.
+    Async Redis client (redis.asyncio) using explicit connection pools.
     The connection details are loaded from the environment variables.
+
+    Two clients share the same settings: get_client() decodes responses to str,
+    get_binary_client() leaves values as raw bytes (for binary payloads such as float32 vectors).
     """
-    _client = None
-
-    @classmethod
-    def get_client(cls):
-        if cls._client is None:
-            cls._client = redis.Redis(
-                host=os.getenv("REDIS_HOST"),
-                port=int(os.getenv("REDIS_PORT")),
-                username=os.getenv("REDIS_USERNAME"),
-                password=os.getenv("REDIS_PASSWORD"),
-                decode_responses=True
-            )
-        return cls._client
+    _pools: Dict[bool, ConnectionPool] = {}
+    _clients: Dict[bool, Redis] = {}
+    _fake_server = None
+
+    @classmethod
+    def _create_client(cls, decode_responses: bool) -> Redis:
+        if REDIS_BACKEND == "fake":
+            import fakeredis
+            if cls._fake_server is None:
+                cls._fake_server = fakeredis.FakeServer()
+            return fakeredis.FakeAsyncRedis(server=cls._fake_server, decode_responses=decode_responses)
+        elif REDIS_BACKEND != "redis":
+            raise ValueError(f"Unsupported Redis backend: {REDIS_BACKEND}")
+        pool = ConnectionPool(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            username=os.getenv("REDIS_USERNAME"),
+            password=os.getenv("REDIS_PASSWORD"),
+            decode_responses=decode_responses,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS,
+            retry_on_timeout=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+        )
+        cls._pools[decode_responses] = pool
+        return Redis(connection_pool=pool)
+
+    @classmethod
+    def get_client(cls) -> Redis:
+        if True not in cls._clients:
+            cls._clients[True] = cls._create_client(decode_responses=True)
+        return cls._clients[True]
+
+    @classmethod
+    def get_binary_client(cls) -> Redis:
+        """
+        Returns a client that leaves values as raw bytes, for binary payloads such as float32 vectors.
+        """
+        if False not in cls._clients:
+            cls._clients[False] = cls._create_client(decode_responses=False)
+        return cls._clients[False]
+
+    @classmethod
+    async def connect(cls) -> None:
+        """
+        Creates both clients and checks the server with a PING.
+        """
+        await cls.get_client().ping()
+        await cls.get_binary_client().ping()
+        logger.info("Redis connection established (%s).", REDIS_BACKEND)
+
+    @classmethod
+    async def warmup(cls) -> None:
+        """
+        Opens REDIS_MIN_CONNECTIONS connections in each pool and returns them as idle connections.
+        """
+        await cls.connect()
+        for pool in cls._pools.values():
+            connections = await asyncio.gather(*(pool.get_connection("PING") for _ in range(REDIS_MIN_CONNECTIONS)), return_exceptions=True)
+            for connection in connections:
+                if not isinstance(connection, Exception):
+                    await pool.release(connection)
+            errors = [connection for connection in connections if isinstance(connection, Exception)]
+            if errors:
+                raise errors[0]
+
+    @classmethod
+    async def close_connection(cls) -> None:
+        for client in cls._clients.values():
+            await client.aclose()
+        for pool in cls._pools.values():
+            await pool.disconnect()
+        cls._clients, cls._pools = {}, {}
+        logger.info("Redis connection closed.")
+
+    @classmethod
+    async def mget(cls, keys: List[str], binary: bool = False) -> List[Optional[object]]:
+        """
+        Reads several keys in one round trip.
+        """
+        if not keys:
+            return []
+        client = cls.get_binary_client() if binary else cls.get_client()
+        return await client.mget(keys)
+
+    @classmethod
+    async def mset(cls, items: Dict[str, object], ex: Optional[int] = None, binary: bool = False) -> None:
+        """
+        Writes several keys, each with the same expiry, in one pipelined round trip.
+        """
+        if not items:
+            return
+        client = cls.get_binary_client() if binary else cls.get_client()
+        async with client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, ex=ex)
+            await pipe.execute()
+
+    @classmethod
+    def report_pool_metrics(cls) -> None:
+        """
+        Publishes the connection pool utilization as gauges.
+        """
+        for decode_responses, pool in cls._pools.items():
+            name = "redis_pool" if decode_responses else "redis_binary_pool"
+            Metrics.set_gauge(f"{name}_in_use", len(pool._in_use_connections))
+            Metrics.set_gauge(f"{name}_idle", len(pool._available_connections))
+            Metrics.set_gauge(f"{name}_max", pool.max_connections)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+
+async def timed(timings: Dict[str, float], name: str, awaitable: Awaitable) -> Any:
+    """
+    Awaits the awaitable and records its duration in milliseconds under timings[name].
+    """
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+class StageGraph:
+    """
+    A small dependency-aware graph of async pipeline stages.
+
+    Each stage is an async callable that receives the results of its dependencies as
+    positional arguments, in the order they were declared. Once started, every stage
+    runs as soon as its dependencies have finished, so independent stages overlap.
+    Stages can be cancelled (e.g. speculative work that turned out to be unnecessary);
+    stages depending on a cancelled or failed stage are cancelled or fail in turn.
+
+    Usage:
+        graph = StageGraph()
+        graph.add("session", fetch_session)
+        graph.add("reformulate", reformulate, deps=["session"])
+        graph.start()
+        try:
+            reformulated = await graph.result("reformulate")
+        finally:
+            graph.cancel_all()
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Duration of each finished stage in milliseconds, excluding the time spent waiting on dependencies.
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable[..., Awaitable], deps: Iterable[str] = ()) -> None:
+        """
+        Registers a stage. Dependencies must be registered before the stages that use them.
+        """
+        deps = tuple(deps)
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+        self._stages[name] = (fn, deps)
+
+    async def _run(self, name: str) -> Any:
+        fn, deps = self._stages[name]
+        args = [await self._tasks[dep] for dep in deps]
+        return await timed(self.timings, name, fn(*args))
+
+    def start(self) -> None:
+        """
+        Schedules every registered stage.
+        """
+        for name in self._stages:
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(self._run(name), name=name)
+
+    async def result(self, name: str) -> Any:
+        """
+        Waits for a stage and returns its result (or raises its exception).
+        """
+        return await self._tasks[name]
+
+    async def run_stage(self, name: str, awaitable: Awaitable) -> Any:
+        """
+        Awaits a stage that is run inline rather than through the graph, recording its timing.
+        """
+        return await timed(self.timings, name, awaitable)
+
+    def cancel(self, *names: str) -> None:
+        """
+        Cancels the given stages if they are still running.
+        """
+        for name in names:
+            task = self._tasks.get(name)
+            if task is not None and not task.done():
+                task.cancel()
+
+    def cancel_all(self) -> None:
+        """
+        Cancels every unfinished stage and marks failed results as retrieved.
+        """
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            else:
+                # Consume the exception of failed stages nobody awaited to avoid
+                # "Task exception was never retrieved" warnings.
+                if not task.cancelled():
+                    task.exception()
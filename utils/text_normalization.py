@@ -0,0 +1,9 @@
+import re
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text for cache lookups: unicode NFKC, case-folded, whitespace collapsed.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().casefold()
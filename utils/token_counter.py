@@ -0,0 +1,74 @@
+import logging
+import os
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Encoding used for models tiktoken does not know (o200k_base is the gpt-4o family encoding).
+TOKENIZER_DEFAULT_ENCODING = os.getenv("TOKENIZER_DEFAULT_ENCODING", "o200k_base")
+# Rough characters per token, only used when the encoding cannot be loaded (e.g. offline without a tiktoken cache).
+APPROXIMATE_CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in the tokens of an LLM, with the local tiktoken tokenizer.
+
+    The encoding is loaded by load(), or on first use. Loading can download the encoding file
+    (blocking, without a timeout) when it is not in the tiktoken cache, so async callers load it
+    ahead of time in a thread. If it cannot be loaded, counts fall back to an estimate of
+    APPROXIMATE_CHARS_PER_TOKEN characters per token.
+
+    Parameters:
+      - model_name: The LLM whose tokenizer is used.
+    """
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name
+        self._encoding = None
+        self._approximate = False
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the encoding has been loaded (or given up on), so counting no longer blocks on it.
+        """
+        return self._encoding is not None or self._approximate
+
+    def load(self) -> None:
+        """
+        Loads the encoding (blocking).
+        """
+        self._get_encoding()
+
+    def _get_encoding(self):
+        if self._encoding is None and not self._approximate:
+            try:
+                import tiktoken
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model_name or "")
+                except KeyError:
+                    self._encoding = tiktoken.get_encoding(TOKENIZER_DEFAULT_ENCODING)
+            except Exception as e:
+                logger.warning("Could not load the tokenizer for %s, token counts are approximate: %s", self.model_name, e)
+                self._approximate = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        encoding = self._get_encoding()
+        if encoding is None:
+            return (len(text) + APPROXIMATE_CHARS_PER_TOKEN - 1) // APPROXIMATE_CHARS_PER_TOKEN
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Returns the longest prefix of the text that fits in max_tokens.
+        """
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text[:max_tokens * APPROXIMATE_CHARS_PER_TOKEN]
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])